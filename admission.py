@@ -0,0 +1,314 @@
+# ==============================================================================
+# admission.py - Per-client rate limits and a cap on concurrent OCR calls
+# ==============================================================================
+# A client retrying in a loop can otherwise take every server thread and
+# spend the Vision quota. Requests to the parse endpoints are checked before
+# their body is read:
+#   - Content-Length above MAX_CONTENT_LENGTH -> 413
+#   - token bucket per API key (X-API-Key / Bearer) or client IP -> 429
+#   - every OCR slot busy and the wait queue full -> 503
+# OCR calls themselves hold one of OCR_MAX_CONCURRENCY slots. Buckets live in
+# process memory by default; RATE_LIMIT_REDIS_URL shares them between
+# processes/replicas through Redis (any client with eval(), e.g. redis-py).
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+
+class OverloadedError(Exception):
+    """No OCR slot became free in time"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ==============================================================================
+# TOKEN BUCKETS
+# ==============================================================================
+class MemoryBuckets:
+    """Token buckets in this process (LRU-bounded; a dropped bucket starts full again)"""
+
+    name = 'memory'
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Spend `cost` tokens; returns (allowed, seconds until enough tokens)"""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return True, 0.0
+            bucket[0] = tokens
+            return False, (cost - tokens) / rate
+
+    def size(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+# Same algorithm as MemoryBuckets, atomic inside Redis; uses the server clock
+# so replicas with skewed clocks agree. Returns {allowed, wait seconds as string}
+# (Lua numbers would be truncated to integers on the way back).
+REDIS_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared through Redis; `client` needs eval() (redis-py or a stand-in)"""
+
+    name = 'redis'
+
+    def __init__(self, client, prefix='receipt-api:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5))
+
+    def take(self, key, rate, burst, cost=1):
+        allowed, wait = self.client.eval(REDIS_TOKEN_BUCKET, 1, self.prefix + key, rate, burst, cost)
+        return bool(int(allowed)), float(wait)
+
+    def size(self):
+        return None  # not tracked locally
+
+
+class RateLimiter:
+    """Token bucket per client: `per_minute` sustained, up to `burst` at once"""
+
+    def __init__(self, per_minute=120, burst=50, backend=None):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.backend = backend or MemoryBuckets()
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited": 0, "backend_errors": 0}
+
+    @classmethod
+    def from_env(cls):
+        """RATE_LIMIT_* settings (None when disabled)"""
+        if os.environ.get('RATE_LIMIT_ENABLED', '0').lower() in ('0', 'false', 'no'):
+            return None
+        backend = None
+        redis_url = os.environ.get('RATE_LIMIT_REDIS_URL')
+        if redis_url:
+            try:
+                backend = RedisBuckets.from_url(redis_url)
+            except ImportError:
+                print("[WARN] RATE_LIMIT_REDIS_URL is set but redis is not installed; using in-process buckets")
+        return cls(
+            per_minute=float(os.environ.get('RATE_LIMIT_PER_MINUTE', 120)),
+            burst=int(os.environ.get('RATE_LIMIT_BURST', 50)),
+            backend=backend,
+        )
+
+    def acquire(self, key, cost=1):
+        """0 when allowed, else seconds to wait before retrying (fails open if the backend errors)"""
+        # A cost above the burst could never be paid; charge a full bucket instead
+        cost = min(cost, self.burst)
+        try:
+            allowed, wait = self.backend.take(key, self.rate, self.burst, cost)
+        except Exception as e:
+            print(f"[WARN] Rate limit backend error: {e}")
+            with self._lock:
+                self._counters["backend_errors"] += 1
+            return 0
+        with self._lock:
+            self._counters["allowed" if allowed else "limited"] += 1
+        return 0 if allowed else max(1, int(wait + 0.999))
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return dict(
+            counters,
+            backend=self.backend.name,
+            per_minute=self.per_minute,
+            burst=self.burst,
+            clients=self.backend.size(),
+        )
+
+
+def client_key(api_key, address):
+    """Bucket key: a digest of the API key (never the key itself), else the client address"""
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    return "ip:" + (address or 'unknown')
+
+
+# ==============================================================================
+# OCR SLOTS
+# ==============================================================================
+class ConcurrencyLimit:
+    """At most `limit` OCR calls at once; callers wait up to `timeout` for a slot.
+
+    `max_waiting` bounds the wait queue: when it is full, saturated() tells
+    the admission check to reject new requests before reading their upload.
+    """
+
+    def __init__(self, limit=6, timeout=10.0, max_waiting=None):
+        self.limit = limit
+        self.timeout = timeout
+        self.max_waiting = limit if max_waiting is None else max_waiting
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiting = 0
+        self._counters = {"acquired": 0, "timeouts": 0}
+
+    @classmethod
+    def from_env(cls):
+        """OCR_MAX_CONCURRENCY slots (0 = unlimited -> None)"""
+        limit = int(os.environ.get('OCR_MAX_CONCURRENCY', 6))
+        if limit <= 0:
+            return None
+        waiting = os.environ.get('OCR_MAX_WAITING')
+        return cls(
+            limit=limit,
+            timeout=float(os.environ.get('OCR_SLOT_TIMEOUT', 10)),
+            max_waiting=int(waiting) if waiting else None,
+        )
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Hold one slot for the duration of the block; raises OverloadedError on timeout"""
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._in_use += 1
+                self._counters["acquired"] += 1
+            else:
+                self._counters["timeouts"] += 1
+        if not acquired:
+            raise OverloadedError("Server busy, all OCR slots in use. Retry later.", retry_after=1)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def saturated(self):
+        """Every slot busy and the wait queue full"""
+        with self._lock:
+            return self._in_use >= self.limit and self._waiting >= self.max_waiting
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._counters,
+                limit=self.limit,
+                in_use=self._in_use,
+                waiting=self._waiting,
+                max_waiting=self.max_waiting,
+                timeout=self.timeout,
+            )
+
+
+class AsyncConcurrencyLimit:
+    """ConcurrencyLimit for one event loop (asgi.py): waiting calls are suspended
+    on an asyncio.Semaphore instead of holding a thread.
+
+    Sized separately from the thread-pool slots, since one process keeps far
+    more async calls in flight. Create it inside the loop that will use it.
+    """
+
+    def __init__(self, limit=256, timeout=10.0, max_waiting=None):
+        self.limit = limit
+        self.timeout = timeout
+        self.max_waiting = limit if max_waiting is None else max_waiting
+        self._slots = asyncio.Semaphore(limit)
+        # Only changed on the event loop; stats() may read them from other threads
+        self._in_use = 0
+        self._waiting = 0
+        self._counters = {"acquired": 0, "timeouts": 0}
+
+    @classmethod
+    def from_env(cls):
+        """ASGI_OCR_MAX_CONCURRENCY slots (default: VISION_ASYNC_MAX_INFLIGHT; 0 = unlimited -> None)"""
+        limit = int(os.environ.get('ASGI_OCR_MAX_CONCURRENCY') or os.environ.get('VISION_ASYNC_MAX_INFLIGHT', 256))
+        if limit <= 0:
+            return None
+        waiting = os.environ.get('ASGI_OCR_MAX_WAITING')
+        return cls(
+            limit=limit,
+            timeout=float(os.environ.get('OCR_SLOT_TIMEOUT', 10)),
+            max_waiting=int(waiting) if waiting else None,
+        )
+
+    @asynccontextmanager
+    async def slot(self, timeout=None):
+        """Hold one slot for the duration of the block; raises OverloadedError on timeout"""
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            raise OverloadedError("Server busy, all OCR slots in use. Retry later.", retry_after=1) from None
+        finally:
+            self._waiting -= 1
+        self._in_use += 1
+        self._counters["acquired"] += 1
+        try:
+            yield
+        finally:
+            self._in_use -= 1
+            self._slots.release()
+
+    def saturated(self):
+        """Every slot busy and the wait queue full"""
+        return self._in_use >= self.limit and self._waiting >= self.max_waiting
+
+    def stats(self):
+        return dict(
+            self._counters,
+            limit=self.limit,
+            in_use=self._in_use,
+            waiting=self._waiting,
+            max_waiting=self.max_waiting,
+            timeout=self.timeout,
+        )
@@ -0,0 +1,394 @@
+# ==============================================================================
+# asgi.py - Asyncio serving mode for the receipt API (Starlette + uvicorn)
+# ==============================================================================
+# Run: uvicorn asgi:app --host 0.0.0.0 --port 7860
+#
+# /parse, /scan and /health/ready are served on the event loop: Google
+# Vision is called through the asyncio client (AsyncManagedVisionClient), so
+# one process keeps many OCR calls in flight (ASGI_OCR_MAX_CONCURRENCY,
+# default VISION_ASYNC_MAX_INFLIGHT) instead of one per gunicorn thread,
+# while image preparation and grouping/filtering/parsing run on a thread pool
+# (ASGI_CPU_WORKERS). Every other route is the Flask app from main.py,
+# mounted as WSGI, so both modes share one pipeline, cache, job queue and
+# /metrics. The WSGI mount buffers a whole body before Flask sees it, so
+# AdmissionMiddleware enforces body limits while the body streams in and runs
+# the admission check for mounted parse routes (/parse-batch, /parse-mindee).
+import os
+import time
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Warm-up is started by the lifespan handler below, inside the server process
+os.environ.setdefault('OCR_WARMUP_DEFERRED', '1')
+
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.datastructures import Headers
+from starlette.middleware import Middleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import main
+from main import (
+    ALLOWED_EXTENSIONS, OCR_UNAVAILABLE_RETRY_AFTER, OCR_ERRORS, OCR_IMAGES, OCR_SECONDS, STAGE_PREPARE,
+    HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, PARSE_ROUTE_SECONDS, allowed_file, logger,
+)
+from ocr_backends import AsyncVisionBackend, OCRError
+from image_preprocess import rescale_boxes
+from job_queue import QueueFullError
+from admission import AsyncConcurrencyLimit, OverloadedError
+from upload_buffer import UploadBuffer
+from response_format import shape_from_args, shape_body, dumps, encode_body
+
+# Threads for CPU-bound work (image decode/resize, line grouping, parsing)
+ASGI_CPU_WORKERS = int(os.environ.get('ASGI_CPU_WORKERS', 4))
+cpu_executor = ThreadPoolExecutor(max_workers=ASGI_CPU_WORKERS, thread_name_prefix='asgi-cpu')
+
+# ASGI_ASYNC_VISION=0 keeps Google Vision on the sync client (run in threads)
+ASGI_ASYNC_VISION = os.environ.get('ASGI_ASYNC_VISION', '1').lower() not in ('0', 'false', 'no')
+
+# AsyncVisionBackend and the event loop's OCR slots, created at start-up inside the loop
+async_vision = None
+async_ocr_slots = None
+
+def run_cpu(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(cpu_executor, fn, *args)
+
+def run_blocking(fn, *args):
+    """Sync I/O-bound calls (stub/Tesseract backends, backend init) on the default pool"""
+    return asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+@main.metrics.register_collector
+def collect_async_vision_stats():
+    """Call counters of the asyncio Vision client"""
+    if async_vision:
+        rpc = async_vision.client.stats()
+        yield ('vision_async_rpc_events_total', 'counter', 'Async Vision client calls, attempts, retries and hedges',
+               [({"event": k}, rpc[k]) for k in
+                ("calls", "attempts", "retries", "hedges", "hedge_wins", "failures", "deadline_exceeded", "rejected")])
+    if async_ocr_slots:
+        slots = async_ocr_slots.stats()
+        yield ('asgi_ocr_slots_in_use', 'gauge', 'Event-loop OCR calls holding a slot', [({}, slots["in_use"])])
+        yield ('asgi_ocr_slots_waiting', 'gauge', 'Event-loop OCR calls waiting for a slot', [({}, slots["waiting"])])
+        yield ('asgi_ocr_slots_limit', 'gauge', 'Event-loop OCR slots (ASGI_OCR_MAX_CONCURRENCY)',
+               [({}, slots["limit"])])
+
+# ==============================================================================
+# OCR
+# ==============================================================================
+async def resolve_backend(name=None):
+    """Async Vision for google when available, else main.resolve_ocr_backend(); returns (backend, error)"""
+    if async_vision and (name or main.ocr_backends.default) == 'google':
+        return async_vision, None
+    return await run_blocking(main.resolve_ocr_backend, name)
+
+def ocr_slot_async():
+    """main.ocr_slot() for the event loop (AsyncExitStack: a no-op `async with` on Python 3.9)"""
+    return async_ocr_slots.slot() if async_ocr_slots else contextlib.AsyncExitStack()
+
+async def get_ocr_async(upload, backend):
+    """main.get_ocr() for the event loop: same cache, preparation and metrics.
+
+    Returns (words, boxes, error); error is an OCRError or None.
+    """
+    cache_key = main.ocr_cache_key(upload, backend)
+    if cache_key:
+        cached = main.ocr_cache.get(cache_key)
+        if cached is not None:
+            return cached[0], cached[1], None
+
+    try:
+        started = time.perf_counter()
+        prepared, error = await run_cpu(main.prepare_ocr_image, upload, backend)
+        STAGE_PREPARE.observe(time.perf_counter() - started)
+        if error:
+            OCR_ERRORS.labels(kind='invalid_image').inc()
+            return [], [], OCRError(error, kind='invalid_image')
+
+        OCR_IMAGES.labels(backend=backend.name, mode='single').inc()
+        async with ocr_slot_async():
+            started = time.perf_counter()
+            if asyncio.iscoroutinefunction(backend.recognize):
+                words, boxes = await backend.recognize(prepared.content)
+            else:
+                words, boxes = await run_blocking(backend.recognize, prepared.content, prepared.image)
+            OCR_SECONDS.labels(backend=backend.name, mode='single').observe(time.perf_counter() - started)
+        boxes = rescale_boxes(boxes, prepared.scale_x, prepared.scale_y)
+
+        if cache_key:
+            main.ocr_cache.put(cache_key, words, boxes)
+        return words, boxes, None
+
+    except OCRError as e:
+        OCR_ERRORS.labels(kind=e.kind).inc()
+        return [], [], e
+
+    except OverloadedError as e:
+        OCR_ERRORS.labels(kind='overloaded').inc()
+        return [], [], OCRError(str(e), kind='overloaded')
+
+    except Exception as e:
+        logger.exception("OCR failed")
+        OCR_ERRORS.labels(kind='exception').inc()
+        return [], [], OCRError(f"OCR error: {str(e)}", kind='exception')
+
+# ==============================================================================
+# ROUTES
+# ==============================================================================
+def error_response(message, status_code, headers=None):
+    return JSONResponse({"status": "error", "message": message}, status_code=status_code, headers=headers)
+
+def parse_response(request, body, status_code=200, headers=None):
+    """A parse result shaped, serialized and compressed the way the Flask views do it"""
+    body = shape_body(body, shape_from_args(request.query_params))
+    data, encoding = encode_body(dumps(body, sort_keys=True), request.headers.get('accept-encoding'))
+    headers = dict(headers or {}, vary='Accept-Encoding')
+    if encoding:
+        headers['content-encoding'] = encoding
+    return Response(data, status_code=status_code, headers=headers, media_type='application/json')
+
+def tracked(endpoint):
+    """Record the same http_* metrics as the Flask request hooks"""
+    def decorate(handler):
+        async def wrapper(request):
+            HTTP_IN_FLIGHT.labels(endpoint=endpoint).inc()
+            started = time.perf_counter()
+            status_code = 500
+            try:
+                response = await handler(request)
+                status_code = response.status_code
+                return response
+            finally:
+                HTTP_IN_FLIGHT.labels(endpoint=endpoint).dec()
+                HTTP_REQUEST_SECONDS.labels(endpoint=endpoint, method=request.method).observe(
+                    time.perf_counter() - started)
+                HTTP_REQUESTS.labels(endpoint=endpoint, method=request.method, code=status_code).inc()
+        return wrapper
+    return decorate
+
+async def parse_receipt(request):
+    """/parse (and its /scan alias) on the event loop; same parameters and responses as the Flask view"""
+    # Same admission control as the Flask views: size, per-client rate, OCR saturation
+    client_address = request.client.host if request.client else None
+    client = main.request_client_key(request.headers, client_address)
+    rejection = main.admission_check(int(request.headers.get('content-length') or 0), client,
+                                     slots=async_ocr_slots)
+    if rejection:
+        body, http_status, headers = rejection
+        return JSONResponse(body, status_code=http_status, headers=headers)
+    # A full job queue sheds ?async=1 before the multipart body is read
+    if main.is_async_request(request.query_params):
+        retry_after = main.job_queue.admission_check()
+        if retry_after:
+            return busy_response(retry_after)
+
+    try:
+        form = await request.form()
+    except UploadTooLarge as e:
+        return upload_too_large(request, e)
+    try:
+        requested_ocr = request.query_params.get('ocr') or form.get('ocr')
+        backend, backend_error = await resolve_backend(requested_ocr)
+        if not backend:
+            return error_response(backend_error, 400 if requested_ocr else 500)
+
+        file = form.get('file')
+        if not isinstance(file, UploadFile):
+            return error_response("No file uploaded. Use field name 'file'", 400)
+        if not file.filename:
+            return error_response("No file selected", 400)
+        if not allowed_file(file.filename):
+            return error_response(f"Invalid format. Allowed: {', '.join(ALLOWED_EXTENSIONS)}", 400)
+
+        # Starlette spools the multipart file like werkzeug does; read it in place
+        upload = UploadBuffer(file.file)
+        # Size and SHA-256 come from one pass over the file; keep it off the loop
+        if await run_cpu(lambda: upload.size) == 0:
+            return error_response("Empty file", 400)
+
+        dedupe = (request.query_params.get('dedupe') or form.get('dedupe') or '1').lower() not in ('0', 'false', 'no')
+        route = main.parse_route(request.query_params.get('route') or form.get('route'))
+        if not route:
+            return error_response(f"Unknown route. Available: {', '.join(main.PARSE_ROUTES)}", 400)
+        if main.is_async_request(request.query_params):
+            return await submit_job(request, form, upload, requested_ocr, dedupe, route, client)
+        if route == 'race':
+            # Racing needs both paths on threads; use the Flask implementation, which
+            # needs a sync OCR backend (resolve_backend() may return the async one)
+            backend, backend_error = await run_blocking(main.resolve_ocr_backend, requested_ocr)
+            if not backend:
+                return error_response(backend_error, 400 if requested_ocr else 500)
+            body, http_status = await run_blocking(main.route_receipt, upload, file.filename, backend, dedupe, route,
+                                                   client)
+            headers = {'Retry-After': str(OCR_UNAVAILABLE_RETRY_AFTER)} if http_status == 503 else None
+            return parse_response(request, body, http_status, headers)
+
+        started = time.perf_counter()
+
+        phash, duplicate = None, None
+        if dedupe:
+            phash, duplicate = await run_cpu(main.find_duplicate, upload, backend, client)
+        if duplicate:
+            body, http_status = duplicate, 200
+        else:
+            words, boxes, error = await get_ocr_async(upload, backend)
+            body, http_status = await run_cpu(main.receipt_response, words, boxes, error)
+            if words and http_status == 200:
+                receipt_id = await run_blocking(main.store_receipt, upload.sha256, backend, words, boxes, body)
+                main.remember_receipt(phash, receipt_id or upload.sha256, body, backend, client)
+
+        if route == 'hybrid':
+            body, http_status = await run_blocking(main.escalate, (body, http_status), upload, file.filename,
+                                                   route, started)
+        else:
+            PARSE_ROUTE_SECONDS.labels(route='rules', engine='rules').observe(time.perf_counter() - started)
+        headers = {'Retry-After': str(OCR_UNAVAILABLE_RETRY_AFTER)} if http_status == 503 else None
+        return parse_response(request, body, http_status, headers)
+
+    except Exception as e:
+        logger.exception("parse failed")
+        return JSONResponse({"status": "error", "message": str(e), "type": type(e).__name__}, status_code=500)
+    finally:
+        await form.close()
+
+async def submit_job(request, form, upload, requested_ocr, dedupe=True, route='rules', client=None):
+    """?async=1: hand the receipt to main.job_queue (worker threads, sync OCR backend)"""
+    job_queue = main.job_queue
+    callback_url = request.query_params.get('callback_url') or form.get('callback_url')
+    if callback_url:
+        callback_error = job_queue.validate_callback_url(callback_url)
+        if callback_error:
+            return error_response(callback_error, 400)
+
+    backend, backend_error = await run_blocking(main.resolve_ocr_backend, requested_ocr)
+    if not backend:
+        return error_response(backend_error, 400 if requested_ocr else 500)
+
+    # The form's file is closed when this request ends, so the job gets its own spool
+    job_upload = upload.detach()
+    try:
+        if route == 'rules':
+            job_id = job_queue.submit(main.process_receipt, job_upload, backend, dedupe, client,
+                                      callback_url=callback_url)
+        else:
+            job_id = job_queue.submit(main.route_receipt, job_upload, form.get('file').filename, backend, dedupe, route,
+                                      client, callback_url=callback_url)
+    except QueueFullError as e:
+        job_upload.close()
+        return busy_response(e.retry_after)
+    return JSONResponse({"status": "accepted", "job_id": job_id, "status_url": f"/jobs/{job_id}"}, status_code=202)
+
+def busy_response(retry_after):
+    return JSONResponse({
+        "status": "error",
+        "message": "Server busy, too many queued receipts. Retry later.",
+        "retry_after": retry_after
+    }, status_code=429, headers={'Retry-After': str(retry_after)})
+
+@tracked('/health/ready')
+async def readiness(request):
+    """200 once an OCR backend (or the async Vision client) can serve /parse"""
+    main.ocr_backends.warm_up()
+    backend = main.ocr_backends.ready_backend()
+    if async_vision and main.ocr_backends.default == 'google':
+        backend = async_vision
+    if backend:
+        return JSONResponse({"status": "ready", "ocr_backend": backend.name, "mode": "asgi"})
+    status = "starting" if main.ocr_backends else "unavailable"
+    return JSONResponse({"status": status, "ocr_backends": main.ocr_backends.describe()}, status_code=503)
+
+# ==============================================================================
+# ADMISSION
+# ==============================================================================
+# Parse routes served on the event loop run admission in parse_receipt()
+EVENT_LOOP_ROUTES = {'/parse', '/scan'}
+
+class UploadTooLarge(Exception):
+    """The request body passed its limit while streaming in"""
+
+    def __init__(self, limit):
+        super().__init__(f"Upload too large (max {limit // (1024 * 1024)}MB)")
+        self.limit = limit
+
+def body_limit(path):
+    """Same per-route body limit as main.ReceiptRequest"""
+    return main.PARSE_BATCH_MAX_BYTES if path == '/parse-batch' else main.app.config['MAX_CONTENT_LENGTH']
+
+def upload_too_large(request, exc):
+    return error_response(str(exc), 413)
+
+class AdmissionMiddleware:
+    """Body limits for every request, and main.admission_check() for parse routes mounted as WSGI.
+
+    Content-Length can be missing (chunked uploads), so bytes are counted as
+    they are received and UploadTooLarge (-> 413) ends the body at the limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        path = scope['path']
+        limit = body_limit(path)
+
+        admitted = None
+        if path in main.ADMISSION_ENDPOINTS and path not in EVENT_LOOP_ROUTES:
+            headers = Headers(scope=scope)
+            client_address = scope['client'][0] if scope.get('client') else None
+            rejection = main.admission_check(int(headers.get('content-length') or 0),
+                                             main.request_client_key(headers, client_address), limit)
+            if rejection:
+                body, http_status, rejection_headers = rejection
+                await JSONResponse(body, status_code=http_status, headers=rejection_headers)(scope, receive, send)
+                return
+            admitted = main.admitted_upstream.set(True)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    raise UploadTooLarge(limit)
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            if admitted is not None:
+                main.admitted_upstream.reset(admitted)
+
+# ==============================================================================
+# APP
+# ==============================================================================
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global async_vision, async_ocr_slots
+    main.start_warmup()
+    if ASGI_ASYNC_VISION and 'google' in main.ocr_backends.resources:
+        async_vision = AsyncVisionBackend.from_env()
+    async_ocr_slots = AsyncConcurrencyLimit.from_env()
+    print(f"✅ ASGI mode: async Vision {'on' if async_vision else 'off'}, {ASGI_CPU_WORKERS} CPU worker threads, "
+          f"{async_ocr_slots.limit if async_ocr_slots else 'unlimited'} OCR slots")
+    yield
+    cpu_executor.shutdown(wait=False)
+
+app = Starlette(
+    routes=[
+        # /scan is the path the Android app posts to
+        Route('/parse', tracked('/parse')(parse_receipt), methods=['POST']),
+        Route('/scan', tracked('/scan')(parse_receipt), methods=['POST']),
+        Route('/health/ready', readiness, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(main.app)),
+    ],
+    middleware=[Middleware(AdmissionMiddleware)],
+    exception_handlers={UploadTooLarge: upload_too_large},
+    lifespan=lifespan,
+)
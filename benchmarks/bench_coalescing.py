@@ -0,0 +1,93 @@
+# ==============================================================================
+# bench_coalescing.py - Burst OCR load with and without request coalescing
+# ==============================================================================
+# Usage: python benchmarks/bench_coalescing.py [--images 400] [--threads 32]
+#
+# Fires concurrent single-image recognize() calls at the stub Vision backend,
+# whose every API call costs --latency-ms (the round trip) and at most
+# --max-inflight calls run at once (like VISION_MAX_INFLIGHT on the managed
+# client), and compares a plain backend with coalescing windows. Reports
+# images/sec, API calls made, mean batch size and per-image latency percentiles.
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vision_stub import StubVisionClient
+from ocr_backends import VisionBackend
+
+WORDS = ["Grand", "Total", "30.000"]
+BOXES = [[10, 10, 50, 30], [55, 10, 100, 30], [200, 10, 260, 30]]
+
+
+class LimitedClient:
+    """Stub client that lets at most `limit` calls run concurrently"""
+
+    def __init__(self, client, limit):
+        self.client = client
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def document_text_detection(self, **kwargs):
+        with self._slots:
+            return self.client.document_text_detection(**kwargs)
+
+    def batch_annotate_images(self, **kwargs):
+        with self._slots:
+            return self.client.batch_annotate_images(**kwargs)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(args, window_ms):
+    client = StubVisionClient(default=(WORDS, BOXES), latency=args.latency_ms / 1000)
+    backend = VisionBackend(LimitedClient(client, args.max_inflight), name='stub',
+                            coalesce_window=window_ms / 1000, coalesce_max=args.max_batch,
+                            coalesce_concurrency=args.max_inflight)
+
+    def one(i):
+        start = time.perf_counter()
+        words, _ = backend.recognize(b"receipt-%d" % i)
+        assert words == WORDS
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        latencies = list(pool.map(one, range(args.images)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "images_per_s": args.images / elapsed,
+        "calls": client.calls,
+        "mean_batch": client.images / client.calls,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of coalesced vs per-image Vision calls")
+    parser.add_argument("--images", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=32, help="concurrent request threads")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated round trip per API call")
+    parser.add_argument("--windows", default="0,10,25,50", help="coalescing windows in ms (0 = off)")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-inflight", type=int, default=4, help="API calls allowed at once")
+    args = parser.parse_args()
+
+    print(f"{'window':>8} {'images/s':>9} {'API calls':>10} {'batch':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for window_ms in [float(w) for w in args.windows.split(',')]:
+        r = run(args, window_ms)
+        label = f"{window_ms:g}ms" if window_ms else "off"
+        print(f"{label:>8} {r['images_per_s']:>9.1f} {r['calls']:>10} {r['mean_batch']:>6.1f} "
+              f"{r['p50'] * 1000:>8.1f} {r['p95'] * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
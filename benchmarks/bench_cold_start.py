@@ -0,0 +1,86 @@
+# ==============================================================================
+# bench_cold_start.py - Time from process start to first response and readiness
+# ==============================================================================
+# Usage: python benchmarks/bench_cold_start.py [--runs 5]
+#
+# Starts fresh interpreters that import main.py and report, relative to
+# process launch: import done, first /health/live response, /health/ready
+# turning 200, and (for comparison) when a first response would have gone
+# out had the OCR clients been built eagerly at import, as before lazy init.
+# Uses the current environment; without any OCR configuration it replays the
+# benchmark fixtures through the stub backend.
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+CHILD = r'''
+import sys, time, json
+launched, timeout, eager = float(sys.argv[1]), float(sys.argv[2]), sys.argv[3] == "1"
+import main
+imported = time.time()
+if eager:
+    main.ocr_backends.get()
+client = main.app.test_client()
+client.get("/health/live")
+live = time.time()
+ready = None
+deadline = live + timeout
+while time.time() < deadline:
+    if client.get("/health/ready").status_code == 200:
+        ready = time.time()
+        break
+    time.sleep(0.005)
+print("RESULT " + json.dumps({
+    "import_s": imported - launched,
+    "first_response_s": live - launched,
+    "ready_s": ready - launched if ready else None,
+}))
+'''
+
+
+def run_once(timeout, eager):
+    env = dict(os.environ)
+    if not any(env.get(k) for k in ('VISION_STUB_FIXTURES', 'OCR_BACKENDS', 'GOOGLE_CREDENTIALS_JSON')):
+        env['VISION_STUB_FIXTURES'] = os.path.join(BENCH_DIR, 'fixtures')
+    launched = time.time()
+    proc = subprocess.run(
+        [sys.executable, '-c', CHILD, repr(launched), str(timeout), '1' if eager else '0'],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    raise RuntimeError(f"child failed:\n{proc.stdout}\n{proc.stderr}")
+
+
+def summarize(results, key):
+    values = [r[key] for r in results if r[key] is not None]
+    if not values:
+        return "n/a"
+    return f"{statistics.median(values) * 1000:8.1f} ms (median of {len(values)})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time to first response and readiness")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for readiness")
+    args = parser.parse_args()
+
+    lazy = [run_once(args.timeout, eager=False) for _ in range(args.runs)]
+    eager = [run_once(args.timeout, eager=True) for _ in range(args.runs)]
+
+    print(f"import main                      {summarize(lazy, 'import_s')}")
+    print(f"first response (lazy init)       {summarize(lazy, 'first_response_s')}")
+    print(f"ready (background warm-up)       {summarize(lazy, 'ready_s')}")
+    print(f"first response (eager init)      {summarize(eager, 'first_response_s')}")
+
+
+if __name__ == "__main__":
+    main()
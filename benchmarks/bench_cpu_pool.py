@@ -0,0 +1,82 @@
+# ==============================================================================
+# bench_cpu_pool.py - CPU stages on request threads vs in the CPU pool
+# ==============================================================================
+# Usage: python benchmarks/bench_cpu_pool.py [--threads 8] [--workers 4] [--rounds 20]
+#
+# Runs main.build_parse_response() over the benchmark fixtures from
+# --threads request threads, first in-thread (GIL-bound) and then through
+# cpu_pool with --workers processes. While each run is going, a probe thread
+# sleeps 1ms in a loop, standing in for a request thread waiting on Vision;
+# its wake-up lag shows how much the CPU work stalls I/O-bound threads.
+import os
+import sys
+import time
+import glob
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from vision_stub import load_fixture
+
+
+def probe_lag(stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        time.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+def run(main, pool, receipts, args):
+    main.cpu_pool = pool
+    stop = threading.Event()
+    lags = []
+    probe = threading.Thread(target=probe_lag, args=(stop, lags), daemon=True)
+    probe.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(lambda r: main.build_parse_response(*r), receipts * args.rounds))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    probe.join()
+
+    lags.sort()
+    return {
+        "receipts_per_s": len(receipts) * args.rounds / elapsed,
+        "lag_p50": statistics.median(lags),
+        "lag_p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse throughput and thread stalls with and without the CPU pool")
+    parser.add_argument("--fixtures", default=os.path.join(BENCH_DIR, 'fixtures'))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=max(2, (os.cpu_count() or 2)))
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('VISION_STUB_FIXTURES', args.fixtures)
+    os.environ['OCR_WARMUP'] = '0'
+    import main as app_main
+    from cpu_pool import CPUPool
+
+    receipts = [load_fixture(path)[:2] for path in sorted(glob.glob(os.path.join(args.fixtures, '*.json')))]
+
+    pool = CPUPool(args.workers)
+    pool.warm_up()
+    pool.parse(*receipts[0])  # wait until the workers are up
+
+    print(f"{'mode':<16} {'receipts/s':>11} {'lag p50 ms':>11} {'lag p99 ms':>11}")
+    for name, selected in (("threads", None), (f"pool x{args.workers}", pool)):
+        r = run(app_main, selected, receipts, args)
+        print(f"{name:<16} {r['receipts_per_s']:>11.1f} {r['lag_p50'] * 1000:>11.2f} {r['lag_p99'] * 1000:>11.2f}")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# ==============================================================================
+# bench_parse_rules.py - Per-receipt cost of smart_filter_receipt + parse_receipt_to_json
+# ==============================================================================
+# Usage: python benchmarks/bench_parse_rules.py [--receipts 2000]
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from receipt_pipeline import smart_filter_receipt, parse_receipt_to_json, classify_line
+
+HEADER_LINES = [
+    "KOPI KENANGAN", "Jl. Sudirman No. 12 Jakarta", "Telp 021-5551234",
+    "Kasir : Dewi", "Date 12/05/2024 Time 19:42", "Table 7", "No. Trans 0001928374",
+]
+ITEM_NAMES = [
+    "Nasi Goreng Spesial", "Es Teh Manis", "Ayam Bakar", "Mie Goreng", "Kopi Susu",
+    "Teh Tarik", "Roti Bakar Coklat", "Sate Ayam", "Air Mineral", "Kentang Goreng",
+]
+FOOTER_LINES = [
+    "QRIS GOPAY", "Thank you for coming", "Welcome back", "www.example.co.id",
+]
+
+
+def money(value):
+    return f"{value:,}".replace(",", ".")
+
+
+def synthetic_receipt(rng, n_items):
+    """Receipt text shaped like group_lines_by_height_overlap output"""
+    lines = list(HEADER_LINES)
+    subtotal = 0
+    for _ in range(n_items):
+        name = rng.choice(ITEM_NAMES)
+        qty = rng.randint(1, 3)
+        unit = rng.randrange(8000, 60000, 500)
+        subtotal += qty * unit
+        if qty > 1:
+            lines.append(name)
+            lines.append(f"{qty} x @{money(unit)} \t {money(qty * unit)}")
+        else:
+            lines.append(f"{name} \t {money(unit)}")
+    tax = subtotal // 10
+    service = subtotal // 20
+    lines += [
+        "-" * 24,
+        f"Subtotal \t {money(subtotal)}",
+        f"Service Charge 5% \t {money(service)}",
+        f"PB1 10% \t {money(tax)}",
+        f"Grand Total \t Rp {money(subtotal + tax + service)}",
+        f"CASH \t {money(subtotal + tax + service + 5000)}",
+        f"KEMBALI \t {money(5000)}",
+    ]
+    lines += FOOTER_LINES
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark for the receipt line rules")
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    receipts = [synthetic_receipt(rng, rng.randint(3, 40)) for _ in range(args.receipts)]
+    n_lines = sum(r.count("\n") + 1 for r in receipts)
+
+    classify_line.cache_clear()
+    t0 = time.perf_counter()
+    filtered = [smart_filter_receipt(r) for r in receipts]
+    t1 = time.perf_counter()
+    results = [parse_receipt_to_json(f) for f in filtered]
+    t2 = time.perf_counter()
+
+    # Second pass: every line is already in the classify_line cache
+    t3 = time.perf_counter()
+    for r in receipts:
+        parse_receipt_to_json(smart_filter_receipt(r))
+    t4 = time.perf_counter()
+
+    balanced = sum(1 for r in results if r.get("status") == "Balanced")
+    per = 1e6 / len(receipts)
+    print(f"receipts: {len(receipts)}  lines: {n_lines}  balanced: {balanced}/{len(receipts)}")
+    print(f"smart_filter_receipt   {(t1 - t0) * per:8.1f} us/receipt")
+    print(f"parse_receipt_to_json  {(t2 - t1) * per:8.1f} us/receipt")
+    print(f"filter + parse (cold)  {(t2 - t0) * per:8.1f} us/receipt")
+    print(f"filter + parse (warm)  {(t4 - t3) * per:8.1f} us/receipt")
+    print(f"classify_line cache    {classify_line.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# ==============================================================================
+# bench_pipeline.py - Offline speed/accuracy regression harness for the parser
+# ==============================================================================
+# Usage:
+#   python benchmarks/bench_pipeline.py                    # report + check against baseline.json
+#   python benchmarks/bench_pipeline.py --update-baseline  # accept current results as the baseline
+#   python benchmarks/bench_pipeline.py --fixtures DIR     # replay other recorded fixtures
+#
+# Replays words/boxes fixtures (vision_stub format, see make_fixtures.py)
+# through group_lines_by_height_overlap -> smart_filter_receipt ->
+# parse_receipt_to_json without any network access, and reports throughput,
+# per-stage p50/p95 latency, per-stage allocation peaks and the share of
+# receipts that come out "Balanced". Exits 1 when accuracy drops, a receipt
+# that used to balance no longer does, or a stage's p95 grows past
+# --max-slowdown times the baseline. Timing baselines are machine-specific;
+# use --skip-timing-check on a different machine than the one that wrote them.
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from receipt_pipeline import group_lines_by_height_overlap, smart_filter_receipt, parse_receipt_to_json, classify_line
+from vision_stub import load_fixture
+
+STAGES = ("group_lines", "filter", "parse")
+
+
+def load_fixtures(path):
+    fixtures = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.json'):
+            words, boxes, payload = load_fixture(os.path.join(path, name))
+            fixtures.append((name[:-len('.json')], words, boxes, payload.get("expected") or {}))
+    return fixtures
+
+
+def run_pipeline(words, boxes, engine=None):
+    full_text = group_lines_by_height_overlap(words, boxes, engine=engine)
+    clean_text = smart_filter_receipt(full_text)
+    return parse_receipt_to_json(clean_text)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def time_stages(fixtures, rounds, engine=None):
+    """Per-stage durations (seconds) over `rounds` passes; first pass starts with a cold classify_line cache"""
+    timings = {stage: [] for stage in STAGES}
+    classify_line.cache_clear()
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(rounds):
+        for _, words, boxes, _ in fixtures:
+            t0 = clock()
+            full_text = group_lines_by_height_overlap(words, boxes, engine=engine)
+            t1 = clock()
+            clean_text = smart_filter_receipt(full_text)
+            t2 = clock()
+            parse_receipt_to_json(clean_text)
+            t3 = clock()
+            timings["group_lines"].append(t1 - t0)
+            timings["filter"].append(t2 - t1)
+            timings["parse"].append(t3 - t2)
+    elapsed = clock() - start
+    return timings, (rounds * len(fixtures)) / elapsed if elapsed else 0.0
+
+
+def measure_allocations(fixtures, engine=None):
+    """Mean/max traced allocation peak (KB) per stage; run separately, tracing slows everything down"""
+    peaks = {stage: [] for stage in STAGES}
+    classify_line.cache_clear()
+    tracemalloc.start()
+    try:
+        for _, words, boxes, _ in fixtures:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            full_text = group_lines_by_height_overlap(words, boxes, engine=engine)
+            peaks["group_lines"].append(tracemalloc.get_traced_memory()[1] - base)
+
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            clean_text = smart_filter_receipt(full_text)
+            peaks["filter"].append(tracemalloc.get_traced_memory()[1] - base)
+
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            parse_receipt_to_json(clean_text)
+            peaks["parse"].append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return {
+        stage: {"mean_kb": round(sum(v) / len(v) / 1024, 1), "max_kb": round(max(v) / 1024, 1)}
+        for stage, v in peaks.items() if v
+    }
+
+
+def evaluate(fixtures, engine=None):
+    """Per-receipt status and grand total, plus accuracy counts"""
+    receipts = {}
+    balanced = 0
+    totals_correct = 0
+    with_expected = 0
+    for name, words, boxes, expected in fixtures:
+        result = run_pipeline(words, boxes, engine)
+        status = result.get("status", "")
+        grand_total = result.get("summary", {}).get("grand_total")
+        receipts[name] = {"status": status, "grand_total": grand_total}
+        balanced += status == "Balanced"
+        if "grand_total" in expected:
+            with_expected += 1
+            totals_correct += grand_total == expected["grand_total"]
+    return {
+        "receipts": receipts,
+        "balanced": balanced,
+        "count": len(fixtures),
+        "totals_correct": totals_correct,
+        "with_expected": with_expected,
+    }
+
+
+def build_report(fixtures, rounds, engine=None, allocations=True):
+    timings, throughput = time_stages(fixtures, rounds, engine)
+    report = evaluate(fixtures, engine)
+    report["receipts_per_sec"] = round(throughput, 1)
+    report["stages"] = {
+        stage: {
+            "p50_us": round(percentile(values, 50) * 1e6, 1),
+            "p95_us": round(percentile(values, 95) * 1e6, 1),
+        }
+        for stage, values in timings.items()
+    }
+    if allocations:
+        for stage, alloc in measure_allocations(fixtures, engine).items():
+            report["stages"][stage].update(alloc)
+    return report
+
+
+def print_report(report):
+    count = report["count"]
+    print(f"receipts: {count}  throughput: {report['receipts_per_sec']:.1f} receipts/sec")
+    print(f"balanced: {report['balanced']}/{count} ({report['balanced'] * 100 / max(1, count):.1f}%)")
+    if report["with_expected"]:
+        print(f"grand total correct: {report['totals_correct']}/{report['with_expected']}")
+    print(f"{'stage':<12} {'p50 us':>9} {'p95 us':>9} {'alloc mean KB':>14} {'alloc max KB':>13}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<12} {s['p50_us']:>9.1f} {s['p95_us']:>9.1f} "
+              f"{s.get('mean_kb', float('nan')):>14.1f} {s.get('max_kb', float('nan')):>13.1f}")
+
+
+def compare(report, baseline, max_slowdown, check_timing=True):
+    """Regression messages (empty when the run is at least as good as the baseline)"""
+    problems = []
+    if report["balanced"] < baseline["balanced"]:
+        problems.append(f"balanced receipts dropped: {baseline['balanced']} -> {report['balanced']}")
+    if report["totals_correct"] < baseline.get("totals_correct", 0):
+        problems.append(f"correct grand totals dropped: {baseline['totals_correct']} -> {report['totals_correct']}")
+
+    for name, before in baseline.get("receipts", {}).items():
+        after = report["receipts"].get(name)
+        if after is None:
+            continue
+        if before["status"] == "Balanced" and after["status"] != "Balanced":
+            problems.append(f"{name}: no longer balanced ({after['status']})")
+        elif after != before:
+            print(f"note: {name} changed {before} -> {after}")
+
+    if check_timing:
+        for stage, before in baseline.get("stages", {}).items():
+            after = report["stages"].get(stage)
+            if after and before["p95_us"] and after["p95_us"] > before["p95_us"] * max_slowdown:
+                problems.append(f"{stage} p95 {before['p95_us']}us -> {after['p95_us']}us "
+                                f"(> {max_slowdown}x baseline)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark and regression check for the receipt parser")
+    parser.add_argument("--fixtures", default=os.path.join(BENCH_DIR, "fixtures"))
+    parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "baseline.json"))
+    parser.add_argument("--rounds", type=int, default=20, help="timed passes over the fixture set")
+    parser.add_argument("--engine", default=None, help="LINE_GROUPING_ENGINE override (auto/numpy/sweep/legacy)")
+    parser.add_argument("--max-slowdown", type=float, default=1.5)
+    parser.add_argument("--skip-timing-check", action="store_true")
+    parser.add_argument("--no-allocations", action="store_true")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"no fixtures in {args.fixtures}")
+        return 2
+
+    report = build_report(fixtures, args.rounds, args.engine, allocations=not args.no_allocations)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    problems = compare(report, baseline, args.max_slowdown, check_timing=not args.skip_timing_check)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    if problems:
+        return 1
+    print("OK: no regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
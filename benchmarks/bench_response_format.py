@@ -0,0 +1,75 @@
+# ==============================================================================
+# bench_response_format.py - /parse response size and serialization time
+# ==============================================================================
+# Usage: python benchmarks/bench_response_format.py [--rounds 200]
+#
+# Builds the /parse response body for every benchmark fixture (offline, via
+# main.build_parse_response), then for each response shape (full, ?debug=0,
+# ?format=compact) reports the mean body size raw, gzipped and brotli-coded
+# (when brotli is installed) and the serialization time per receipt with the
+# stdlib encoder (what jsonify used) and with orjson (when installed).
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from vision_stub import load_fixture
+
+SHAPES = {
+    "full": {},
+    "debug=0": {"debug": "0"},
+    "compact": {"format": "compact"},
+}
+
+
+def stdlib_dumps(obj):
+    """Flask's default jsonify encoding"""
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def time_per_call(fn, bodies, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for body in bodies:
+            fn(body)
+    return (time.perf_counter() - start) / (rounds * len(bodies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response size and serialization time per receipt")
+    parser.add_argument("--fixtures", default=os.path.join(BENCH_DIR, 'fixtures'))
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['OCR_WARMUP'] = '0'
+    import main as app_main
+    import response_format
+    from response_format import shape_from_args, shape_body, compress, orjson, brotli
+
+    responses = [app_main.build_parse_response(*load_fixture(path)[:2])
+                 for path in sorted(glob.glob(os.path.join(args.fixtures, '*.json')))]
+
+    print(f"{len(responses)} receipts, {args.rounds} rounds")
+    print(f"{'shape':<10} {'bytes':>7} {'gzip':>7} {'br':>7} {'json us':>9} {'orjson us':>10}")
+    for name, params in SHAPES.items():
+        bodies = [shape_body(r, shape_from_args(params)) for r in responses]
+        encoded = [stdlib_dumps(b) for b in bodies]
+        size = sum(map(len, encoded)) / len(encoded)
+        gz = sum(len(compress(e, 'gzip')) for e in encoded) / len(encoded)
+        br = f"{sum(len(compress(e, 'br')) for e in encoded) / len(encoded):>7.0f}" if brotli else f"{'-':>7}"
+
+        json_us = time_per_call(stdlib_dumps, bodies, args.rounds) * 1e6
+        if orjson:
+            fast_us = f"{time_per_call(lambda b: response_format.dumps(b, sort_keys=True), bodies, args.rounds) * 1e6:>10.1f}"
+        else:
+            fast_us = f"{'-':>10}"
+        print(f"{name:<10} {size:>7.0f} {gz:>7.0f} {br} {json_us:>9.1f} {fast_us}")
+
+
+if __name__ == "__main__":
+    main()
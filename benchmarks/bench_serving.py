@@ -0,0 +1,177 @@
+# ==============================================================================
+# bench_serving.py - Load test: gunicorn threads (WSGI) vs uvicorn + asgi.py
+# ==============================================================================
+# Usage: python benchmarks/bench_serving.py [--modes wsgi,asgi] [--requests 400]
+#                                           [--concurrency 100] [--vision-latency-ms 300]
+#                                           [--route rules|hybrid|race] [--out results.json]
+#
+# Starts fake_vision_server.py in this process (every image gets the same
+# recorded receipt after --vision-latency-ms), then for each mode launches the
+# API as a subprocess pointed at it (OCR_BACKENDS=google, VISION_ENDPOINT,
+# cache off), fires --requests uploads at /parse?route=--route from
+# --concurrency client threads and reports throughput, latency percentiles and
+# errors. A mode whose first request fails is reported as an error instead of
+# being timed (e.g. --modes asgi --route race checks the raced path in
+# SERVER_MODE=asgi). --out writes the settings and results as JSON; the last
+# recorded comparison is serving_results.json.
+# ASGI mode needs starlette, uvicorn and python-multipart installed.
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from PIL import Image
+from fake_vision_server import FakeVisionServer
+from vision_stub import load_fixture
+
+SERVER_COMMANDS = {
+    'wsgi': lambda port: ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1',
+                          '--threads', '8', '--timeout', '0', 'main:app'],
+    'asgi': lambda port: ['uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                          '--log-level', 'warning'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def sample_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 900), 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def multipart_body(image):
+    boundary = 'bench-serving-boundary'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="receipt.png"\r\n'
+        f'Content-Type: image/png\r\n\r\n'
+    ).encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def wait_ready(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/health/ready', timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def post_parse(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            payload = json.loads(response.read())
+            ok = payload.get("status") == "success"
+    except (urllib.error.URLError, ConnectionError, OSError):
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else float('nan')
+
+
+def run_mode(mode, vision_address, args):
+    port = free_port()
+    env = dict(os.environ, OCR_BACKENDS='google', VISION_ENDPOINT=vision_address, VISION_INSECURE='1',
+               OCR_CACHE_ENABLED='0', VISION_POOL_SIZE='8', LOG_LEVEL='WARNING')
+    env.pop('VISION_STUB_FIXTURES', None)
+    server = subprocess.Popen(SERVER_COMMANDS[mode](port), cwd=REPO_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        if not wait_ready(base_url):
+            raise RuntimeError(f"{mode} server did not become ready")
+
+        body, content_type = multipart_body(sample_image())
+        url = f'{base_url}/parse?route={args.route}'
+        ok, _ = post_parse(url, body, content_type)  # first request pays for lazy imports
+        if not ok:
+            raise RuntimeError(f"{mode}: POST /parse?route={args.route} failed")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda _: post_parse(url, body, content_type), range(args.requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = [t for ok, t in results if ok]
+    return {
+        "rps": len(latencies) / elapsed,
+        "errors": len(results) - len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /parse in WSGI and ASGI serving modes")
+    parser.add_argument("--modes", default="wsgi,asgi")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--vision-latency-ms", type=float, default=300.0)
+    parser.add_argument("--route", default="rules", choices=("rules", "hybrid", "race"),
+                        help="parse route (?route=); hybrid/race without MINDEE_API_KEY run rules only")
+    parser.add_argument("--fixture", default=os.path.join(BENCH_DIR, 'fixtures', 'synthetic_000.json'),
+                        help="receipt returned by the fake Vision server")
+    parser.add_argument("--out", default=None, help="write settings and results to this JSON file")
+    args = parser.parse_args()
+
+    words, boxes, _ = load_fixture(args.fixture)
+    with FakeVisionServer(default=(words, boxes), latency=args.vision_latency_ms / 1000,
+                          max_workers=max(64, 2 * args.concurrency)) as vision:
+        print(f"{'mode':<6} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        results = {}
+        for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+            r = results[mode] = run_mode(mode, vision.address, args)
+            print(f"{mode:<6} {r['rps']:>8.1f} {r['errors']:>7} {r['p50'] * 1000:>8.1f} "
+                  f"{r['p95'] * 1000:>8.1f} {r['p99'] * 1000:>8.1f}")
+
+    if args.out:
+        report = {
+            "settings": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "vision_latency_ms": args.vision_latency_ms,
+                "route": args.route,
+                "fixture": os.path.basename(args.fixture),
+                "gunicorn_args": ' '.join(SERVER_COMMANDS['wsgi'](0)[3:]),
+            },
+            "machine": {"python": platform.python_version(), "cpus": os.cpu_count(), "system": platform.system()},
+            "results": {mode: {k: round(v, 4) for k, v in r.items()} for mode, r in results.items()},
+        }
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# ==============================================================================
+# bench_vision_client.py - Call policies of ManagedVisionClient vs a flaky fake server
+# ==============================================================================
+# Usage: python benchmarks/bench_vision_client.py [--calls 300] [--threads 8]
+#
+# Starts fake_vision_server.py locally with a latency tail (--slow-share of
+# calls take --slow-ms) and injected UNAVAILABLE errors (--fail-rate), then
+# runs the same load through three policies: a single attempt with no retry
+# (like the bare client), retry with jittered backoff, and retry plus p95
+# hedging. Reports success rate and latency percentiles for each.
+import os
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import vision
+from fake_vision_server import FakeVisionServer
+from managed_vision import ManagedVisionClient, create_client
+
+WORDS = ["Grand", "Total", "30.000"]
+BOXES = [[10, 10, 50, 30], [55, 10, 100, 30], [200, 10, 260, 30]]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else float('nan')
+
+
+def run_policy(address, args, **policy):
+    client = ManagedVisionClient(
+        [create_client(endpoint=address, insecure=True) for _ in range(args.threads)],
+        deadline=args.deadline, attempt_timeout=args.deadline, backoff_base=0.02, backoff_max=0.5,
+        **policy
+    )
+    image = vision.Image(content=b"receipt")
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            client.document_text_detection(image=image)
+            ok = True
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(one, range(args.calls)))
+
+    latencies = [t for ok, t in results if ok]
+    return {
+        "success": sum(ok for ok, _ in results) / len(results),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else float('nan'),
+        "stats": client.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Vision call policies against a fake server")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--base-ms", type=float, default=20)
+    parser.add_argument("--slow-ms", type=float, default=800)
+    parser.add_argument("--slow-share", type=float, default=0.03)
+    parser.add_argument("--fail-rate", type=float, default=0.05)
+    parser.add_argument("--deadline", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    policies = [
+        ("single attempt", dict(max_attempts=1)),
+        ("retry", dict(max_attempts=4)),
+        ("retry + p95 hedge", dict(max_attempts=4, hedge='p95', hedge_min=0.05)),
+    ]
+
+    print(f"{'policy':<20} {'success':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  retries/hedges")
+    for name, policy in policies:
+        rng = random.Random(args.seed)
+        latency = lambda _call: (args.slow_ms if rng.random() < args.slow_share else args.base_ms) / 1000
+        with FakeVisionServer(default=(WORDS, BOXES), latency=latency,
+                              fail_rate=args.fail_rate, seed=args.seed) as server:
+            r = run_policy(server.address, args, **policy)
+        s = r["stats"]
+        print(f"{name:<20} {r['success'] * 100:>7.1f}% {r['p50'] * 1000:>8.1f} {r['p95'] * 1000:>8.1f} "
+              f"{r['p99'] * 1000:>8.1f} {r['max'] * 1000:>8.1f}  {s['retries']}/{s['hedges']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# ==============================================================================
+# make_fixtures.py - Synthetic OCR fixtures (words + boxes) for bench_pipeline.py
+# ==============================================================================
+# Usage: python benchmarks/make_fixtures.py [--out benchmarks/fixtures] [--receipts 37]
+#
+# Writes one file per receipt in the vision_stub fixture format, plus an
+# "expected" block with the true grand total. Receipts are laid out the way
+# Vision reports them (one box per word, slight skew and jitter) and a share
+# of them carry typical OCR damage: a misread price digit or a missing total
+# line. Real recorded fixtures can be dropped into the same directory.
+import os
+import sys
+import json
+import random
+import argparse
+
+from bench_parse_rules import HEADER_LINES, ITEM_NAMES, FOOTER_LINES, money
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vision_stub import save_fixture
+
+CHAR_WIDTH = 11
+LINE_HEIGHT = 22
+LINE_PITCH = 30
+PRICE_RIGHT_EDGE = 620
+
+
+def receipt_lines(rng, n_items):
+    """(left text, right text) rows and the true grand total"""
+    rows = [(line, "") for line in HEADER_LINES]
+    subtotal = 0
+    for _ in range(n_items):
+        name = rng.choice(ITEM_NAMES)
+        qty = rng.randint(1, 3)
+        unit = rng.randrange(8000, 60000, 500)
+        subtotal += qty * unit
+        if qty > 1:
+            rows.append((name, ""))
+            rows.append((f"{qty} x @{money(unit)}", money(qty * unit)))
+        else:
+            rows.append((name, money(unit)))
+
+    tax = subtotal // 10
+    service = subtotal // 20
+    grand_total = subtotal + tax + service
+    rows += [
+        ("-" * 24, ""),
+        ("Subtotal", money(subtotal)),
+        ("Service Charge 5%", money(service)),
+        ("PB1 10%", money(tax)),
+        ("Grand Total", f"Rp {money(grand_total)}"),
+        ("CASH", money(grand_total + 5000)),
+        ("KEMBALI", money(5000)),
+    ]
+    rows += [(line, "") for line in FOOTER_LINES]
+    return rows, grand_total
+
+
+def damage(rng, rows):
+    """Apply one typical OCR failure; returns its name"""
+    kind = rng.choice(["misread_price", "missing_total"])
+    if kind == "missing_total":
+        rows[:] = [r for r in rows if r[0] != "Grand Total"]
+        return kind
+
+    priced = [i for i, (left, right) in enumerate(rows) if right and left not in ("CASH", "KEMBALI")]
+    i = rng.choice(priced)
+    left, right = rows[i]
+    digits = [j for j, ch in enumerate(right) if ch.isdigit() and j > 0]
+    j = rng.choice(digits)
+    wrong = str((int(right[j]) + rng.randint(1, 8)) % 10)
+    rows[i] = (left, right[:j] + wrong + right[j + 1:])
+    return kind
+
+
+def layout(rng, rows, skew=0.01, jitter=3):
+    """Place every word of every row as a Vision-style box"""
+    words, boxes = [], []
+    for n, (left, right) in enumerate(rows):
+        top = 40 + n * LINE_PITCH
+
+        x = 20
+        for word in left.split():
+            width = CHAR_WIDTH * len(word)
+            y = top + int(x * skew) + rng.randint(-jitter, jitter)
+            words.append(word)
+            boxes.append([x, y, x + width, y + LINE_HEIGHT])
+            x += width + 8
+
+        if right:
+            tokens = right.split()
+            x = PRICE_RIGHT_EDGE - CHAR_WIDTH * len(right)
+            for word in tokens:
+                width = CHAR_WIDTH * len(word)
+                y = top + int(x * skew) + rng.randint(-jitter, jitter)
+                words.append(word)
+                boxes.append([x, y, x + width, y + LINE_HEIGHT])
+                x += width + CHAR_WIDTH
+    return words, boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic words/boxes fixtures")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+    parser.add_argument("--receipts", type=int, default=37)
+    parser.add_argument("--damaged", type=float, default=0.35, help="share of receipts with OCR damage")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    for n in range(args.receipts):
+        rows, grand_total = receipt_lines(rng, rng.randint(2, 25))
+        damage_kind = damage(rng, rows) if rng.random() < args.damaged else None
+        words, boxes = layout(rng, rows)
+        save_fixture(
+            os.path.join(args.out, f"synthetic_{n:03d}.json"),
+            words, boxes,
+            expected={"grand_total": grand_total, "damage": damage_kind},
+        )
+    print(f"wrote {args.receipts} fixtures to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
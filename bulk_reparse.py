@@ -0,0 +1,247 @@
+# ==============================================================================
+# bulk_reparse.py - Re-run grouping/filter/parse over saved OCR output, offline
+# ==============================================================================
+# Usage: python bulk_reparse.py INPUT [INPUT ...] -o results.jsonl
+#                               [--baseline previous.jsonl] [--workers N] [--chunk 64]
+#
+# INPUT is a directory of words/boxes JSON files (vision_stub fixture
+# format), a .jsonl file with one {"id", "words", "boxes"} object per line,
+# or a receipt store database (.sqlite3/.db, see receipt_store.py). Receipts
+# are streamed in chunks to worker processes and the results written in
+# input order as JSONL: {"id", "status", "grand_total", "items", "result"}.
+# Progress and throughput go to stderr. With --baseline (the output of an
+# earlier run), a summary of status and grand_total changes is printed and
+# --diff writes the changed receipts to a JSONL file.
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from collections import Counter, deque
+from cpu_pool import pack_ocr, parse_packed
+from receipt_pipeline import outcome_label
+
+
+# ==============================================================================
+# INPUT
+# ==============================================================================
+def iter_directory(path):
+    for file_path in sorted(glob.glob(os.path.join(path, '*.json'))):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Skipping {file_path}: {e}", file=sys.stderr)
+            continue
+        yield os.path.splitext(os.path.basename(file_path))[0], payload.get("words", []), payload.get("boxes", [])
+
+
+def iter_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                payload = json.loads(line)
+            except ValueError as e:
+                print(f"[WARN] {path}:{line_no}: {e}", file=sys.stderr)
+                continue
+            receipt_id = payload.get("id") or payload.get("receipt_id") or f"{os.path.basename(path)}:{line_no}"
+            yield receipt_id, payload.get("words", []), payload.get("boxes", [])
+
+
+def iter_store(path):
+    from receipt_store import ReceiptStore
+    yield from ReceiptStore(path).iter_ocr()
+
+
+def iter_inputs(paths):
+    """(id, words, boxes) from every input, in order"""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_directory(path)
+        elif path.endswith(('.sqlite3', '.sqlite', '.db')):
+            yield from iter_store(path)
+        else:
+            yield from iter_jsonl(path)
+
+
+def iter_chunks(records, size):
+    """Chunks of (id, packed OCR) ready to send to a worker"""
+    chunk = []
+    for receipt_id, words, boxes in records:
+        chunk.append((receipt_id, pack_ocr(words, boxes)))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ==============================================================================
+# WORKER
+# ==============================================================================
+def parse_chunk(chunk):
+    """Parse a chunk in a worker; returns [(id, result), ...]"""
+    results = []
+    for receipt_id, packed in chunk:
+        try:
+            _, result, _ = parse_packed(packed)
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        results.append((receipt_id, result))
+    return results
+
+
+def run_chunks(chunks, workers):
+    """Results of parse_chunk over `chunks` in input order, with a bounded number in flight"""
+    if workers <= 0:
+        for chunk in chunks:
+            yield parse_chunk(chunk)
+        return
+
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(parse_chunk, (chunk,)))
+            # Keep a few chunks per worker queued; the input may not fit in memory
+            if len(pending) >= workers * 4:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+# ==============================================================================
+# DIFF
+# ==============================================================================
+def summarize(result):
+    """(status, grand_total) of a parse result (status 'error' if it raised)"""
+    if "error" in result:
+        return "error", None
+    return result.get("status", "empty"), result.get("summary", {}).get("grand_total")
+
+
+def status_label(status):
+    """outcome_label(), keeping this script's own 'error' and 'empty' statuses"""
+    return status if status in ('error', 'empty') else outcome_label(status or '')
+
+
+def load_baseline(path):
+    """id -> (status, grand_total) from an earlier run's output"""
+    baseline = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                baseline[row["id"]] = (row.get("status"), row.get("grand_total"))
+    return baseline
+
+
+class DiffSummary:
+    """Status / grand_total changes against a baseline run"""
+
+    def __init__(self, baseline, diff_file=None):
+        self.baseline = baseline
+        self.diff_file = diff_file
+        self.seen = set()
+        self.compared = 0
+        self.added = 0
+        self.status_changes = Counter()
+        self.total_changes = 0
+
+    def add(self, receipt_id, status, grand_total):
+        self.seen.add(receipt_id)
+        before = self.baseline.get(receipt_id)
+        if before is None:
+            self.added += 1
+            return
+        self.compared += 1
+        old_status, old_total = before
+        status_changed = old_status != status
+        total_changed = old_total != grand_total
+        if status_changed:
+            self.status_changes[(status_label(old_status), status_label(status))] += 1
+        if total_changed:
+            self.total_changes += 1
+        if self.diff_file and (status_changed or total_changed):
+            self.diff_file.write(json.dumps({
+                "id": receipt_id,
+                "status": [old_status, status],
+                "grand_total": [old_total, grand_total],
+            }, ensure_ascii=False) + "\n")
+
+    def report(self, out):
+        missing = len(self.baseline.keys() - self.seen)
+        changed = sum(self.status_changes.values())
+        print(f"\nDiff against baseline: {self.compared} compared, {self.added} new, {missing} missing", file=out)
+        print(f"  status changed:      {changed}", file=out)
+        for (old, new), count in self.status_changes.most_common():
+            print(f"    {old:>24} -> {new:<24} {count}", file=out)
+        print(f"  grand_total changed: {self.total_changes}", file=out)
+
+
+# ==============================================================================
+# MAIN
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Re-parse saved OCR output with the current rules")
+    parser.add_argument("inputs", nargs='+', help="directories of JSON fixtures, .jsonl files or receipt store databases")
+    parser.add_argument("-o", "--output", default='-', help="results JSONL (default: stdout)")
+    parser.add_argument("--baseline", help="results JSONL of an earlier run to diff against")
+    parser.add_argument("--diff", help="write receipts whose status or grand_total changed to this JSONL file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (0 = in-process)")
+    parser.add_argument("--chunk", type=int, default=64, help="receipts per worker task")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    diff = None
+    diff_file = None
+    if args.baseline:
+        if args.diff:
+            diff_file = open(args.diff, 'w', encoding='utf-8')
+        diff = DiffSummary(load_baseline(args.baseline), diff_file)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    statuses = Counter()
+    done = 0
+    started = last_report = time.perf_counter()
+    try:
+        chunks = iter_chunks(iter_inputs(args.inputs), max(1, args.chunk))
+        for results in run_chunks(chunks, args.workers):
+            for receipt_id, result in results:
+                status, grand_total = summarize(result)
+                out.write(json.dumps({
+                    "id": receipt_id,
+                    "status": status,
+                    "grand_total": grand_total,
+                    "items": len(result.get("items", [])),
+                    "result": result,
+                }, ensure_ascii=False, separators=(',', ':')) + "\n")
+                statuses[status_label(status)] += 1
+                if diff:
+                    diff.add(receipt_id, status, grand_total)
+            done += len(results)
+
+            now = time.perf_counter()
+            if now - last_report >= args.progress_every:
+                last_report = now
+                print(f"... {done} receipts, {done / (now - started):.0f}/s", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if diff_file:
+            diff_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Parsed {done} receipts in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f}/s, "
+          f"{args.workers} workers, chunks of {args.chunk})", file=sys.stderr)
+    for label, count in statuses.most_common():
+        print(f"  {label:<24} {count}", file=sys.stderr)
+    if diff:
+        diff.report(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# ==============================================================================
+# cpu_pool.py - Run the CPU-bound receipt stages in worker processes
+# ==============================================================================
+# Image preparation (decode, verify, downscale, re-encode) and line grouping +
+# filtering + parsing hold the GIL; on request threads they stall the threads
+# that should be waiting on Vision. With CPU_POOL_WORKERS > 0 these stages run
+# in a ProcessPoolExecutor instead. Workers are spawned (not forked: the
+# parent holds gRPC channels and threads), start with an initializer that
+# imports the pipeline and runs a sample receipt so patterns and caches are
+# warm, and exchange compact payloads: words joined into one string and boxes
+# as packed int32 bytes rather than pickled lists of lists.
+import os
+import time
+import threading
+import multiprocessing
+from array import array
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Separates words in the packed payload (never produced by OCR engines)
+WORD_SEPARATOR = '\x1f'
+
+# Tiny receipt run once per worker by the initializer
+WARMUP_WORDS = ["Nasi", "Goreng", "25.000", "Es", "Teh", "5.000", "TOTAL", "30.000"]
+WARMUP_BOXES = [
+    [10, 10, 60, 30], [65, 10, 130, 30], [300, 10, 360, 30],
+    [10, 40, 30, 60], [35, 40, 70, 60], [300, 40, 360, 60],
+    [10, 70, 80, 90], [300, 70, 360, 90],
+]
+
+
+def pack_ocr(words, boxes):
+    """(words, boxes) -> (count, joined words, int32 box bytes) for the trip to a worker"""
+    flat = array('i', chain.from_iterable(boxes))
+    return len(words), WORD_SEPARATOR.join(words), flat.tobytes()
+
+
+def unpack_ocr(payload):
+    count, text, box_bytes = payload
+    words = text.split(WORD_SEPARATOR) if count else []
+    flat = array('i')
+    flat.frombytes(box_bytes)
+    boxes = [flat[i:i + 4].tolist() for i in range(0, len(flat), 4)]
+    return words, boxes
+
+
+def is_pool_worker():
+    """True inside a worker process (which re-imports the parent's __main__ when spawned)"""
+    return multiprocessing.parent_process() is not None
+
+
+# ==============================================================================
+# WORKER SIDE
+# ==============================================================================
+def _init_worker():
+    """Import the pipeline and parse a sample so the first real task is not a cold start"""
+    parse_packed(pack_ocr(WARMUP_WORDS, WARMUP_BOXES))
+
+
+def _ping():
+    return os.getpid()
+
+
+def parse_packed(payload):
+    """Group, filter and parse packed OCR output; returns (clean_text, result, stage seconds)"""
+    from receipt_pipeline import group_lines, filter_lines, ReceiptParser
+
+    words, boxes = unpack_ocr(payload)
+    started = time.perf_counter()
+    lines = group_lines(words, boxes)
+    grouped = time.perf_counter()
+    clean_lines = list(filter_lines(lines))
+    filtered = time.perf_counter()
+    parser = ReceiptParser()
+    for line in clean_lines:
+        parser.feed(line)
+    result = parser.result()
+    parsed = time.perf_counter()
+    return "\n".join(clean_lines), result, (grouped - started, filtered - grouped, parsed - filtered)
+
+
+def prepare_bytes(content, config):
+    """Validate (config None) or preprocess an image in a worker.
+
+    Returns (content, scale_x, scale_y, original_size, passthrough, error);
+    content is None when the original bytes should be sent unchanged.
+    """
+    from PIL import Image
+    from upload_buffer import UploadBuffer
+    from image_preprocess import preprocess_for_ocr, preprocess_stats, invalid_image_message
+
+    upload = UploadBuffer.from_bytes(content)
+    if config is None:
+        try:
+            img = Image.open(upload.open())
+            img.verify()
+            size = Image.open(upload.open()).size
+        except Exception as e:
+            return None, 1, 1, None, False, invalid_image_message(e)
+        return None, 1, 1, size, False, None
+
+    passthrough_before = preprocess_stats()["passthrough"]
+    prepared, error = preprocess_for_ocr(upload, **config)
+    if error:
+        return None, 1, 1, None, False, error
+    passthrough = preprocess_stats()["passthrough"] > passthrough_before
+    return (None if passthrough else prepared.content, prepared.scale_x, prepared.scale_y,
+            prepared.original_size, passthrough, None)
+
+
+# ==============================================================================
+# PARENT SIDE
+# ==============================================================================
+class CPUPool:
+    """Process pool for prepare/parse, created on first use (safe to import before a fork)"""
+
+    def __init__(self, workers=2, start_method='spawn'):
+        self.workers = workers
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "restarts": 0}
+        self._pending = 0
+
+    @classmethod
+    def from_env(cls):
+        """CPU_POOL_WORKERS processes (0 = off, stages stay on request threads)"""
+        workers = int(os.environ.get('CPU_POOL_WORKERS', 0))
+        if workers <= 0 or is_pool_worker():
+            return None
+        return cls(workers, os.environ.get('CPU_POOL_START_METHOD', 'spawn'))
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _reset(self, broken):
+        """Replace a pool whose worker died (OOM kill, segfault in a decoder)"""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+                with self._stats_lock:
+                    self._counters["restarts"] += 1
+        broken.shutdown(wait=False)
+
+    def run(self, fn, *args):
+        """fn(*args) in a worker process; blocks the calling thread until it finishes"""
+        executor = self._get_executor()
+        with self._stats_lock:
+            self._counters["submitted"] += 1
+            self._pending += 1
+        try:
+            result = executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            self._reset(executor)
+            self._count_done(failed=True)
+            raise
+        except Exception:
+            self._count_done(failed=True)
+            raise
+        self._count_done()
+        return result
+
+    def _count_done(self, failed=False):
+        with self._stats_lock:
+            self._pending -= 1
+            self._counters["failed" if failed else "completed"] += 1
+
+    def warm_up(self):
+        """Start the worker processes (and their initializers) without waiting for them"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ping)
+
+    def parse(self, words, boxes):
+        """(clean_text, result, (group, filter, parse) seconds) computed in a worker"""
+        return self.run(parse_packed, pack_ocr(words, boxes))
+
+    def prepare(self, upload, config):
+        """Validate/preprocess an UploadBuffer in a worker; same return shape as prepare_bytes()"""
+        return self.run(prepare_bytes, upload.getvalue(), config)
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self._counters)
+            pending = self._pending
+        return dict(
+            counters,
+            workers=self.workers,
+            start_method=self.start_method,
+            started=self._executor is not None,
+            in_flight=pending,
+            queue_depth=max(0, pending - self.workers),
+        )
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False)
@@ -0,0 +1,151 @@
+# ==============================================================================
+# fake_vision_server.py - Local gRPC ImageAnnotator for exercising the Vision client
+# ==============================================================================
+# Serves BatchAnnotateImages (what document_text_detection calls under the
+# hood) from vision_stub fixtures, with injectable latency and failures.
+#
+# Usage: python fake_vision_server.py --fixtures DIR [--port 50051] [--latency-ms 50]
+#                                     [--fail-rate 0.1] [--fail-code UNAVAILABLE]
+# then run the API with VISION_ENDPOINT=127.0.0.1:50051 VISION_INSECURE=1
+import time
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from google.cloud import vision
+from vision_stub import StubVisionClient
+
+SERVICE = 'google.cloud.vision.v1.ImageAnnotator'
+
+
+def annotation_proto(words, boxes):
+    """AnnotateImageResponse proto holding words/boxes as one paragraph"""
+    vision_words = []
+    for text, (x0, y0, x1, y1) in zip(words, boxes):
+        vision_words.append(vision.Word(
+            symbols=[vision.Symbol(text=ch) for ch in text],
+            bounding_box=vision.BoundingPoly(vertices=[
+                vision.Vertex(x=x0, y=y0),
+                vision.Vertex(x=x1, y=y0),
+                vision.Vertex(x=x1, y=y1),
+                vision.Vertex(x=x0, y=y1),
+            ]),
+        ))
+    pages = [vision.Page(blocks=[vision.Block(paragraphs=[vision.Paragraph(words=vision_words)])])] if vision_words else []
+    return vision.AnnotateImageResponse(full_text_annotation=vision.TextAnnotation(pages=pages))
+
+
+class FakeVisionServer:
+    """In-process ImageAnnotator server on 127.0.0.1.
+
+    latency     - seconds per call, or callable(call_number) -> seconds
+    fail_first  - the first N calls fail with fail_code
+    fail_rate   - probability that any later call fails with fail_code
+    """
+
+    def __init__(self, fixtures=None, default=None, latency=0.0, fail_first=0,
+                 fail_rate=0.0, fail_code='UNAVAILABLE', port=0, seed=None, max_workers=32):
+        self.fixtures = dict(fixtures or {})
+        self.default = default
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_rate = fail_rate
+        self.fail_code = grpc.StatusCode[fail_code]
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._responses = {}
+
+        self._server = grpc.server(
+            ThreadPoolExecutor(max_workers=max_workers),
+            options=[('grpc.max_receive_message_length', -1), ('grpc.max_send_message_length', -1)],
+        )
+        handler = grpc.method_handlers_generic_handler(SERVICE, {
+            'BatchAnnotateImages': grpc.unary_unary_rpc_method_handler(
+                self._batch_annotate,
+                request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+                response_serializer=vision.BatchAnnotateImagesResponse.serialize,
+            ),
+        })
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port(f'127.0.0.1:{port}')
+        self.address = f'127.0.0.1:{self.port}'
+
+    @classmethod
+    def from_dir(cls, path, **kwargs):
+        return cls(StubVisionClient.from_dir(path).fixtures, **kwargs)
+
+    def add(self, image_bytes, words, boxes):
+        key = hashlib.sha256(image_bytes).hexdigest()
+        self.fixtures[key] = (words, boxes)
+        self._responses.pop(key, None)
+
+    def start(self):
+        self._server.start()
+        return self
+
+    def stop(self, grace=None):
+        self._server.stop(grace)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _batch_annotate(self, request, context):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            fail = call <= self.fail_first or (self.fail_rate and self._rng.random() < self.fail_rate)
+            if fail:
+                self.failures += 1
+
+        delay = self.latency(call) if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+        if fail:
+            context.abort(self.fail_code, f"injected failure on call {call}")
+
+        responses = []
+        for item in request.requests:
+            key = hashlib.sha256(item.image.content).hexdigest()
+            responses.append(self._response_for(key if key in self.fixtures else None))
+        return vision.BatchAnnotateImagesResponse(responses=responses)
+
+    def _response_for(self, key):
+        """Annotation proto for a fixture key (None = default), built once"""
+        response = self._responses.get(key)
+        if response is None:
+            found = self.fixtures.get(key, self.default) if key else self.default
+            response = annotation_proto(*found) if found else vision.AnnotateImageResponse()
+            self._responses[key] = response
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Google Vision gRPC server")
+    parser.add_argument("--fixtures", required=True, help="directory of vision_stub fixtures")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-code", default="UNAVAILABLE")
+    args = parser.parse_args()
+
+    server = FakeVisionServer.from_dir(
+        args.fixtures, latency=args.latency_ms / 1000, fail_rate=args.fail_rate,
+        fail_code=args.fail_code, port=args.port,
+    ).start()
+    print(f"🧪 Fake Vision server on {server.address} ({len(server.fixtures)} fixtures)")
+    try:
+        server._server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# ==============================================================================
+# gunicorn.conf.py - Worker start-up hooks (gunicorn loads this file from the
+# working directory automatically)
+# ==============================================================================
+import os
+
+# GUNICORN_PRELOAD=1 (or --preload) imports the app once in the master and
+# forks workers from it, so each worker skips the imports on boot
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0').lower() in ('1', 'true', 'yes')
+
+# Clients and warm-up threads must be created inside each worker, after the
+# fork: tell main.py not to start warm-up at import time
+os.environ['OCR_WARMUP_DEFERRED'] = '1'
+
+
+def when_ready(server):
+    """Master, before workers are forked: pull in the heavy client libraries once"""
+    if server.cfg.preload_app:
+        from ocr_backends import preload_modules
+        preload_modules()
+
+
+def post_worker_init(worker):
+    """Worker, app loaded: initialize OCR clients in the background"""
+    # One Vision channel per request thread unless configured otherwise
+    os.environ.setdefault('VISION_POOL_SIZE', str(worker.cfg.threads))
+    import main
+    main.start_warmup()
@@ -0,0 +1,137 @@
+# ==============================================================================
+# image_preprocess.py - Shrink uploads before sending them to OCR
+# ==============================================================================
+import io
+import os
+import logging
+import threading
+from collections import namedtuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+from upload_buffer import UploadBuffer
+
+# EXIF orientations that swap width and height
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+PreparedImage = namedtuple('PreparedImage', ['content', 'image', 'scale_x', 'scale_y', 'original_size'])
+
+logger = logging.getLogger(__name__)
+
+INVALID_IMAGE_MESSAGE = "Invalid image format: the upload is not a readable image"
+
+
+def invalid_image_message(exc):
+    """Client-facing error for an upload PIL could not decode (no file object reprs)"""
+    if isinstance(exc, UnidentifiedImageError):
+        return INVALID_IMAGE_MESSAGE
+    return f"Invalid image format: {str(exc)}"
+
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "passthrough": 0}
+
+
+def preprocess_config_from_env():
+    """OCR_PREPROCESS_* settings (None when the stage is switched off)"""
+    if os.environ.get('OCR_PREPROCESS', '1').lower() in ('0', 'false', 'no'):
+        return None
+    return {
+        "max_dimension": int(os.environ.get('OCR_MAX_DIMENSION', 2000)),
+        "fmt": os.environ.get('OCR_ENCODE_FORMAT', 'JPEG').upper(),
+        "quality": int(os.environ.get('OCR_ENCODE_QUALITY', 85)),
+        "grayscale": os.environ.get('OCR_GRAYSCALE', '1').lower() not in ('0', 'false', 'no'),
+    }
+
+
+def preprocess_for_ocr(upload, max_dimension=2000, fmt='JPEG', quality=85, grayscale=True):
+    """Decode once, apply EXIF orientation, downscale and re-encode for OCR.
+
+    `upload` is an UploadBuffer (or bytes). JPEGs are decoded at reduced DCT
+    scale via Image.draft, then reduce()d and thumbnailed to `max_dimension`
+    on the long edge. Returns (PreparedImage, error); scale_x/scale_y map OCR
+    coordinates back to the upright original.
+    """
+    if not isinstance(upload, UploadBuffer):
+        upload = UploadBuffer.from_bytes(upload)
+    original_bytes = upload.size
+
+    try:
+        img = Image.open(upload.open())
+        raw_width, raw_height = img.size
+        orientation = img.getexif().get(0x0112, 1)
+
+        long_edge = max(raw_width, raw_height)
+        if long_edge > max_dimension and img.format == 'JPEG':
+            ratio = max_dimension / long_edge
+            img.draft('L' if grayscale else 'RGB', (int(raw_width * ratio) + 1, int(raw_height * ratio) + 1))
+        img.load()
+    except Exception as e:
+        return None, invalid_image_message(e)
+
+    if orientation in _ROTATED_ORIENTATIONS:
+        original_size = (raw_height, raw_width)
+    else:
+        original_size = (raw_width, raw_height)
+
+    img = ImageOps.exif_transpose(img)
+    if grayscale:
+        img = img.convert('L')
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    long_edge = max(img.size)
+    if long_edge > max_dimension:
+        factor = long_edge // max_dimension
+        if factor >= 2:
+            img = img.reduce(factor)
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    out = io.BytesIO()
+    img.save(out, format=fmt, quality=quality, optimize=True)
+    content = out.getvalue()
+
+    unchanged = img.size == original_size and orientation == 1
+    passthrough = unchanged and len(content) >= original_bytes
+    if passthrough:
+        # Re-encoding did not help; send the upload as-is
+        content = upload.getvalue()
+    record_preprocess(original_bytes, len(content), passthrough)
+
+    saved = original_bytes - len(content)
+    logger.debug("🗜️ OCR payload %d -> %d bytes (%d%% saved, %dx%d -> %dx%d)",
+                 original_bytes, len(content), saved * 100 // max(1, original_bytes),
+                 original_size[0], original_size[1], img.size[0], img.size[1])
+
+    return PreparedImage(
+        content=content,
+        image=img,
+        scale_x=original_size[0] / img.size[0],
+        scale_y=original_size[1] / img.size[1],
+        original_size=original_size,
+    ), None
+
+
+def record_preprocess(bytes_in, bytes_out, passthrough=False):
+    """Count one preprocessed image (also called for images prepared in cpu_pool workers)"""
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += bytes_in
+        _stats["bytes_out"] += bytes_out
+        _stats["passthrough"] += int(passthrough)
+
+
+def rescale_boxes(boxes, scale_x, scale_y):
+    """Map OCR boxes from the preprocessed image back to original pixels"""
+    if scale_x == 1 and scale_y == 1:
+        return boxes
+    return [
+        [round(x0 * scale_x), round(y0 * scale_y), round(x1 * scale_x), round(y1 * scale_y)]
+        for x0, y0, x1, y1 in boxes
+    ]
+
+
+def preprocess_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    return stats
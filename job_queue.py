@@ -0,0 +1,279 @@
+# ==============================================================================
+# job_queue.py - In-process async job queue for /parse?async=1
+# ==============================================================================
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import ssl
+import socket
+import threading
+import ipaddress
+import http.client
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when no more jobs can be accepted"""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+def resolve_public_address(hostname, port):
+    """(address, error): the address to connect to, or an error message when
+    `hostname` does not resolve or any of its addresses is loopback, private,
+    link-local (e.g. 169.254.169.254 metadata) or otherwise non-public"""
+    try:
+        infos = socket.getaddrinfo(hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return None, f"callback_url host does not resolve: {hostname}"
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not address.is_global:
+            return None, f"callback_url host resolves to a non-public address: {hostname}"
+    return infos[0][4][0], None
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Connects to an already validated address instead of resolving the host
+    again (DNS rebinding); the Host header still carries the URL's hostname"""
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(_PinnedHTTPConnection):
+    """_PinnedHTTPConnection over TLS; SNI and certificate checks use the hostname"""
+
+    default_port = http.client.HTTPS_PORT
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, address, timeout)
+        self.context = ssl.create_default_context()
+
+    def connect(self):
+        super().connect()
+        self.sock = self.context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+class JobQueue:
+    """Bounded queue of parse jobs served by a fixed pool of worker threads.
+
+    A job is any callable returning (response_body, http_status). At most
+    `max_pending` jobs wait for a worker; beyond that submit() raises
+    QueueFullError so the endpoint can answer 429. Finished jobs are kept for
+    `result_ttl` seconds for polling. When a job has a callback URL, its final
+    state is POSTed there as JSON. Callback hosts must be in
+    `allowed_callback_hosts` when it is set, and must resolve to public
+    addresses otherwise; the callback then connects to the address that was
+    checked. Redirects are not followed.
+    """
+
+    def __init__(self, workers=2, max_pending=32, result_ttl=3600,
+                 callback_timeout=10, allowed_callback_hosts=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.callback_timeout = callback_timeout
+        self.allowed_callback_hosts = set(allowed_callback_hosts or [])
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._durations = []  # recent job durations, for Retry-After
+        self._counters = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "callbacks_failed": 0}
+
+    @classmethod
+    def from_env(cls):
+        """Build a queue from JOB_* environment variables"""
+        hosts = [h.strip() for h in os.environ.get('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',') if h.strip()]
+        return cls(
+            workers=int(os.environ.get('JOB_WORKERS', 2)),
+            max_pending=int(os.environ.get('JOB_QUEUE_MAX', 32)),
+            result_ttl=int(os.environ.get('JOB_RESULT_TTL', 3600)),
+            allowed_callback_hosts=hosts,
+        )
+
+    # --------------------------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------------------------
+    def validate_callback_url(self, url):
+        """Return an error message for an unacceptable callback URL, else None"""
+        return self._resolve_callback(url)[2]
+
+    def admission_check(self):
+        """Cheap pre-check before reading an upload: None if a job can be
+        queued right now, else the Retry-After seconds (counted as rejected)"""
+        if not self._queue.full():
+            return None
+        with self._lock:
+            self._counters["rejected"] += 1
+        return self.retry_after()
+
+    def submit(self, fn, *args, callback_url=None):
+        """Queue fn(*args); returns the job id or raises QueueFullError"""
+        self._ensure_workers()
+        self._expire_old_jobs()
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "callback_url": callback_url,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, fn, args))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+                self._counters["rejected"] += 1
+            raise QueueFullError(self.retry_after())
+
+        with self._lock:
+            self._counters["submitted"] += 1
+        return job_id
+
+    def get(self, job_id):
+        """Snapshot of a job (None if unknown or expired)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def retry_after(self):
+        """Seconds a client should wait before retrying a rejected submit"""
+        with self._lock:
+            recent = self._durations[-20:]
+        avg = sum(recent) / len(recent) if recent else 5.0
+        waves = self._queue.qsize() / max(1, self.workers)
+        return max(1, int(round(avg * waves)))
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for j in self._jobs.values() if j["status"] == "running")
+            return dict(
+                self._counters,
+                workers=self.workers,
+                max_pending=self.max_pending,
+                pending=self._queue.qsize(),
+                running=running,
+                tracked=len(self._jobs),
+            )
+
+    # --------------------------------------------------------------------------
+    # Workers
+    # --------------------------------------------------------------------------
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"parse-job-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            job_id, fn, args = self._queue.get()
+            try:
+                self._run(job_id, fn, args)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id, fn, args):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = "running"
+            job["started"] = time.time()
+
+        try:
+            body, http_status = fn(*args)
+            status = "done" if http_status < 400 else "failed"
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            body, http_status = {"status": "error", "message": str(e), "type": type(e).__name__}, 500
+            status = "failed"
+
+        finished = time.time()
+        with self._lock:
+            job.update(status=status, finished=finished, result=body, http_status=http_status)
+            self._counters[status] += 1
+            self._durations.append(finished - job["started"])
+            del self._durations[:-100]
+            snapshot = dict(job)
+
+        if snapshot.get("callback_url"):
+            self._send_callback(snapshot)
+
+    def _resolve_callback(self, url):
+        """(parsed URL, address to connect to, error message); the address is
+        None for allowlisted hosts, which are resolved normally"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            return parsed, None, "callback_url must be an absolute http(s) URL"
+        try:
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        except ValueError:
+            return parsed, None, "callback_url has an invalid port"
+        if self.allowed_callback_hosts:
+            if parsed.hostname not in self.allowed_callback_hosts:
+                return parsed, None, f"callback_url host not allowed: {parsed.hostname}"
+            return parsed, None, None
+        address, error = resolve_public_address(parsed.hostname, port)
+        return parsed, address, error
+
+    def _send_callback(self, job):
+        # Checked again at send time (the name may resolve differently by now),
+        # and the connection goes to the address that passed the check
+        parsed, address, error = self._resolve_callback(job["callback_url"])
+        if error:
+            print(f"[WARN] Job {job['job_id']} callback skipped: {error}")
+            with self._lock:
+                self._counters["callbacks_failed"] += 1
+            return
+        payload = json.dumps({k: v for k, v in job.items() if k != "callback_url"}).encode('utf-8')
+        connection_class = _PinnedHTTPSConnection if parsed.scheme == 'https' else _PinnedHTTPConnection
+        conn = connection_class(parsed.hostname, parsed.port, address, self.callback_timeout)
+        target = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+        try:
+            conn.request("POST", target, body=payload, headers={"Content-Type": "application/json"})
+            callback_status = conn.getresponse().status
+            if callback_status >= 300:
+                raise http.client.HTTPException(f"HTTP {callback_status}")
+        except Exception as e:
+            print(f"[WARN] Job {job['job_id']} callback failed: {e}")
+            callback_status = None
+            with self._lock:
+                self._counters["callbacks_failed"] += 1
+        finally:
+            conn.close()
+
+        with self._lock:
+            if job["job_id"] in self._jobs:
+                self._jobs[job["job_id"]]["callback_status"] = callback_status
+
+    def _expire_old_jobs(self):
+        if self.result_ttl <= 0:
+            return
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [jid for jid, j in self._jobs.items() if j["finished"] and j["finished"] < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
@@ -0,0 +1,77 @@
+# ==============================================================================
+# lazy_resource.py - Build expensive clients once, on first use, from any thread
+# ==============================================================================
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LazyResource:
+    """A value made by `factory()` the first time it is needed.
+
+    The factory runs at most once: concurrent callers wait for the first one
+    and then share its result. A factory returning None (or raising) marks the
+    resource as failed, e.g. missing credentials. warm_up() runs the factory on
+    a daemon thread so the first request does not pay for it.
+    States: pending -> initializing -> ready | failed
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._warming = False
+        self.state = 'pending'
+        self.error = None
+        self.init_seconds = None
+
+    def get(self):
+        """The value (initializing it if needed), or None when unavailable"""
+        if self.state == 'ready':
+            return self._value
+        if self.state == 'failed':
+            return None
+
+        with self._lock:
+            if self.state == 'pending':
+                self.state = 'initializing'
+                start = time.perf_counter()
+                try:
+                    value = self._factory()
+                except Exception as e:
+                    logger.exception("%s init failed", self.name)
+                    value = None
+                    self.error = f"{type(e).__name__}: {e}"
+                self.init_seconds = round(time.perf_counter() - start, 3)
+                self._value = value
+                if value is None:
+                    self.error = self.error or "unavailable"
+                    self.state = 'failed'
+                else:
+                    self.state = 'ready'
+            return self._value
+
+    def peek(self):
+        """The value if already initialized; never triggers initialization"""
+        return self._value if self.state == 'ready' else None
+
+    def warm_up(self):
+        """Start initializing in the background (no-op once started)"""
+        with self._lock:
+            if self.state != 'pending' or self._warming:
+                return None
+            self._warming = True
+        thread = threading.Thread(target=self.get, name=f"warm-up-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+    def describe(self):
+        info = {"name": self.name, "state": self.state}
+        if self.init_seconds is not None:
+            info["init_seconds"] = self.init_seconds
+        if self.error:
+            info["error"] = self.error
+        return info
@@ -3,414 +3,677 @@
 # ==============================================================================
 import os
 import json
-import re
-from flask import Flask, request, jsonify
-from google.cloud import vision
-from google.oauth2 import service_account
-import io
+import time
+import logging
+import sqlite3
+import contextlib
+import contextvars
+from flask import Flask, Request, request, jsonify, g
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
-
-# New imports for Mindee
-try:
-    from mindee_parser import init_mindee_model, parse_with_mindee
-except Exception:
-    # mindee_parser may not be present in some branches; handle gracefully
-    init_mindee_model = None
-    parse_with_mindee = None
+from ocr_cache import OCRCache
+from receipt_pipeline import group_lines, filter_lines, ReceiptParser, outcome_label
+from ocr_backends import OCRBackends, OCRError
+from job_queue import JobQueue, QueueFullError
+from upload_buffer import UploadBuffer
+from image_preprocess import (
+    PreparedImage, preprocess_config_from_env, preprocess_for_ocr, rescale_boxes, preprocess_stats, record_preprocess,
+    invalid_image_message,
+)
+from metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from lazy_resource import LazyResource
+from cpu_pool import CPUPool, is_pool_worker
+from near_duplicates import NearDuplicateIndex, hash_upload, HASH_BITS
+from response_format import FastJSONProvider, shape_from_args, shape_body, encode_body, use_orjson, serializer_name, dumps
+from receipt_store import ReceiptStore
+from admission import RateLimiter, ConcurrencyLimit, OverloadedError, client_key
+from mindee_receipts import MindeeReceipts, receipt_result
 
 # ==============================================================================
 # FLASK APP
 # ==============================================================================
+# /parse-batch takes many phone photos in one body: it gets its own, larger
+# request limit (and a per-file cap, see PARSE_BATCH_* in .env.example)
+PARSE_BATCH_MAX_BYTES = int(float(os.environ.get('PARSE_BATCH_MAX_MB', 256)) * 1024 * 1024)
+PARSE_BATCH_MAX_FILE_BYTES = int(float(os.environ.get('PARSE_BATCH_MAX_FILE_MB', 16)) * 1024 * 1024)
+
+class ReceiptRequest(Request):
+    """Request with a per-route body limit (MAX_CONTENT_LENGTH everywhere but /parse-batch)"""
+
+    @property
+    def max_content_length(self):
+        if self.path == '/parse-batch':
+            return PARSE_BATCH_MAX_BYTES
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = ReceiptRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
+# orjson for jsonify() when installed (see JSON_SERIALIZER in .env.example)
+if use_orjson():
+    app.json = FastJSONProvider(app)
+print(f"✅ JSON serializer: {serializer_name()}")
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # ==============================================================================
-# INITIALIZE GOOGLE VISION
+# LOGGING
 # ==============================================================================
-def init_vision_client():
-    """Initialize Google Vision with credentials from HF Secrets"""
-    try:
-        # Try environment variable first (HF Secret: GOOGLE_CREDENTIALS_JSON)
-        google_creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
-
-        if google_creds_json:
-            print("✅ Using GOOGLE_CREDENTIALS_JSON from secrets")
-            creds_dict = json.loads(google_creds_json)
-            credentials = service_account.Credentials.from_service_account_info(creds_dict)
-            return vision.ImageAnnotatorClient(credentials=credentials)
-
-        # Fallback: try file
-        creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-        if creds_path and os.path.exists(creds_path):
-            print(f"✅ Using credentials file: {creds_path}")
-            return vision.ImageAnnotatorClient()
-
-        print("⚠️ No credentials found, trying default...")
-        return vision.ImageAnnotatorClient()
-
-    except Exception as e:
-        print(f"❌ Vision API init failed: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
-
-print("🚀 Initializing Google Vision API...")
-vision_client = init_vision_client()
-
-# Initialize Mindee (if available)
-mindee_model = None
-if init_mindee_model:
-    try:
-        init_mindee_model()
-    except Exception as e:
-        print(f"[WARN] Mindee init raised: {e}")
+# Per-request diagnostics go through logging (LOG_LEVEL=DEBUG to see parse
+# results) instead of unconditional prints
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger('receipt_api')
+logging.getLogger('PIL').setLevel(max(logging.INFO, logger.getEffectiveLevel()))
 
 # ==============================================================================
-# GOOGLE VISION OCR
+# METRICS
 # ==============================================================================
-def get_ocr_google(image_bytes):
-    """Extract text using Google Vision API"""
-    if not vision_client:
-        return [], [], None, "Google Vision client not initialized"
-
-    try:
-        # Validate image
-        try:
-            img = Image.open(io.BytesIO(image_bytes))
-            img.verify()
-            img = Image.open(io.BytesIO(image_bytes))
-        except Exception as e:
-            return [], [], None, f"Invalid image format: {str(e)}"
-
-        image = vision.Image(content=image_bytes)
-        response = vision_client.document_text_detection(image=image)
-
-        if response.error.message:
-            return [], [], None, f"Google Vision API error: {response.error.message}"
-
-        words = []
-        boxes = []
-
-        for page in response.full_text_annotation.pages:
-            for block in page.blocks:
-                for paragraph in block.paragraphs:
-                    for word in paragraph.words:
-                        word_text = ''.join([symbol.text for symbol in word.symbols])
-                        words.append(word_text)
-
-                        vertices = word.bounding_box.vertices
-                        box = [
-                            vertices[0].x,
-                            vertices[0].y,
-                            vertices[2].x,
-                            vertices[2].y
-                        ]
-                        boxes.append(box)
-
-        return words, boxes, img, None
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return [], [], None, f"OCR error: {str(e)}"
+# Exposed at /metrics in Prometheus text format
+metrics = Registry()
+
+STAGE_SECONDS = metrics.histogram(
+    'receipt_stage_duration_seconds', 'Time spent in each receipt processing stage', ['stage'])
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['endpoint', 'method'])
+HTTP_REQUESTS = metrics.counter(
+    'http_requests_total', 'HTTP requests by endpoint and status code', ['endpoint', 'method', 'code'])
+HTTP_IN_FLIGHT = metrics.gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served', ['endpoint'])
+PARSE_OUTCOMES = metrics.counter(
+    'receipt_parse_outcomes_total', 'Parsed receipts by summary status', ['outcome'])
+OCR_ERRORS = metrics.counter(
+    'ocr_errors_total', 'OCR failures by kind', ['kind'])
+OCR_IMAGES = metrics.counter(
+    'ocr_images_total', 'Images sent to an OCR backend', ['backend', 'mode'])
+ADMISSION_DECISIONS = metrics.counter(
+    'admission_decisions_total', 'Parse requests admitted or shed before the upload is read', ['decision'])
+OCR_SECONDS = metrics.histogram(
+    'ocr_request_duration_seconds', 'Time spent in OCR backend calls (Vision RPC, Tesseract)', ['backend', 'mode'])
+PARSE_ROUTE_SECONDS = metrics.histogram(
+    'parse_route_duration_seconds', 'Parse latency by route and the engine whose result was returned', ['route', 'engine'])
+PARSE_ROUTE_DECISIONS = metrics.counter(
+    'parse_route_decisions_total', 'Rules-or-Mindee decisions of the hybrid and race routes', ['route', 'decision'])
+
+STAGE_PREPARE = STAGE_SECONDS.labels(stage='prepare_image')
+STAGE_GROUP = STAGE_SECONDS.labels(stage='group_lines')
+STAGE_FILTER = STAGE_SECONDS.labels(stage='filter')
+STAGE_PARSE = STAGE_SECONDS.labels(stage='parse')
+STAGE_PHASH = STAGE_SECONDS.labels(stage='perceptual_hash')
+
+@metrics.register_collector
+def collect_component_stats():
+    """Counters owned by the OCR cache, job queue and preprocessing stage"""
+    if ocr_cache:
+        cache = ocr_cache.stats()
+        yield ('ocr_cache_events_total', 'counter', 'OCR cache activity by event',
+               [({"event": k}, cache[k]) for k in ("hits", "disk_hits", "misses", "stores", "evictions", "expired")])
+        yield ('ocr_cache_entries', 'gauge', 'Entries in the in-memory OCR cache', [({}, cache["entries"])])
+        yield ('ocr_cache_bytes', 'gauge', 'Approximate size of the in-memory OCR cache', [({}, cache["bytes"])])
+
+    yield ('ocr_backend_ready', 'gauge', 'OCR backends initialized and usable (1) or not (0)',
+           [({"backend": name}, int(r.state == 'ready')) for name, r in ocr_backends.resources.items()])
+
+    # One family per metric with a sample per backend (a repeated HELP/TYPE
+    # makes Prometheus reject the whole scrape)
+    rpc_events, coalesced_batches, coalesced_images, coalesce_queued = [], [], [], []
+    for name, resource in ocr_backends.resources.items():
+        backend = resource.peek()
+        client = getattr(backend, 'client', None)
+        if hasattr(client, 'stats'):
+            rpc = client.stats()
+            rpc_events.extend(({"backend": name, "event": k}, rpc[k]) for k in
+                              ("calls", "attempts", "retries", "hedges", "hedge_wins", "failures",
+                               "deadline_exceeded", "rejected"))
+        batcher = getattr(backend, 'batcher', None)
+        if batcher:
+            batching = batcher.stats()
+            coalesced_batches.append(({"backend": name}, batching["batches"]))
+            coalesced_images.append(({"backend": name}, batching["items"]))
+            coalesce_queued.append(({"backend": name}, batching["queued"]))
+    if rpc_events:
+        yield ('vision_rpc_events_total', 'counter', 'Vision client calls, attempts, retries and hedges', rpc_events)
+    if coalesced_batches:
+        yield ('ocr_coalesced_batches_total', 'counter', 'Batch calls made from coalesced single-image requests',
+               coalesced_batches)
+        yield ('ocr_coalesced_images_total', 'counter', 'Single-image requests sent inside coalesced batches',
+               coalesced_images)
+        yield ('ocr_coalesce_queued', 'gauge', 'Images waiting for the next coalesced batch', coalesce_queued)
+
+    if near_duplicates:
+        dup = near_duplicates.stats()
+        yield ('receipt_duplicates_total', 'counter', 'Near-duplicate index activity by event',
+               [({"event": k}, dup[k]) for k in ("lookups", "hits", "stores", "evictions", "expired")])
+        yield ('receipt_duplicate_index_entries', 'gauge', 'Receipts in the near-duplicate index',
+               [({}, dup["entries"])])
+
+    if receipt_store:
+        store = receipt_store.stats()
+        yield ('receipt_store_events_total', 'counter', 'Receipt store activity by event',
+               [({"event": k}, store[k]) for k in ("saves", "updates", "reads", "misses", "reparses", "pruned")])
+        yield ('receipt_store_rows', 'gauge', 'Receipts in the persistent store', [({}, store["rows"])])
+
+    if rate_limiter:
+        limits = rate_limiter.stats()
+        yield ('rate_limit_decisions_total', 'counter', 'Rate limiter decisions (backend_errors fail open)',
+               [({"decision": k}, limits[k]) for k in ("allowed", "limited", "backend_errors")])
+        if limits["clients"] is not None:
+            yield ('rate_limit_clients', 'gauge', 'Clients with a token bucket in this process', [({}, limits["clients"])])
+    if ocr_slots:
+        slots = ocr_slots.stats()
+        yield ('ocr_slots_in_use', 'gauge', 'OCR calls holding a concurrency slot', [({}, slots["in_use"])])
+        yield ('ocr_slots_waiting', 'gauge', 'OCR calls waiting for a concurrency slot', [({}, slots["waiting"])])
+        yield ('ocr_slots_limit', 'gauge', 'OCR concurrency slots (OCR_MAX_CONCURRENCY)', [({}, slots["limit"])])
+        yield ('ocr_slot_timeouts_total', 'counter', 'OCR calls that gave up waiting for a slot', [({}, slots["timeouts"])])
+
+    jobs = job_queue.stats()
+    yield ('parse_jobs_total', 'counter', 'Async parse jobs by event',
+           [({"event": k}, jobs[k]) for k in ("submitted", "rejected", "done", "failed", "callbacks_failed")])
+    yield ('parse_jobs_pending', 'gauge', 'Async parse jobs waiting for a worker', [({}, jobs["pending"])])
+    yield ('parse_jobs_running', 'gauge', 'Async parse jobs being processed', [({}, jobs["running"])])
+
+    if cpu_pool:
+        pool = cpu_pool.stats()
+        yield ('cpu_pool_tasks_total', 'counter', 'Tasks run in CPU pool worker processes by event',
+               [({"event": k}, pool[k]) for k in ("submitted", "completed", "failed", "restarts")])
+        yield ('cpu_pool_queue_depth', 'gauge', 'CPU pool tasks waiting for a free worker process',
+               [({}, pool["queue_depth"])])
+        yield ('cpu_pool_in_flight', 'gauge', 'CPU pool tasks queued or running', [({}, pool["in_flight"])])
+        yield ('cpu_pool_workers', 'gauge', 'CPU pool worker processes', [({}, pool["workers"])])
+
+    if OCR_PREPROCESS:
+        pre = preprocess_stats()
+        yield ('ocr_preprocess_images_total', 'counter', 'Images preprocessed before OCR', [({}, pre["images"])])
+        yield ('ocr_preprocess_bytes_total', 'counter', 'Image bytes before and after preprocessing',
+               [({"direction": "in"}, pre["bytes_in"]), ({"direction": "out"}, pre["bytes_out"])])
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.labels(endpoint=g.metrics_endpoint).inc()
+
+@app.after_request
+def record_response_code(response):
+    g.metrics_code = response.status_code
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli JSON bodies per Accept-Encoding (see RESPONSE_COMPRESS* in .env.example)"""
+    if response.mimetype != 'application/json' or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    data, encoding = encode_body(response.get_data(), request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    endpoint = g.get('metrics_endpoint')
+    if endpoint is None:
+        return
+    HTTP_IN_FLIGHT.labels(endpoint=endpoint).dec()
+    HTTP_REQUEST_SECONDS.labels(endpoint=endpoint, method=request.method).observe(
+        time.perf_counter() - g.metrics_started)
+    HTTP_REQUESTS.labels(endpoint=endpoint, method=request.method, code=g.get('metrics_code', 500)).inc()
 
 # ==============================================================================
-# TEXT PROCESSING (FROM NOTEBOOK)
+# INITIALIZE OCR BACKENDS
 # ==============================================================================
-def group_lines_by_height_overlap(words, boxes, overlap_threshold=0.5):
-    """Group words into lines based on vertical overlap"""
-    if not words or not boxes:
-        return ""
-
-    results = []
-    for word, box in zip(words, boxes):
-        bbox = [
-            [box[0], box[1]],
-            [box[2], box[1]],
-            [box[2], box[3]],
-            [box[0], box[3]]
-        ]
-        results.append((bbox, word))
-
-    results = sorted(results, key=lambda r: r[0][0][1])
-    lines = []
-
-    while results:
-        current_item = results.pop(0)
-        box_curr = current_item[0]
-
-        y_min_curr = min(box_curr[0][1], box_curr[1][1])
-        y_max_curr = max(box_curr[2][1], box_curr[3][1])
-        height_curr = y_max_curr - y_min_curr
-
-        current_line = [current_item]
-        remaining_results = []
-
-        for other_item in results:
-            box_other = other_item[0]
-            y_min_other = min(box_other[0][1], box_other[1][1])
-            y_max_other = max(box_other[2][1], box_other[3][1])
-
-            overlap_min = max(y_min_curr, y_min_other)
-            overlap_max = min(y_max_curr, y_max_other)
-            overlap_h = max(0, overlap_max - overlap_min)
-
-            height_other = y_max_other - y_min_other
-            min_height = min(height_curr, height_other)
-
-            if min_height > 0 and (overlap_h / min_height) > overlap_threshold:
-                current_line.append(other_item)
-            else:
-                remaining_results.append(other_item)
-
-        results = remaining_results
-        current_line.sort(key=lambda item: item[0][0][0])
-        lines.append(current_line)
-
-    final_text_lines = []
-    for line_items in lines:
-        line_str = ""
-        for i, item in enumerate(line_items):
-            text = item[1]
-            if i > 0:
-                prev_box = line_items[i-1][0]
-                curr_box = item[0]
-                prev_x_end = max(prev_box[1][0], prev_box[2][0])
-                curr_x_start = min(curr_box[0][0], curr_box[3][0])
-                distance = curr_x_start - prev_x_end
-
-                if distance > 20:
-                    line_str += " \t " + text
-                else:
-                    line_str += " " + text
-            else:
-                line_str += text
-
-        final_text_lines.append(line_str)
+# Google Vision, local Tesseract and the fixture stub (see OCR_BACKEND* in .env.example).
+# Clients are built on first use or by the warm-up below, not at import, so a
+# worker can answer /health/live as soon as it boots.
+ocr_backends = OCRBackends.from_env()
+print(f"✅ OCR backends enabled: {', '.join(ocr_backends.names()) or 'none'} (default: {ocr_backends.default})")
+
+def load_mindee():
+    """Mindee receipt client (MINDEE_API_KEY), or None when not configured"""
+    return MindeeReceipts.from_env()
+
+mindee_parser = LazyResource('mindee', load_mindee)
+
+# Image preparation and grouping/filtering/parsing in worker processes
+# (CPU_POOL_WORKERS > 0; see .env.example). Processes start with the warm-up.
+cpu_pool = CPUPool.from_env()
+if cpu_pool:
+    print(f"✅ CPU pool: {cpu_pool.workers} worker processes ({cpu_pool.start_method})")
+
+# OCR_WARMUP=1 initializes clients on a background thread right after start-up.
+# Under gunicorn the hook in gunicorn.conf.py starts it in each worker instead,
+# since threads and gRPC channels do not survive the fork after --preload.
+OCR_WARMUP = os.environ.get('OCR_WARMUP', '1').lower() not in ('0', 'false', 'no')
+WARMUP_DEFERRED = os.environ.get('OCR_WARMUP_DEFERRED', '0') == '1'
+
+def start_warmup():
+    """Initialize OCR backends and Mindee in the background (idempotent)"""
+    if not OCR_WARMUP:
+        return
+    ocr_backends.warm_up()
+    mindee_parser.warm_up()
+    if cpu_pool:
+        cpu_pool.warm_up()
+
+# Spawned CPU pool workers re-import this module when it is the script being run
+if not WARMUP_DEFERRED and not is_pool_worker():
+    start_warmup()
+
+# OCR result cache (keyed by image hash; see OCR_CACHE_* in .env.example)
+ocr_cache = OCRCache.from_env()
+if ocr_cache:
+    print(f"✅ OCR cache enabled (max {ocr_cache.max_entries} entries, ttl {ocr_cache.ttl}s, disk: {ocr_cache.disk_dir or 'off'})")
+
+# Same receipt uploaded again as a different photo/file (see NEAR_DUP_* in .env.example)
+near_duplicates = NearDuplicateIndex.from_env()
+if near_duplicates:
+    print(f"✅ Near-duplicate detection enabled (max {near_duplicates.max_entries} receipts, "
+          f"distance <= {near_duplicates.max_distance} bits)")
+
+# Parsed receipts with their OCR output, kept across restarts (see RECEIPT_STORE_* in .env.example)
+receipt_store = ReceiptStore.from_env(dumps=dumps)
+if receipt_store:
+    print(f"✅ Receipt store: {receipt_store.path}")
 
-    return "\n".join(final_text_lines)
-
-def smart_filter_receipt(text):
-    """Filter receipt text"""
-    if not text or text.strip() == "":
-        return ""
-
-    lines = text.split('\n')
-
-    blacklist_patterns = [
-        r'No\.|Trans|Date|Time|Tanggal|Waktu|Kasir|Table|Bill|Receipt|Welcome|Thank',
-        r'Phone|Fax|Email|Website|WWW|Telp',
-        r'MANDIRI|BCA|BNI|BRI|CIMB|DANAMON|PERMATA|MAYBANK',
-        r'QRIS|GOPAY|OVO|DANA|LINKAJA|SHOPEEPAY',
-        r'DEBIT|CREDIT|CARD|KARTU|EDC|FLASH|E-MONEY',
-        r'TUNAI|PAID|LUNAS|BAYAR',
-        r'\d{2}[-./]\d{2}[-./]\d{2,4}',
-        r'[A-Z0-9]{12,}'
-    ]
+# ==============================================================================
+# ADMISSION CONTROL
+# ==============================================================================
+# Per-client token buckets and a cap on concurrent OCR calls (see RATE_LIMIT_*
+# and OCR_MAX_CONCURRENCY in .env.example). Checked before the upload is read.
+rate_limiter = RateLimiter.from_env()
+ocr_slots = ConcurrencyLimit.from_env()
+if rate_limiter:
+    print(f"✅ Rate limit: {rate_limiter.per_minute:g}/min per client, burst {rate_limiter.burst} ({rate_limiter.backend.name})")
+if ocr_slots:
+    print(f"✅ OCR concurrency: {ocr_slots.limit} slots, {ocr_slots.max_waiting} waiting max")
+
+ADMISSION_ENDPOINTS = {'/parse', '/scan', '/parse-mindee', '/parse-batch'}
+ASYNC_ENDPOINTS = {'/parse', '/scan'}
+
+# Behind the Hugging Face proxy every request comes from the proxy's address.
+# Each proxy appends the address it saw to X-Forwarded-For, so with N trusted
+# proxies the client is the Nth hop from the right; anything left of it is
+# whatever the client sent and must not pick the bucket. 0 = ignore the header.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+
+def request_client_key(headers, remote_addr):
+    """Rate limit key for a request: its API key if it sends one, else the client IP"""
+    api_key = headers.get('X-API-Key')
+    authorization = headers.get('Authorization') or ''
+    if not api_key and authorization.lower().startswith('bearer '):
+        api_key = authorization[7:].strip()
+    address = remote_addr
+    forwarded = headers.get('X-Forwarded-For')
+    if RATE_LIMIT_TRUSTED_PROXIES > 0 and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        # Fewer hops than trusted proxies: the request did not come through them
+        if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES:
+            address = hops[-RATE_LIMIT_TRUSTED_PROXIES]
+    return client_key(api_key, address)
+
+def admission_check(content_length, key, max_length=None, slots=ocr_slots):
+    """None when a parse request may proceed, else (body, http status, headers) to reject it with.
+
+    `slots` is the OCR concurrency limit the request would wait on (asgi.py
+    passes its own).
+    """
+    max_length = max_length or app.config['MAX_CONTENT_LENGTH']
+    if content_length and content_length > max_length:
+        ADMISSION_DECISIONS.labels(decision='too_large').inc()
+        return {"status": "error", "message": f"Upload too large (max {max_length // (1024 * 1024)}MB)"}, 413, {}
+
+    # Before the rate limit, so a shed request does not cost the client a token
+    if slots and slots.saturated():
+        ADMISSION_DECISIONS.labels(decision='overloaded').inc()
+        return {
+            "status": "error",
+            "message": "Server busy, all OCR slots in use. Retry later.",
+            "retry_after": OCR_UNAVAILABLE_RETRY_AFTER
+        }, 503, {'Retry-After': str(OCR_UNAVAILABLE_RETRY_AFTER)}
 
-    blacklist_regex = re.compile('|'.join(blacklist_patterns), re.IGNORECASE)
-    money_regex = re.compile(r'(?:Rp\.?\s*|@\s*|x\s*)?(\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{0,2})?)', re.IGNORECASE)
-    keyword_regex = re.compile(r'TOTAL|SUBTOTAL|TAX|PAJAK|PPN|HARGA|QTY|ITEM|DISKON|SC|SERVICE', re.IGNORECASE)
+    rejection = rate_limit_check(key)
+    if rejection:
+        return rejection
 
-    final_lines = []
+    ADMISSION_DECISIONS.labels(decision='admitted').inc()
+    return None
 
-    for i, line in enumerate(lines):
-        line_clean = line.strip()
-        if not line_clean or blacklist_regex.search(line_clean):
-            continue
+def rate_limit_check(key, cost=1):
+    """Spend `cost` tokens of the client's bucket; None when allowed, else a 429 rejection"""
+    if not rate_limiter:
+        return None
+    retry_after = rate_limiter.acquire(key, cost)
+    if not retry_after:
+        return None
+    ADMISSION_DECISIONS.labels(decision='rate_limited').inc()
+    return {
+        "status": "error",
+        "message": "Too many requests. Retry later.",
+        "retry_after": retry_after
+    }, 429, {'Retry-After': str(retry_after)}
+
+def is_async_request(args):
+    """?async=1 (query string only, so it can be checked before the body is read)"""
+    return args.get('async', '').lower() in ('1', 'true', 'yes')
+
+# Set by asgi.py for requests it already admitted before buffering their body
+# for this app (WSGIMiddleware reads the whole body before any Flask hook runs)
+admitted_upstream = contextvars.ContextVar('admitted_upstream', default=False)
+
+@app.before_request
+def admit_request():
+    """Shed parse requests (size, full job queue, rate, OCR saturation) before their body is read"""
+    if g.get('metrics_endpoint') not in ADMISSION_ENDPOINTS or admitted_upstream.get():
+        return None
+    # Nothing here may touch request.values/form/files: that parses the whole upload
+    if g.metrics_endpoint in ASYNC_ENDPOINTS and is_async_request(request.args):
+        retry_after = job_queue.admission_check()
+        if retry_after:
+            return queue_full_response(retry_after)
+    rejection = admission_check(request.content_length, request_client_key(request.headers, request.remote_addr),
+                                request.max_content_length)
+    if rejection:
+        body, http_status, headers = rejection
+        response = jsonify(body)
+        response.headers.update(headers)
+        return response, http_status
+    return None
+
+def ocr_slot():
+    """Context holding an OCR concurrency slot (raises OverloadedError when none frees up in time)"""
+    return ocr_slots.slot() if ocr_slots else contextlib.nullcontext()
 
-        is_service_change = "SERVICE" in line_clean.upper() and "CHANGE" in line_clean.upper()
+# ==============================================================================
+# OCR
+# ==============================================================================
+# Downscale/re-encode uploads before OCR (see OCR_PREPROCESS_* in .env.example)
+OCR_PREPROCESS = preprocess_config_from_env()
+
+# Retry-After (seconds) sent with 503 when the OCR service stays unavailable
+OCR_UNAVAILABLE_RETRY_AFTER = 2
+
+def as_upload(image):
+    """Accept raw bytes or an UploadBuffer"""
+    return image if isinstance(image, UploadBuffer) else UploadBuffer.from_bytes(image)
+
+def resolve_ocr_backend(name=None):
+    """Requested (or default) OCR backend; returns (backend, error message)"""
+    backend = ocr_backends.get(name)
+    if backend:
+        return backend, None
+    if name:
+        available = ', '.join(ocr_backends.names()) or 'none'
+        return None, f"OCR backend '{name}' is not available. Available: {available}"
+    return None, "No OCR backend configured. Add GOOGLE_CREDENTIALS_JSON to Hugging Face Secrets."
+
+def ocr_cache_key(upload, backend):
+    """Cache key per image and backend (Google keeps the bare hash used by existing cache entries)"""
+    if not ocr_cache:
+        return None
+    if backend.name == 'google':
+        return upload.sha256
+    return f"{upload.sha256}-{backend.name}"
 
-        if not is_service_change and re.search(r'CHANGE|KEMBALI|CASH', line_clean, re.IGNORECASE):
-            continue
+def validate_image(upload):
+    """Check that the upload decodes as an image; returns (PIL image, error)"""
+    try:
+        img = Image.open(upload.open())
+        img.verify()
+        img = Image.open(upload.open())
+    except Exception as e:
+        return None, invalid_image_message(e)
+    return img, None
+
+def prepare_ocr_image(upload, backend):
+    """Validate an upload and build the payload sent to OCR; returns (PreparedImage, error)"""
+    # The stub backend replays fixtures keyed by the uploaded bytes, so it
+    # must receive them unchanged
+    config = None if backend.replays_original_bytes else OCR_PREPROCESS
+    if cpu_pool:
+        return prepare_in_pool(upload, config)
+
+    if config is None:
+        img, error = validate_image(upload)
+        if error:
+            return None, error
+        return PreparedImage(upload.getvalue(), img, 1, 1, img.size), None
+
+    return preprocess_for_ocr(upload, **config)
+
+def prepare_in_pool(upload, config):
+    """prepare_ocr_image() in a cpu_pool worker; the PreparedImage carries no decoded image"""
+    content, scale_x, scale_y, original_size, passthrough, error = cpu_pool.prepare(upload, config)
+    if error:
+        return None, error
+    if content is None:
+        content = upload.getvalue()
+    if config is not None:
+        record_preprocess(upload.size, len(content), passthrough)
+    return PreparedImage(content, None, scale_x, scale_y, original_size), None
+
+def get_ocr(image_bytes, backend=None):
+    """Extract words/boxes with an OCR backend (served from ocr_cache on repeat uploads).
+
+    Returns (words, boxes, PIL image, error); error is an OCRError or None.
+    """
+    backend = backend or ocr_backends.get()
+    if not backend:
+        OCR_ERRORS.labels(kind='not_configured').inc()
+        return [], [], None, OCRError("No OCR backend configured", kind='not_configured')
+
+    upload = as_upload(image_bytes)
+    cache_key = ocr_cache_key(upload, backend)
+    if cache_key:
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            words, boxes = cached
+            return words, boxes, None, None
 
-        has_money = money_regex.search(line_clean)
-        has_keyword = keyword_regex.search(line_clean)
-
-        if has_money or has_keyword:
-            if has_money and not has_keyword and i > 0:
-                prev_line = lines[i-1].strip()
-                if (not blacklist_regex.search(prev_line) and
-                    not money_regex.search(prev_line) and
-                    not keyword_regex.search(prev_line) and
-                    (len(final_lines) == 0 or final_lines[-1] != prev_line)):
-                    final_lines.append(prev_line)
-            final_lines.append(line_clean)
-
-    return '\n'.join(final_lines)
-
-def parse_receipt_to_json(clean_text):
-    """Parse receipt to JSON"""
-    if not clean_text:
-        return {}
-
-    lines = clean_text.split('\n')
-
-    item_pattern = re.compile(r'^(.*?)\s*((?:Rp\.?\s*)?[\d,.]+)$', re.IGNORECASE)
-    qty_specific_pattern = re.compile(r'(?:^|\s)[x@]\s*(\d+)|(\d+)\s*[x@]', re.IGNORECASE)
-    separator_pattern = re.compile(r'^[\-=_]{3,}$')
-    metadata_pattern = re.compile(r'^(OPERATOR|CASHIER|KASIR|SERVER|TABLE|TBL|POS|SHIFT|WAKTU|DATE|TIME|NO\.|ORDER|PICKUP|QUEUE|ANTRIAN)', re.IGNORECASE)
-
-    def parse_price(price_str):
-        digits = re.sub(r'\D', '', price_str)
-        return int(digits) if digits else 0
-
-    items = []
-    grand_total = 0
-    tax = 0
-    service = 0
-    total_discount = 0
-    pending_name = None
-
-    forbidden_items = re.compile(r'TOTAL|SUBTOTAL|BELANJA|JUAL|HEMAT|PAYMENT|NPWP|DPP|PURCHASE|VAT|HASE|CHANGE|KEMBALI|CASH|TUNAI|DEBIT|CREDIT|ITEM|ITEMS|QTY|MENU|EDC|MANUAL', re.IGNORECASE)
-    discount_keywords = re.compile(r'DISKON|DISC|VOUCHER|POTONGAN|PROMO|HEMAT', re.IGNORECASE)
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
+    try:
+        # Validate image and shrink it for upload (decoded once)
+        with STAGE_PREPARE.time():
+            prepared, error = prepare_ocr_image(upload, backend)
+        if error:
+            OCR_ERRORS.labels(kind='invalid_image').inc()
+            return [], [], None, OCRError(error, kind='invalid_image')
 
-        if separator_pattern.match(line) or metadata_pattern.search(line):
-            pending_name = None
-            continue
+        OCR_IMAGES.labels(backend=backend.name, mode='single').inc()
+        with ocr_slot(), OCR_SECONDS.labels(backend=backend.name, mode='single').time():
+            words, boxes = backend.recognize(prepared.content, prepared.image)
+        boxes = rescale_boxes(boxes, prepared.scale_x, prepared.scale_y)
 
-        if re.search(r'^(Grand\s*Total|Total\s*Bayar|Amount|Tagihan|Net|Total\s+[A-Z]+|Total\b)', line, re.IGNORECASE):
-            if not re.search(r'(Sub|Disc|Hemat|Saving|Item)', line, re.IGNORECASE):
-                parts = item_pattern.search(line)
-                if parts:
-                    found_total = parse_price(parts.group(2))
-                    if found_total > 0:
-                        grand_total = found_total
-            continue
+        if cache_key:
+            ocr_cache.put(cache_key, words, boxes)
 
-        if re.search(r'(Tax|Pajak|PB1|PPN|VAT)', line, re.IGNORECASE):
-            parts = item_pattern.search(line)
-            if parts:
-                tax = parse_price(parts.group(2))
-            continue
+        return words, boxes, prepared.image, None
 
-        if re.search(r'(Service|SC[:\s]|Charge)', line, re.IGNORECASE):
-            parts = item_pattern.search(line)
-            if parts:
-                service = parse_price(parts.group(2))
-            continue
+    except OCRError as e:
+        OCR_ERRORS.labels(kind=e.kind).inc()
+        return [], [], None, e
 
-        qty_match = qty_specific_pattern.search(line)
-        price_match = item_pattern.search(line)
+    except OverloadedError as e:
+        OCR_ERRORS.labels(kind='overloaded').inc()
+        return [], [], None, OCRError(str(e), kind='overloaded')
 
-        if pending_name and price_match:
-            current_line_name = price_match.group(1).strip()
-            if forbidden_items.search(current_line_name):
-                pending_name = None
-            else:
-                total_price = parse_price(price_match.group(2))
-
-                if discount_keywords.search(pending_name):
-                    total_discount += abs(total_price)
-                    pending_name = None
-                    continue
-
-                calc_qty = 1
-                if qty_match:
-                    q_val = qty_match.group(1) or qty_match.group(2)
-                    if q_val:
-                        calc_qty = int(q_val)
-
-                if not forbidden_items.search(pending_name):
-                    items.append({
-                        "name": pending_name,
-                        "qty": calc_qty,
-                        "unit_price": total_price // calc_qty if calc_qty > 0 else total_price,
-                        "line_total": total_price
-                    })
-                pending_name = None
+    except Exception as e:
+        logger.exception("OCR failed")
+        OCR_ERRORS.labels(kind='exception').inc()
+        return [], [], None, OCRError(f"OCR error: {str(e)}", kind='exception')
+
+def get_ocr_batch(images, backend=None):
+    """OCR many images (bytes or UploadBuffers) in as few backend calls as possible; returns [(words, boxes, error), ...]"""
+    backend = backend or ocr_backends.get()
+    if not backend:
+        OCR_ERRORS.labels(kind='not_configured').inc(len(images))
+        return [([], [], "No OCR backend configured") for _ in images]
+
+    results = [None] * len(images)
+    pending = []  # (index, cache_key, PreparedImage) still needing OCR
+
+    for i, image in enumerate(images):
+        upload = as_upload(image)
+        cache_key = ocr_cache_key(upload, backend)
+        if cache_key:
+            cached = ocr_cache.get(cache_key)
+            if cached is not None:
+                results[i] = (cached[0], cached[1], None)
                 continue
 
-        if not pending_name and items and (qty_match or ("@" in line and price_match)):
-            qty_val = 1
-            if qty_match:
-                q = qty_match.group(1) or qty_match.group(2)
-                if q:
-                    qty_val = int(q)
-
-            if price_match:
-                unit = parse_price(price_match.group(2))
-                items[-1]['unit_price'] = unit
-                if qty_val > 1:
-                    items[-1]['qty'] = qty_val
-            elif qty_val > 1:
-                items[-1]['qty'] = qty_val
+        with STAGE_PREPARE.time():
+            prepared, error = prepare_ocr_image(upload, backend)
+        if error:
+            OCR_ERRORS.labels(kind='invalid_image').inc()
+            results[i] = ([], [], error)
             continue
+        pending.append((i, cache_key, prepared))
 
-        if price_match:
-            name = price_match.group(1).strip()
-            total_price = parse_price(price_match.group(2))
+    if not pending:
+        return results
 
-            if forbidden_items.search(name):
-                continue
-            if total_price > 100000000:
-                continue
-
-            if len(name) > 1:
-                if discount_keywords.search(name):
-                    total_discount += abs(total_price)
-                    continue
-
-                items.append({
-                    "name": name,
-                    "qty": 1,
-                    "unit_price": total_price,
-                    "line_total": total_price
-                })
-            pending_name = None
+    OCR_IMAGES.labels(backend=backend.name, mode='batch').inc(len(pending))
+    try:
+        with ocr_slot(), OCR_SECONDS.labels(backend=backend.name, mode='batch').time():
+            recognized = backend.recognize_batch(
+                [prepared.content for _, _, prepared in pending],
+                [prepared.image for _, _, prepared in pending],
+            )
+    except OverloadedError as e:
+        recognized = [([], [], OCRError(str(e), kind='overloaded')) for _ in pending]
+
+    for (i, cache_key, prepared), (words, boxes, error) in zip(pending, recognized):
+        if error:
+            OCR_ERRORS.labels(kind=error.kind).inc()
+            results[i] = ([], [], str(error))
             continue
 
-        if not price_match:
-            if not forbidden_items.search(line):
-                if not re.match(r'^[\-=_]+$', line):
-                    pending_name = line
-
-    calc_subtotal = sum(i['line_total'] for i in items)
-    final_calc_total = calc_subtotal - total_discount + tax + service
+        boxes = rescale_boxes(boxes, prepared.scale_x, prepared.scale_y)
+        if cache_key:
+            ocr_cache.put(cache_key, words, boxes)
+        results[i] = (words, boxes, None)
 
-    gap = grand_total - final_calc_total
+    return results
 
-    if tax > 0 and abs(gap) == tax:
-        tax = 0
-        final_calc_total = grand_total
+# ==============================================================================
+# RECEIPT PIPELINE
+# ==============================================================================
+# Requests to the CPU pool in flight per /parse-batch (unused without the pool)
+PARSE_BATCH_WORKERS = int(os.environ.get('PARSE_BATCH_WORKERS', 4))
+PARSE_BATCH_MAX_FILES = int(os.environ.get('PARSE_BATCH_MAX_FILES', 50))
+batch_executor = ThreadPoolExecutor(max_workers=PARSE_BATCH_WORKERS, thread_name_prefix='parse-batch')
+
+# Background jobs for /parse?async=1 (see JOB_* in .env.example)
+job_queue = JobQueue.from_env()
+
+def build_parse_response(words, boxes):
+    """Run grouping, filtering and parsing on OCR output; returns the /parse response body"""
+    if not words:
+        PARSE_OUTCOMES.labels(outcome='no_text').inc()
+        return {
+            "status": "success",
+            "message": "No text detected in image",
+            "data": {
+                "items": [],
+                "summary": {
+                    "subtotal": 0,
+                    "total_discount": 0,
+                    "tax": 0,
+                    "service": 0,
+                    "grand_total": 0,
+                    "calculated_total": 0,
+                    "diff": 0
+                },
+                "status": "No Text Detected"
+            }
+        }
 
-    if grand_total == 0:
-        if final_calc_total > 0:
-            status = "Total Not Found (Auto-Calculated)"
-            grand_total = final_calc_total
-        else:
-            status = "Total Not Found"
+    if cpu_pool:
+        # Steps 2-4 in a worker process, timed there
+        clean_text, json_result, (group_s, filter_s, parse_s) = cpu_pool.parse(words, boxes)
+        STAGE_GROUP.observe(group_s)
+        STAGE_FILTER.observe(filter_s)
+        STAGE_PARSE.observe(parse_s)
     else:
-        diff = grand_total - final_calc_total
-        status = f"Gap {diff}" if abs(diff) > 1000 else "Balanced"
+        # Step 2: Group words into lines
+        with STAGE_GROUP.time():
+            lines = group_lines(words, boxes)
+
+        # Step 3: Filter receipt lines
+        with STAGE_FILTER.time():
+            clean_lines = list(filter_lines(lines))
+
+        # Step 4: Parse to JSON, line by line
+        with STAGE_PARSE.time():
+            parser = ReceiptParser()
+            for line in clean_lines:
+                parser.feed(line)
+            json_result = parser.result()
+        clean_text = "\n".join(clean_lines)
+    PARSE_OUTCOMES.labels(outcome=outcome_label(json_result.get("status", ""))).inc()
 
     return {
-        "items": items,
-        "summary": {
-            "subtotal": calc_subtotal,
-            "total_discount": total_discount,
-            "tax": tax,
-            "service": service,
-            "grand_total": grand_total,
-            "calculated_total": final_calc_total,
-            "diff": grand_total - final_calc_total
-        },
-        "status": status
+        "status": "success",
+        "data": json_result,
+        "debug": {
+            "words_detected": len(words),
+            "lines_after_filter": clean_text.count('\n') + 1,
+            "raw_text": clean_text
+        }
     }
 
+# ==============================================================================
+# REQUEST MEMORY REPORTING
+# ==============================================================================
+# REPORT_MEMORY=1 traces Python allocations and reports each request's peak
+# above its starting point (X-Peak-Memory-KB) next to the process max RSS
+# (X-Max-RSS-KB). Tracing is process-wide and slows requests down, so it is
+# meant for measurement runs; concurrent requests inflate each other's peaks.
+REPORT_MEMORY = os.environ.get('REPORT_MEMORY', '0').lower() in ('1', 'true', 'yes')
+
+if REPORT_MEMORY:
+    import tracemalloc
+    try:
+        import resource
+    except ImportError:  # Windows
+        resource = None
+
+    tracemalloc.start()
+
+    @app.before_request
+    def start_memory_trace():
+        g.traced_at_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    @app.after_request
+    def report_memory(response):
+        _, peak = tracemalloc.get_traced_memory()
+        peak_kb = max(0, peak - g.get('traced_at_start', 0)) // 1024
+        response.headers['X-Peak-Memory-KB'] = str(peak_kb)
+        max_rss = ""
+        if resource:
+            max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            response.headers['X-Max-RSS-KB'] = str(max_rss_kb)
+            max_rss = f", max RSS {max_rss_kb}KB"
+        logger.info("📈 %s %s: peak +%dKB traced%s", request.method, request.path, peak_kb, max_rss)
+        return response
+
 # ==============================================================================
 # FLASK ROUTES
 # ==============================================================================
+# Backend initialization state -> the google_vision field clients already read
+GOOGLE_VISION_STATUS = {
+    "ready": "connected",
+    "pending": "initializing",
+    "initializing": "initializing",
+}
+
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({
@@ -419,10 +682,21 @@ def home():
         "version": "3.1",
         "approach": "Google Vision OCR + Rule-based Pattern Matching",
         "accuracy": "59.5% (22/37 receipts balanced on test set)",
-        "google_vision_status": "connected" if vision_client else "not configured",
+        "google_vision_status": GOOGLE_VISION_STATUS.get(ocr_backends.state('google'), "not configured"),
+        "ocr_backends": ocr_backends.names(),
         "endpoints": {
             "/parse": "POST - Upload receipt image (multipart/form-data, field: 'file')",
-            "/health": "GET - Health check"
+            "/parse?ocr=<backend>": "POST - Pick the OCR backend for this request (google, tesseract, stub)",
+            "/parse?route=hybrid": "POST - Rules first, Mindee only for receipts the rules cannot balance (route=race: also start Mindee when the rules are slow)",
+            "/parse?async=1": "POST - Queue a receipt, returns job_id (optional 'callback_url' gets the result POSTed)",
+            "/jobs/<job_id>": "GET - Status/result of an async parse job",
+            "/receipts/<receipt_id>": "GET - A stored parse result (needs RECEIPT_STORE_PATH)",
+            "/receipts/<receipt_id>/reparse": "POST - Re-run the current rules over a stored receipt's OCR output",
+            "/parse-batch": "POST - Upload several receipt images (multipart/form-data, field: 'files', repeated)",
+            "/health": "GET - Health check",
+            "/health/live": "GET - Liveness probe (process is up)",
+            "/health/ready": "GET - Readiness probe (OCR backend initialized; 503 until then)",
+            "/metrics": "GET - Prometheus metrics (stage latencies, outcomes, cache and queue counters)"
         },
         "usage_example": {
             "curl": "curl -X POST -F 'file=@receipt.jpg' https://YOUR-SPACE.hf.space/parse",
@@ -432,27 +706,71 @@ def home():
 
 @app.route('/health', methods=['GET'])
 def health():
-    if vision_client:
+    """Overall status; reports readiness but never waits for client initialization"""
+    if ocr_backends:
+        ready = ocr_backends.ready_backend() is not None
         return jsonify({
-            "status": "healthy",
-            "google_vision": "connected",
-            "memory_usage": "~50MB"
+            "status": "healthy" if ready else "starting",
+            "live": True,
+            "ready": ready,
+            "google_vision": GOOGLE_VISION_STATUS.get(ocr_backends.state('google'), "not configured"),
+            "ocr_backends": ocr_backends.describe(),
+            "mindee": mindee_parser.describe(),
+            "memory_usage": "~50MB",
+            "ocr_cache": ocr_cache.stats() if ocr_cache else "disabled",
+            "job_queue": job_queue.stats(),
+            "ocr_preprocess": preprocess_stats() if OCR_PREPROCESS else "disabled",
+            "cpu_pool": cpu_pool.stats() if cpu_pool else "disabled",
+            "near_duplicates": near_duplicates.stats() if near_duplicates else "disabled",
+            "receipt_store": receipt_store.stats() if receipt_store else "disabled",
+            "rate_limit": rate_limiter.stats() if rate_limiter else "disabled",
+            "ocr_slots": ocr_slots.stats() if ocr_slots else "unlimited",
+            "parse_routes": {"default": PARSE_ROUTE, "escalate_on": sorted(HYBRID_ESCALATE_ON), "race_ms": HYBRID_RACE_MS}
         }), 200
     else:
         return jsonify({
             "status": "unhealthy",
             "google_vision": "not configured",
-            "help": "Add GOOGLE_CREDENTIALS_JSON to Hugging Face Secrets (Settings > Repository secrets)"
+            "ocr_backends": ocr_backends.describe(),
+            "help": "Add GOOGLE_CREDENTIALS_JSON to Hugging Face Secrets (Settings > Repository secrets), "
+                    "or install Tesseract / set VISION_STUB_FIXTURES for a local backend"
         }), 500
 
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the worker is up and serving requests"""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: the default OCR backend is initialized (starts warm-up if nothing has)"""
+    ocr_backends.warm_up()
+    backend = ocr_backends.ready_backend()
+    if backend:
+        return jsonify({"status": "ready", "ocr_backend": backend.name}), 200
+    return jsonify({
+        "status": "starting" if ocr_backends else "unavailable",
+        "ocr_backends": ocr_backends.describe()
+    }), 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return app.response_class(metrics.render(), status=200, content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/parse', methods=['POST'])
 def parse_receipt():
-    """Main parsing endpoint"""
-    if not vision_client:
-        return jsonify({
-            "status": "error",
-            "message": "Google Vision API not configured. Add GOOGLE_CREDENTIALS_JSON to Hugging Face Secrets."
-        }), 500
+    """Main parsing endpoint (?async=1 queues the receipt and returns a job id, ?ocr= picks the backend,
+    ?dedupe=0 parses even when the receipt was seen before, ?route=hybrid|race escalates to Mindee;
+    ?debug=0, ?fields=, ?items=array and ?format=compact shrink the response, see response_format.py)"""
+    requested_ocr = request.values.get('ocr')
+    backend, backend_error = resolve_ocr_backend(requested_ocr)
+    if not backend:
+        return jsonify({"status": "error", "message": backend_error}), 400 if requested_ocr else 500
+
+    route = parse_route(request.values.get('route'))
+    if not route:
+        return jsonify({"status": "error", "message": f"Unknown route. Available: {', '.join(PARSE_ROUTES)}"}), 400
 
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file uploaded. Use field name 'file'"}), 400
@@ -468,69 +786,432 @@ def parse_receipt():
             "message": f"Invalid format. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         }), 400
 
+    async_mode = is_async_request(request.args)
+    dedupe = request.values.get('dedupe', '1').lower() not in ('0', 'false', 'no')
+    client = request_client_key(request.headers, request.remote_addr)
+    callback_url = request.args.get('callback_url') or request.form.get('callback_url')
+    if async_mode:
+        if callback_url:
+            callback_error = job_queue.validate_callback_url(callback_url)
+            if callback_error:
+                return jsonify({"status": "error", "message": callback_error}), 400
+
     try:
-        image_bytes = file.read()
+        # The upload stays in werkzeug's spooled file; no bytes copy here
+        upload = UploadBuffer.from_file_storage(file)
 
-        if len(image_bytes) == 0:
+        if upload.size == 0:
             return jsonify({"status": "error", "message": "Empty file"}), 400
 
-        # Step 1: OCR with Google Vision
-        words, boxes, pil_image, error = get_ocr_google(image_bytes)
+        if async_mode:
+            # The request's file is closed at teardown, so the job gets its own spool
+            job_upload = upload.detach()
+            try:
+                if route == 'rules':
+                    job_id = job_queue.submit(process_receipt, job_upload, backend, dedupe, client,
+                                              callback_url=callback_url)
+                else:
+                    job_id = job_queue.submit(route_receipt, job_upload, file.filename, backend, dedupe, route, client,
+                                              callback_url=callback_url)
+            except QueueFullError as e:
+                job_upload.close()
+                return queue_full_response(e.retry_after)
+            return jsonify({
+                "status": "accepted",
+                "job_id": job_id,
+                "status_url": f"/jobs/{job_id}"
+            }), 202
+
+        if route == 'rules':
+            started = time.perf_counter()
+            body, http_status = process_receipt(upload, backend, dedupe, client)
+            PARSE_ROUTE_SECONDS.labels(route='rules', engine='rules').observe(time.perf_counter() - started)
+        else:
+            body, http_status = route_receipt(upload, file.filename, backend, dedupe, route, client)
+        response = jsonify(shape_body(body, shape_from_args(request.args)))
+        if http_status == 503:
+            response.headers['Retry-After'] = str(OCR_UNAVAILABLE_RETRY_AFTER)
+        return response, http_status
 
-        if error:
-            return jsonify({"status": "error", "message": error}), 500
+    except Exception as e:
+        logger.exception("%s failed", request.path)
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "type": type(e).__name__
+        }), 500
 
-        if not words:
-            return jsonify({
-                "status": "success",
-                "message": "No text detected in image",
-                "data": {
-                    "items": [],
-                    "summary": {
-                        "subtotal": 0,
-                        "total_discount": 0,
-                        "tax": 0,
-                        "service": 0,
-                        "grand_total": 0,
-                        "calculated_total": 0,
-                        "diff": 0
-                    },
-                    "status": "No Text Detected"
-                }
-            }), 200
+def process_receipt(upload, backend=None, dedupe=True, client=None):
+    """OCR + parse one image; returns (response body, http status).
 
-        # Step 2: Group words into lines
-        full_text = group_lines_by_height_overlap(words, boxes)
+    `client` (request_client_key()) scopes near-duplicate matches: a receipt
+    only matches earlier uploads from the same client.
+    """
+    backend = backend or ocr_backends.get()
+    try:
+        # Step 0: the same receipt parsed before from another photo/file?
+        phash = None
+        if dedupe and backend:
+            phash, duplicate = find_duplicate(upload, backend, client)
+            if duplicate:
+                return duplicate, 200
+        image_hash = upload.sha256
+
+        # Step 1: OCR (Google Vision unless another backend was picked)
+        words, boxes, pil_image, error = get_ocr(upload, backend)
+    finally:
+        upload.close()
 
-        # Step 3: Filter receipt text
-        clean_text = smart_filter_receipt(full_text)
+    body, http_status = receipt_response(words, boxes, error)
+    if words and http_status == 200:
+        receipt_id = store_receipt(image_hash, backend, words, boxes, body)
+        remember_receipt(phash, receipt_id or image_hash, body, backend, client)
+    return body, http_status
 
-        # Step 4: Parse to JSON
-        json_result = parse_receipt_to_json(clean_text)
+def store_receipt(image_hash, backend, words, boxes, body):
+    """Persist a successful parse in receipt_store and add its receipt_id to the body; returns the id"""
+    if not receipt_store:
+        return None
+    try:
+        receipt_id = receipt_store.save(image_hash, backend.name, words, boxes, body)
+    except sqlite3.Error as e:
+        logger.warning("receipt store write failed: %s", e)
+        return None
+    body["receipt_id"] = receipt_id
+    return receipt_id
+
+def find_duplicate(upload, backend, client):
+    """Perceptual hash of the upload and the same client's earlier response for the same receipt, if any.
+
+    Returns (phash, response body or None); phash is None when the index is
+    off, the client is unknown, the exact bytes are already in the OCR cache
+    (no need for the ~13ms hash) or the image does not decode.
+    """
+    if not near_duplicates or not client:
+        return None, None
+    cache_key = ocr_cache_key(upload, backend)
+    if cache_key and ocr_cache.contains(cache_key):
+        return None, None
+    started = time.perf_counter()
+    phash = cpu_pool.run(hash_upload, upload.getvalue()) if cpu_pool else hash_upload(upload)
+    STAGE_PHASH.observe(time.perf_counter() - started)
+    if phash is None:
+        return None, None
+
+    match = near_duplicates.lookup(phash, scope=(backend.name, client))
+    if not match:
+        return phash, None
+    receipt_id, body, distance, age = match
+    logger.info("near-duplicate of %s (%d bits apart)", receipt_id[:12], distance)
+    return phash, dict(body, duplicate={
+        "receipt_id": receipt_id,
+        "distance": distance,
+        "similarity": round(1 - distance / HASH_BITS, 3),
+        "age_seconds": round(age),
+    })
+
+def remember_receipt(phash, receipt_id, body, backend, client):
+    """Index a parsed receipt for find_duplicate() (receipt_id: store id, else the upload's SHA-256)"""
+    if near_duplicates and phash is not None and client:
+        near_duplicates.put(receipt_id, phash, body, scope=(backend.name, client))
+
+def receipt_response(words, boxes, error=None):
+    """Steps 2-4 on OCR output, or the error reply; returns (response body, http status)"""
+    if error:
+        # Vision still failing after retries: tell the app to retry, not that it broke
+        if error.kind in ('unavailable', 'overloaded'):
+            http_status = 503
+        else:
+            http_status = 400 if error.kind == 'invalid_image' else 500
+        return {"status": "error", "message": str(error)}, http_status
+
+    # Steps 2-4: group lines, filter, parse
+    result = build_parse_response(words, boxes)
+    if not words:
+        return result, 200
+
+    if logger.isEnabledFor(logging.DEBUG):
+        json_result = result["data"]
+        logger.debug("parse result %s", json.dumps({
+            "status": json_result.get("status"),
+            "items": len(json_result.get("items", [])),
+            "summary": json_result.get("summary"),
+            "result": json_result,
+        }, default=str))
+
+    return result, 200
+
+# ==============================================================================
+# HYBRID ROUTING (rules first, Mindee for the receipts they cannot balance)
+# ==============================================================================
+# ?route=hybrid runs the rules pipeline and sends the receipt to Mindee only
+# when its outcome label is in HYBRID_ESCALATE_ON; the Mindee answer replaces
+# "data" (same shape) when it is not in that set itself. ?route=race also
+# starts Mindee once the rules path has run for HYBRID_RACE_MS and returns
+# the first acceptable answer. PARSE_ROUTE is the default for /parse.
+PARSE_ROUTES = ('rules', 'hybrid', 'race')
+PARSE_ROUTE = os.environ.get('PARSE_ROUTE', 'rules').lower()
+if PARSE_ROUTE not in PARSE_ROUTES:
+    print(f"[WARN] Unknown PARSE_ROUTE '{PARSE_ROUTE}', using 'rules'")
+    PARSE_ROUTE = 'rules'
+HYBRID_ESCALATE_ON = {label.strip() for label in os.environ.get(
+    'HYBRID_ESCALATE_ON', 'gap,total_not_found').lower().split(',') if label.strip()}
+HYBRID_RACE_MS = int(os.environ.get('HYBRID_RACE_MS', 3000))
+# Rules and Mindee calls of raced requests (two per request at most)
+route_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('HYBRID_RACE_WORKERS', 8)),
+                                    thread_name_prefix='parse-route')
+if PARSE_ROUTE != 'rules':
+    print(f"✅ Parse route: {PARSE_ROUTE} (escalate on {', '.join(sorted(HYBRID_ESCALATE_ON))})")
+
+def parse_route(value):
+    """Route for a ?route= value (PARSE_ROUTE when empty), or None when unknown"""
+    route = (value or PARSE_ROUTE).lower()
+    return route if route in PARSE_ROUTES else None
+
+def escalation_reason(body, http_status):
+    """Outcome label that sends a result to Mindee, or None to keep it ('ocr_error' for failed OCR)"""
+    if http_status != 200:
+        label = 'ocr_error'
+    else:
+        label = outcome_label((body.get("data") or {}).get("status", ""))
+    return label if label in HYBRID_ESCALATE_ON else None
+
+def get_mindee(upload, filename):
+    """Mindee prediction for an upload (served from ocr_cache on repeat uploads); returns (data, OCRError or None)"""
+    mindee = mindee_parser.get()
+    if not mindee:
+        return None, OCRError("Mindee parser not available.", kind='not_configured')
 
-        print(f"\n=== DEBUG: json_result structure ===")
-        print(f"Type: {type(json_result)}")
-        print(f"Keys: {json_result.keys() if isinstance(json_result, dict) else 'N/A'}")
-        print(f"Has summary: {'summary' in json_result if isinstance(json_result, dict) else False}")
-        if isinstance(json_result, dict) and 'summary' in json_result:
-            print(f"Summary value: {json_result['summary']}")
-        print(f"Full result: {json_result}")
-        print("=== END DEBUG ===\n")
+    # A payload in its own cache namespace, never mistaken for words/boxes
+    if ocr_cache:
+        cached = ocr_cache.get_payload(upload.sha256, 'mindee')
+        if cached is not None:
+            return cached, None
+
+    try:
+        OCR_IMAGES.labels(backend='mindee', mode='single').inc()
+        with ocr_slot(), OCR_SECONDS.labels(backend='mindee', mode='single').time():
+            data = mindee.parse(upload.getvalue(), filename)
+    except OverloadedError as e:
+        OCR_ERRORS.labels(kind='overloaded').inc()
+        return None, OCRError(str(e), kind='overloaded')
+    except Exception as e:
+        logger.exception("Mindee parsing failed")
+        OCR_ERRORS.labels(kind='exception').inc()
+        return None, OCRError(f"Mindee parsing error: {str(e)}", kind='exception')
+
+    if ocr_cache:
+        ocr_cache.put_payload(upload.sha256, 'mindee', data)
+    return data, None
+
+def mindee_response(rules_body, data):
+    """Response with "data" from a Mindee prediction (the prediction itself goes to debug.mindee)"""
+    body = dict(rules_body) if rules_body.get("status") == "success" else {"status": "success"}
+    body.pop("message", None)
+    body["data"] = receipt_result(data)
+    body["debug"] = dict(body.get("debug") or {}, mindee=data)
+    return body
+
+def route_receipt(upload, filename, backend=None, dedupe=True, route='hybrid', client=None):
+    """process_receipt() with escalation to Mindee (route: hybrid or race); returns (response body, http status)"""
+    started = time.perf_counter()
+    # process_receipt() closes its upload, and a raced rules path may outlive
+    # the request; both paths get their own view of the bytes
+    content = upload.getvalue()
+    mindee_upload = UploadBuffer.from_bytes(content)
+    mindee_future = None
+
+    if route == 'race' and mindee_parser.get():
+        rules_future = route_executor.submit(process_receipt, UploadBuffer.from_bytes(content), backend, dedupe,
+                                             client)
+        upload.close()
+        done, _ = wait([rules_future], timeout=max(0, HYBRID_RACE_MS) / 1000)
+        if not done:
+            # Rules are over budget: start Mindee as well, first acceptable answer wins
+            PARSE_ROUTE_DECISIONS.labels(route=route, decision='race_started').inc()
+            mindee_future = route_executor.submit(get_mindee, mindee_upload, filename)
+            wait([rules_future, mindee_future], return_when=FIRST_COMPLETED)
+            if not rules_future.done():
+                data, error = mindee_future.result()
+                if not error:
+                    body = mindee_response({}, data)
+                    if not escalation_reason(body, 200):
+                        return finish_route(body, 200, route, 'mindee', 'race_won', started)
+        rules = rules_future.result()
+    else:
+        rules = process_receipt(upload, backend, dedupe, client)
+    return escalate(rules, mindee_upload, filename, route, started, mindee_future)
+
+def escalate(rules, upload, filename, route, started, mindee_future=None):
+    """Keep a rules (body, http status) or replace it with Mindee's answer; returns (response body, http status)"""
+    body, http_status = rules
+    reason = escalation_reason(body, http_status)
+    if not reason:
+        return finish_route(body, http_status, route, 'rules', 'rules', started)
+
+    data, error = mindee_future.result() if mindee_future else get_mindee(upload, filename)
+    if error:
+        decision = 'mindee_unavailable' if error.kind == 'not_configured' else 'mindee_error'
+        return finish_route(body, http_status, route, 'rules', decision, started, reason)
+    candidate = mindee_response(body, data)
+    if escalation_reason(candidate, 200):
+        return finish_route(body, http_status, route, 'rules', 'mindee_no_better', started, reason)
+    return finish_route(candidate, 200, route, 'mindee', 'escalated', started, reason)
+
+def finish_route(body, http_status, route, engine, decision, started, reason=None):
+    """Record the routing decision and add a "route" block to the body"""
+    elapsed = time.perf_counter() - started
+    PARSE_ROUTE_SECONDS.labels(route=route, engine=engine).observe(elapsed)
+    PARSE_ROUTE_DECISIONS.labels(route=route, decision=decision).inc()
+    info = {"route": route, "engine": engine, "decision": decision, "seconds": round(elapsed, 3)}
+    if reason:
+        info["escalation_reason"] = reason
+    return dict(body, route=info), http_status
+
+def queue_full_response(retry_after):
+    response = jsonify({
+        "status": "error",
+        "message": "Server busy, too many queued receipts. Retry later.",
+        "retry_after": retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status (and result, once finished) of an async parse job (same ?debug=/?fields=/?format= as /parse)"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found or expired"}), 404
+    job.pop("callback_url", None)
+    if "result" in job:
+        job["result"] = shape_body(job["result"], shape_from_args(request.args))
+    return jsonify(job), 200
+
+@app.route('/receipts/<receipt_id>', methods=['GET'])
+def get_receipt(receipt_id):
+    """A stored parse result (same ?debug=/?fields=/?format= as /parse)"""
+    if not receipt_store:
+        return jsonify({"status": "error", "message": "Receipt store is disabled (set RECEIPT_STORE_PATH)"}), 404
+    receipt = receipt_store.get(receipt_id)
+    if not receipt:
+        return jsonify({"status": "error", "message": "Receipt not found"}), 404
+
+    body = shape_body(receipt["result"], shape_from_args(request.args))
+    return jsonify(dict(body, receipt_id=receipt_id, stored={
+        "backend": receipt["backend"],
+        "created": receipt["created"],
+        "updated": receipt["updated"],
+    })), 200
+
+@app.route('/receipts/<receipt_id>/reparse', methods=['POST'])
+def reparse_receipt(receipt_id):
+    """Run the current rules over a stored receipt's OCR output, no OCR call (?save=0 keeps the stored result)"""
+    if not receipt_store:
+        return jsonify({"status": "error", "message": "Receipt store is disabled (set RECEIPT_STORE_PATH)"}), 404
+    receipt = receipt_store.get(receipt_id, with_ocr=True)
+    if not receipt:
+        return jsonify({"status": "error", "message": "Receipt not found"}), 404
+
+    body = build_parse_response(receipt["words"], receipt["boxes"])
+    previous = receipt["result"].get("data", {})
+    changed = body["data"] != previous
+    save = request.values.get('save', '1').lower() not in ('0', 'false', 'no')
+    if changed and save:
+        receipt_store.update_result(receipt_id, body)
+
+    body = shape_body(body, shape_from_args(request.args))
+    return jsonify(dict(body, receipt_id=receipt_id, reparse={
+        "changed": changed,
+        "saved": changed and save,
+        "previous_status": previous.get("status"),
+        "previous_grand_total": previous.get("summary", {}).get("grand_total"),
+    })), 200
+
+@app.route('/parse-batch', methods=['POST'])
+def parse_receipt_batch():
+    """Batch parsing endpoint: many receipts in one request, one Vision call per chunk of 16 (?ocr= picks the backend)"""
+    requested_ocr = request.values.get('ocr')
+    backend, backend_error = resolve_ocr_backend(requested_ocr)
+    if not backend:
+        return jsonify({"status": "error", "message": backend_error}), 400 if requested_ocr else 500
+
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({"status": "error", "message": "No files uploaded. Use field name 'files'"}), 400
+
+    if len(files) > PARSE_BATCH_MAX_FILES:
+        return jsonify({
+            "status": "error",
+            "message": f"Too many files ({len(files)}). Max per batch: {PARSE_BATCH_MAX_FILES}"
+        }), 400
+
+    # admit_request() charged one token before the body was read; each further file costs one more
+    if len(files) > 1:
+        rejection = rate_limit_check(request_client_key(request.headers, request.remote_addr), len(files) - 1)
+        if rejection:
+            body, http_status, headers = rejection
+            response = jsonify(body)
+            response.headers.update(headers)
+            return response, http_status
+
+    try:
+        # Per-file validation; invalid files get an error result, the rest go to OCR
+        results = [None] * len(files)
+        pending = []
+        for i, file in enumerate(files):
+            if file.filename == '':
+                results[i] = {"status": "error", "message": "No file selected"}
+            elif not allowed_file(file.filename):
+                results[i] = {"status": "error", "message": f"Invalid format. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"}
+            else:
+                upload = UploadBuffer.from_file_storage(file)
+                if upload.size == 0:
+                    results[i] = {"status": "error", "message": "Empty file"}
+                elif upload.size > PARSE_BATCH_MAX_FILE_BYTES:
+                    results[i] = {
+                        "status": "error",
+                        "message": f"File too large (max {PARSE_BATCH_MAX_FILE_BYTES // (1024 * 1024)}MB per file)"
+                    }
+                else:
+                    pending.append((i, upload))
+
+        # Step 1: OCR all images with batched backend calls
+        ocr_results = get_ocr_batch([upload for _, upload in pending], backend)
+
+        # Steps 2-4 for each receipt. Parsing is pure Python and holds the GIL,
+        # so receipts only run in parallel in the CPU pool's processes (the
+        # threads just keep several in flight); without it they run in turn
+        futures = {}
+        for (i, upload), (words, boxes, error) in zip(pending, ocr_results):
+            if error:
+                results[i] = {"status": "error", "message": error}
+            else:
+                future = batch_executor.submit(build_parse_response, words, boxes) if cpu_pool else None
+                futures[i] = (future, upload.sha256, words, boxes)
+
+        for i, (future, image_hash, words, boxes) in futures.items():
+            try:
+                results[i] = future.result() if future else build_parse_response(words, boxes)
+            except Exception as e:
+                results[i] = {"status": "error", "message": str(e), "type": type(e).__name__}
+                continue
+            if words:
+                store_receipt(image_hash, backend, words, boxes, results[i])
+
+        shape = shape_from_args(request.args)
+        results = [shape_body(result, shape) for result in results]
+        for file, result in zip(files, results):
+            result["filename"] = file.filename
 
         return jsonify({
             "status": "success",
-            "data": json_result,
-            "debug": {
-                "words_detected": len(words),
-                "lines_after_filter": len(clean_text.split('\n')),
-                "raw_text": clean_text
-            }
+            "count": len(results),
+            "results": results
         }), 200
 
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(error_trace)
+        logger.exception("%s failed", request.path)
         return jsonify({
             "status": "error",
             "message": str(e),
@@ -545,7 +1226,7 @@ def scan_receipt_endpoint():
 @app.route('/parse-mindee', methods=['POST'])
 def parse_mindee_endpoint():
     """Endpoint to parse receipt using Mindee model (ML-based). Expects multipart form with 'file'."""
-    if not parse_with_mindee:
+    if not mindee_parser.get():
         return jsonify({"status": "error", "message": "Mindee parser not available."}), 500
 
     if 'file' not in request.files:
@@ -558,42 +1239,16 @@ def parse_mindee_endpoint():
     if not allowed_file(file.filename):
         return jsonify({"status": "error", "message": f"Invalid format. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
 
-    # Save to a temp path and call Mindee
-    import tempfile
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            tmp.write(file.read())
-            tmp_path = tmp.name
-
-        # Ensure mindee model was initialized and available
-        try:
-            # parse_with_mindee returns fields or raises
-            result_fields = parse_with_mindee(tmp_path)
-            # Convert result_fields to a serializable dict if needed
-            try:
-                # Some Mindee responses are nested dataclasses - try to convert
-                def serialize_field(obj):
-                    if hasattr(obj, 'to_dict'):
-                        return obj.to_dict()
-                    if isinstance(obj, dict):
-                        return {k: serialize_field(v) for k, v in obj.items()}
-                    if hasattr(obj, '__dict__'):
-                        return {k: serialize_field(v) for k, v in obj.__dict__.items()}
-                    return obj
-                data = serialize_field(result_fields)
-            except Exception:
-                data = str(result_fields)
-
-            return jsonify({"status": "success", "data": data}), 200
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return jsonify({"status": "error", "message": f"Mindee parsing error: {str(e)}"}), 500
-    finally:
-        try:
-            os.unlink(tmp_path)
-        except Exception:
-            pass
+    started = time.perf_counter()
+    data, error = get_mindee(UploadBuffer.from_file_storage(file), file.filename)
+    if error:
+        if error.kind == 'overloaded':
+            response = jsonify({"status": "error", "message": str(error)})
+            response.headers['Retry-After'] = str(OCR_UNAVAILABLE_RETRY_AFTER)
+            return response, 503
+        return jsonify({"status": "error", "message": str(error)}), 500
+    PARSE_ROUTE_SECONDS.labels(route='mindee', engine='mindee').observe(time.perf_counter() - started)
+    return jsonify({"status": "success", "data": data}), 200
 
 # ==============================================================================
 # LAUNCH
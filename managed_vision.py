@@ -0,0 +1,425 @@
+# ==============================================================================
+# managed_vision.py - Vision client with a channel pool, deadlines, retry and hedging
+# ==============================================================================
+# Drop-in for vision.ImageAnnotatorClient as used by VisionBackend
+# (document_text_detection / batch_annotate_images). Each call gets an overall
+# deadline and a per-attempt timeout, retryable gRPC codes are retried with
+# full-jitter exponential backoff, and optionally a hedged copy of a slow
+# attempt is sent on another channel. Point VISION_ENDPOINT at a
+# fake_vision_server.py instance (VISION_INSECURE=1) to exercise it locally.
+# AsyncManagedVisionClient applies the same policy to the asyncio client
+# (ImageAnnotatorAsyncClient) used by the ASGI app.
+import os
+import time
+import random
+import asyncio
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_ENDPOINT = 'vision.googleapis.com:443'
+
+# OCR requests are idempotent, so these are safe to retry
+RETRYABLE_CODES = {'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'RESOURCE_EXHAUSTED', 'ABORTED'}
+
+# Each channel keeps its own connection (gRPC otherwise shares subchannels
+# between channels to the same target); receipt photos can exceed the 4MB
+# default message size
+CHANNEL_OPTIONS = [
+    ('grpc.use_local_subchannel_pool', 1),
+    ('grpc.max_send_message_length', -1),
+    ('grpc.max_receive_message_length', -1),
+]
+
+# Latency samples needed before p95 hedging kicks in
+HEDGE_MIN_SAMPLES = 20
+
+
+class VisionCallError(Exception):
+    """A Vision call that failed after retries, or could not be started in time"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+        self.transient = code in RETRYABLE_CODES
+
+
+def status_code_name(exc):
+    """gRPC status name ('UNAVAILABLE', ...) of an RPC exception, else None"""
+    if isinstance(exc, VisionCallError):
+        return exc.code
+    # google.api_core exceptions carry grpc_status_code; raw grpc.RpcError has code()
+    code = getattr(exc, 'grpc_status_code', None)
+    if code is None and callable(getattr(exc, 'code', None)):
+        try:
+            code = exc.code()
+        except Exception:
+            code = None
+    return getattr(code, 'name', None)
+
+
+def is_transient(exc):
+    """True for failures a client should retry later (503), not a bad request"""
+    return status_code_name(exc) in RETRYABLE_CODES
+
+
+def create_client(credentials=None, endpoint=None, insecure=False):
+    """One ImageAnnotatorClient on its own gRPC channel"""
+    import grpc
+    from google.cloud import vision
+    from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
+
+    if insecure:
+        channel = grpc.insecure_channel(endpoint, options=CHANNEL_OPTIONS)
+    else:
+        channel = ImageAnnotatorGrpcTransport.create_channel(
+            endpoint or DEFAULT_ENDPOINT, credentials=credentials, options=CHANNEL_OPTIONS
+        )
+    return vision.ImageAnnotatorClient(transport=ImageAnnotatorGrpcTransport(channel=channel))
+
+
+def create_async_client(credentials=None, endpoint=None, insecure=False):
+    """One ImageAnnotatorAsyncClient on its own grpc.aio channel (call from inside the event loop)"""
+    import grpc
+    from google.cloud import vision
+    from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcAsyncIOTransport
+
+    if insecure:
+        channel = grpc.aio.insecure_channel(endpoint, options=CHANNEL_OPTIONS)
+    else:
+        channel = ImageAnnotatorGrpcAsyncIOTransport.create_channel(
+            endpoint or DEFAULT_ENDPOINT, credentials=credentials, options=CHANNEL_OPTIONS
+        )
+    return vision.ImageAnnotatorAsyncClient(transport=ImageAnnotatorGrpcAsyncIOTransport(channel=channel))
+
+
+def parse_hedge(value):
+    """VISION_HEDGE: 'off', 'p95', or a fixed delay in milliseconds"""
+    value = (value or 'off').strip().lower()
+    if value in ('', 'off', '0', 'false', 'no'):
+        return None
+    if value == 'p95':
+        return 'p95'
+    return float(value) / 1000
+
+
+def endpoint_from_env():
+    """(endpoint or None, insecure) from VISION_ENDPOINT / VISION_INSECURE"""
+    endpoint = os.environ.get('VISION_ENDPOINT') or None
+    insecure = os.environ.get('VISION_INSECURE', '0').lower() in ('1', 'true', 'yes')
+    return endpoint, insecure
+
+
+def policy_from_env():
+    """Deadline/retry/hedging keyword arguments from VISION_* environment variables"""
+    return dict(
+        deadline=float(os.environ.get('VISION_DEADLINE', 30)),
+        attempt_timeout=float(os.environ.get('VISION_ATTEMPT_TIMEOUT', 10)),
+        max_attempts=int(os.environ.get('VISION_MAX_ATTEMPTS', 4)),
+        backoff_base=float(os.environ.get('VISION_BACKOFF_BASE_MS', 200)) / 1000,
+        backoff_max=float(os.environ.get('VISION_BACKOFF_MAX_MS', 5000)) / 1000,
+        hedge=parse_hedge(os.environ.get('VISION_HEDGE', 'off')),
+        hedge_min=float(os.environ.get('VISION_HEDGE_MIN_MS', 300)) / 1000,
+    )
+
+
+class CallPolicy:
+    """Settings, counters and latency samples shared by the sync and async clients"""
+
+    def __init__(self, clients, deadline=30.0, attempt_timeout=10.0, max_attempts=4,
+                 backoff_base=0.2, backoff_max=5.0, hedge=None, hedge_min=0.3, max_inflight=None):
+        from google.cloud import vision
+        self._vision = vision
+        self.clients = list(clients)
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min = hedge_min
+        self.max_inflight = max_inflight
+
+        self._next = itertools.count()
+        self._latencies = deque(maxlen=256)
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+            "failures": 0, "deadline_exceeded": 0, "rejected": 0,
+        }
+
+    def _annotate_request(self, image):
+        vision = self._vision
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+        return vision.AnnotateImageRequest(image=image, features=[feature])
+
+    def _retry_delay(self, exc, attempt, deadline):
+        """Backoff before the next attempt, or raise VisionCallError when the call should give up"""
+        code = status_code_name(exc)
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        out_of_time = time.monotonic() + delay >= deadline
+        if code not in RETRYABLE_CODES or attempt >= self.max_attempts or out_of_time:
+            self._count("deadline_exceeded" if code == 'DEADLINE_EXCEEDED' else "failures")
+            raise VisionCallError(f"Vision API {code or type(exc).__name__} after {attempt} attempt(s): {exc}",
+                                  code=code) from exc
+        self._count("retries")
+        return delay
+
+    def _deadline_error(self):
+        self._count("deadline_exceeded")
+        return VisionCallError(f"Vision call exceeded its {self.deadline}s deadline", code='DEADLINE_EXCEEDED')
+
+    def _rejected_error(self):
+        self._count("rejected")
+        return VisionCallError("Too many Vision requests in flight", code='RESOURCE_EXHAUSTED')
+
+    def _pick(self):
+        return self.clients[next(self._next) % len(self.clients)]
+
+    def _hedge_delay(self):
+        if self.hedge is None:
+            return None
+        if self.hedge != 'p95':
+            return self.hedge
+        p95 = self.latency_p95()
+        return None if p95 is None else max(self.hedge_min, p95)
+
+    def latency_p95(self):
+        samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        p95 = self.latency_p95()
+        return dict(
+            counters,
+            pool_size=len(self.clients),
+            max_inflight=self.max_inflight,
+            latency_p95_ms=round(p95 * 1000, 1) if p95 is not None else None,
+            hedge="p95" if self.hedge == 'p95' else (None if self.hedge is None else round(self.hedge * 1000)),
+        )
+
+
+class ManagedVisionClient(CallPolicy):
+    """Round-robins calls over a pool of Vision clients with a shared call policy.
+
+    deadline         - seconds for the whole call, retries included
+    attempt_timeout  - gRPC timeout of a single attempt
+    max_attempts     - attempts per call on retryable status codes
+    backoff_base/max - full-jitter backoff: sleep U(0, min(max, base * 2^n))
+    hedge            - None, 'p95' (recent p95 latency, at least hedge_min) or
+                       a fixed delay; an attempt still running after it gets
+                       a second copy on another channel, first answer wins
+    max_inflight     - concurrent calls allowed; others wait within their deadline
+    """
+
+    def __init__(self, clients, max_inflight=None, sleep=time.sleep, **policy):
+        super().__init__(clients, max_inflight=max_inflight, **policy)
+        self._sleep = sleep
+        self._inflight = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+        self._hedge_pool = None
+        if self.hedge is not None:
+            workers = 2 * (max_inflight or 4 * len(self.clients))
+            self._hedge_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vision-hedge')
+
+    @classmethod
+    def from_env(cls, credentials=None):
+        """Pool and policy from VISION_* environment variables"""
+        pool_size = max(1, int(os.environ.get('VISION_POOL_SIZE', 4)))
+        endpoint, insecure = endpoint_from_env()
+        max_inflight = int(os.environ.get('VISION_MAX_INFLIGHT', 4 * pool_size))
+        clients = [create_client(credentials, endpoint, insecure) for _ in range(pool_size)]
+        print(f"✅ Vision channel pool: {pool_size} channels to {endpoint or DEFAULT_ENDPOINT}")
+        return cls(clients, max_inflight=max_inflight or None, **policy_from_env())
+
+    # --------------------------------------------------------------------------
+    # ImageAnnotatorClient surface
+    # --------------------------------------------------------------------------
+    def document_text_detection(self, image, **kwargs):
+        return self.batch_annotate_images(requests=[self._annotate_request(image)]).responses[0]
+
+    def batch_annotate_images(self, requests, **kwargs):
+        return self.call('batch_annotate_images', requests=requests)
+
+    # --------------------------------------------------------------------------
+    # Call policy
+    # --------------------------------------------------------------------------
+    def call(self, method, **kwargs):
+        """Run client.<method>(**kwargs) under the deadline/retry/hedging policy"""
+        deadline = time.monotonic() + self.deadline
+        self._count("calls")
+
+        if self._inflight and not self._inflight.acquire(timeout=self.deadline):
+            raise self._rejected_error()
+        try:
+            return self._call_with_retry(method, kwargs, deadline)
+        finally:
+            if self._inflight:
+                self._inflight.release()
+
+    def _call_with_retry(self, method, kwargs, deadline):
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._deadline_error()
+            try:
+                return self._attempt(method, kwargs, min(self.attempt_timeout, remaining))
+            except Exception as e:
+                self._sleep(self._retry_delay(e, attempt, deadline))
+
+    def _attempt(self, method, kwargs, timeout):
+        """One attempt, hedged on a second channel if it runs past the hedge delay"""
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None or hedge_delay >= timeout:
+            return self._invoke(self._pick(), method, kwargs, timeout)
+
+        start = time.monotonic()
+        primary = self._hedge_pool.submit(self._invoke, self._pick(), method, kwargs, timeout)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        hedged = self._hedge_pool.submit(self._invoke, self._pick(), method, kwargs,
+                                         max(0.001, timeout - (time.monotonic() - start)))
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            remaining = timeout - (time.monotonic() - start)
+            done, pending = wait(pending, timeout=max(0, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is hedged:
+                    self._count("hedge_wins")
+                return result
+        if error is not None:
+            raise error
+        raise VisionCallError("Vision attempt timed out", code='DEADLINE_EXCEEDED')
+
+    def _invoke(self, client, method, kwargs, timeout):
+        self._count("attempts")
+        start = time.monotonic()
+        # retry=None: the GAPIC default policy would retry for up to 600s on its own
+        result = getattr(client, method)(retry=None, timeout=timeout, **kwargs)
+        self._latencies.append(time.monotonic() - start)
+        return result
+
+
+class AsyncManagedVisionClient(CallPolicy):
+    """ManagedVisionClient for asyncio: awaitable calls on grpc.aio channels.
+
+    One event loop can keep max_inflight calls open at once (hundreds, not
+    one per thread); further calls wait for a slot within their deadline.
+    Must be created inside the event loop that will use it.
+    """
+
+    def __init__(self, clients, max_inflight=256, **policy):
+        super().__init__(clients, max_inflight=max_inflight, **policy)
+        self._inflight = asyncio.Semaphore(max_inflight) if max_inflight else None
+
+    @classmethod
+    def from_env(cls, credentials=None):
+        """Pool and policy from VISION_* environment variables (VISION_ASYNC_MAX_INFLIGHT caps open calls)"""
+        pool_size = max(1, int(os.environ.get('VISION_POOL_SIZE', 4)))
+        endpoint, insecure = endpoint_from_env()
+        max_inflight = int(os.environ.get('VISION_ASYNC_MAX_INFLIGHT', 256))
+        clients = [create_async_client(credentials, endpoint, insecure) for _ in range(pool_size)]
+        print(f"✅ Async Vision channel pool: {pool_size} channels to {endpoint or DEFAULT_ENDPOINT}, "
+              f"up to {max_inflight or 'unlimited'} calls in flight")
+        return cls(clients, max_inflight=max_inflight or None, **policy_from_env())
+
+    async def document_text_detection(self, image, **kwargs):
+        response = await self.batch_annotate_images(requests=[self._annotate_request(image)])
+        return response.responses[0]
+
+    async def batch_annotate_images(self, requests, **kwargs):
+        return await self.call('batch_annotate_images', requests=requests)
+
+    async def call(self, method, **kwargs):
+        """Await client.<method>(**kwargs) under the deadline/retry/hedging policy"""
+        deadline = time.monotonic() + self.deadline
+        self._count("calls")
+
+        if self._inflight:
+            try:
+                await asyncio.wait_for(self._inflight.acquire(), timeout=self.deadline)
+            except asyncio.TimeoutError:
+                raise self._rejected_error() from None
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._deadline_error()
+                try:
+                    return await self._attempt(method, kwargs, min(self.attempt_timeout, remaining))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await asyncio.sleep(self._retry_delay(e, attempt, deadline))
+        finally:
+            if self._inflight:
+                self._inflight.release()
+
+    async def _attempt(self, method, kwargs, timeout):
+        """One attempt, hedged on a second channel if it runs past the hedge delay"""
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None or hedge_delay >= timeout:
+            return await self._invoke(self._pick(), method, kwargs, timeout)
+
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._invoke(self._pick(), method, kwargs, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        hedged = asyncio.ensure_future(self._invoke(self._pick(), method, kwargs,
+                                                    max(0.001, timeout - (time.monotonic() - start))))
+        pending = {primary, hedged}
+        error = None
+        try:
+            while pending:
+                remaining = timeout - (time.monotonic() - start)
+                done, pending = await asyncio.wait(pending, timeout=max(0, remaining),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is hedged:
+                        self._count("hedge_wins")
+                    return task.result()
+        finally:
+            # The losing copy is no longer needed
+            for task in pending:
+                task.cancel()
+        if error is not None:
+            raise error
+        raise VisionCallError("Vision attempt timed out", code='DEADLINE_EXCEEDED')
+
+    async def _invoke(self, client, method, kwargs, timeout):
+        self._count("attempts")
+        start = time.monotonic()
+        result = await getattr(client, method)(retry=None, timeout=timeout, **kwargs)
+        self._latencies.append(time.monotonic() - start)
+        return result
@@ -0,0 +1,102 @@
+# ==============================================================================
+# micro_batcher.py - Coalesce concurrent single-item calls into batch calls
+# ==============================================================================
+# Request threads submit() one item each and block on a Future. A collector
+# thread takes the first waiting item, keeps collecting for up to `window`
+# seconds or until `max_batch` items are queued, then hands the whole batch
+# to `batch_fn` on a dispatch pool (so the next batch can be collected while
+# this one is in flight) and fans the results back out to the waiters.
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """Runs batch_fn(items) -> results (same length and order) for concurrent submitters.
+
+    window         - seconds to wait for more items after the first one arrives
+    max_batch      - dispatch as soon as this many items are collected
+    max_concurrent - batches allowed in flight at once
+    """
+
+    def __init__(self, batch_fn, window=0.025, max_batch=16, max_concurrent=4, name='batcher'):
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.max_concurrent = max(1, max_concurrent)
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix=f'{name}-dispatch')
+        self._lock = threading.Lock()
+        self._counters = {"items": 0, "batches": 0, "full_batches": 0, "errors": 0}
+        self._sizes = {}
+
+        self._collector = threading.Thread(target=self._collect_loop, name=f'{name}-collect', daemon=True)
+        self._collector.start()
+
+    def submit(self, item):
+        """Queue one item; the Future resolves to its result (or batch_fn's exception)"""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _collect_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Wait for a free dispatch slot before closing the batch, so items
+            # arriving while every slot is busy join it instead of queuing behind it
+            self._slots.acquire()
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                self._record(len(batch), error=True)
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            self._record(len(batch))
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def _record(self, size, error=False):
+        with self._lock:
+            self._counters["items"] += size
+            self._counters["batches"] += 1
+            self._counters["full_batches"] += int(size >= self.max_batch)
+            self._counters["errors"] += int(error)
+            self._sizes[size] = self._sizes.get(size, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            sizes = dict(sorted(self._sizes.items()))
+        batches = counters["batches"]
+        return dict(
+            counters,
+            window_ms=round(self.window * 1000, 1),
+            max_batch=self.max_batch,
+            queued=self._queue.qsize(),
+            mean_batch_size=round(counters["items"] / batches, 2) if batches else None,
+            batch_sizes=sizes,
+        )
@@ -0,0 +1,140 @@
+# ==============================================================================
+# mindee_receipts.py - Mindee receipt API (ReceiptV5) from in-memory uploads
+# ==============================================================================
+# The upload is sent straight from memory (no temp file) and the prediction is
+# turned into plain JSON by a fixed table of typed converters, one per
+# ReceiptV5 field, instead of reflecting over every object's __dict__.
+# Output per field: {"value", "confidence"}; line items, taxes and company
+# registrations become lists of flat dicts. Polygons/bounding boxes are not
+# included. receipt_result() maps the prediction onto the rule-based /parse
+# "data" shape for the hybrid route (see HYBRID ROUTING in main.py).
+import os
+from operator import attrgetter
+from receipt_pipeline import summarize_receipt
+
+
+def _field(field):
+    """StringField, AmountField, DateField, ClassificationField"""
+    return {"value": field.value, "confidence": field.confidence}
+
+
+def _locale(field):
+    return {
+        "value": field.value,
+        "language": field.language,
+        "country": field.country,
+        "currency": field.currency,
+        "confidence": field.confidence,
+    }
+
+
+def _line_items(items):
+    return [{
+        "description": item.description,
+        "quantity": item.quantity,
+        "unit_price": item.unit_price,
+        "total_amount": item.total_amount,
+        "confidence": item.confidence,
+    } for item in items]
+
+
+def _taxes(taxes):
+    return [{
+        "value": tax.value,
+        "rate": tax.rate,
+        "code": tax.code,
+        "basis": tax.basis,
+        "confidence": tax.confidence,
+    } for tax in taxes]
+
+
+def _registrations(registrations):
+    return [{"type": r.type, "value": r.value, "confidence": r.confidence} for r in registrations]
+
+
+# (output key, getter, converter), in output order
+RECEIPT_FIELDS = tuple((name, attrgetter(name), convert) for name, convert in (
+    ("locale", _locale),
+    ("category", _field),
+    ("subcategory", _field),
+    ("document_type", _field),
+    ("date", _field),
+    ("time", _field),
+    ("supplier_name", _field),
+    ("supplier_address", _field),
+    ("supplier_phone_number", _field),
+    ("supplier_company_registrations", _registrations),
+    ("receipt_number", _field),
+    ("line_items", _line_items),
+    ("total_net", _field),
+    ("total_tax", _field),
+    ("taxes", _taxes),
+    ("tip", _field),
+    ("total_amount", _field),
+))
+
+
+def serialize_receipt(prediction):
+    """Plain dict of a ReceiptV5 prediction (fields missing from the prediction are skipped)"""
+    data = {}
+    for name, get, convert in RECEIPT_FIELDS:
+        try:
+            value = get(prediction)
+        except AttributeError:
+            continue
+        data[name] = convert(value) if value is not None else None
+    return data
+
+
+def _amount(data, name):
+    """Whole-currency value of an amount field in serialized data (0 when missing)"""
+    field = data.get(name) or {}
+    return int(round(field.get("value") or 0))
+
+
+def receipt_result(data):
+    """Serialized prediction in the rule-based /parse "data" shape (items, summary, status)"""
+    items = []
+    for line in data.get("line_items") or []:
+        qty = int(line["quantity"]) if line.get("quantity") and line["quantity"] >= 1 else 1
+        unit_price = int(round(line["unit_price"])) if line.get("unit_price") is not None else None
+        if line.get("total_amount") is not None:
+            line_total = int(round(line["total_amount"]))
+        else:
+            line_total = (unit_price or 0) * qty
+        items.append({
+            "name": (line.get("description") or "").strip(),
+            "qty": qty,
+            "unit_price": unit_price if unit_price is not None else line_total // qty,
+            "line_total": line_total,
+        })
+    return summarize_receipt(items, _amount(data, "total_amount"), tax=_amount(data, "total_tax"),
+                             service=_amount(data, "tip"))
+
+
+class MindeeReceipts:
+    """Mindee client for the receipt product; parse() takes the upload bytes"""
+
+    def __init__(self, client, product_class):
+        self.client = client
+        self.product_class = product_class
+
+    @classmethod
+    def from_env(cls):
+        """Client for MINDEE_API_KEY (None when the key or the mindee package is missing)"""
+        api_key = os.environ.get('MINDEE_API_KEY')
+        if not api_key:
+            print("[WARN] MINDEE_API_KEY is not set; /parse-mindee is disabled")
+            return None
+        try:
+            from mindee import Client, product
+        except ImportError:
+            print("[WARN] mindee is not installed; /parse-mindee is disabled")
+            return None
+        return cls(Client(api_key=api_key), product.ReceiptV5)
+
+    def parse(self, content, filename):
+        """Serialized prediction for one image (bytes); raises on API errors"""
+        source = self.client.source_from_bytes(content, filename)
+        response = self.client.parse(self.product_class, source)
+        return serialize_receipt(response.document.inference.prediction)
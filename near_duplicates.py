@@ -0,0 +1,207 @@
+# ==============================================================================
+# near_duplicates.py - Recognize a receipt that was already parsed from another photo
+# ==============================================================================
+# The OCR cache only catches byte-identical uploads. Here each parsed receipt
+# is indexed by a perceptual hash, so the same receipt re-sent by another
+# group member (forwarded, re-encoded, resized, lightly cropped) returns the
+# earlier parse result instead of a new Vision call.
+#
+# Hash: downscaled grayscale, cropped to the bright paper region (drops the
+# table or background around it), resized to 32x64, and the low-frequency
+# 16x32 block of its 2D DCT thresholded at the median -> 512 bits (pHash).
+# On synthetic receipts almost all forwarded copies stay within ~30 bits while
+# different receipts from one template are 40+ apart; re-shots from a new
+# angle vary more and are only caught when taken nearly the same way.
+# That threshold has only been checked on synthetic images, and similar
+# receipts from one store can land within it, so the index is off by default
+# (NEAR_DUP_ENABLED=1) and a match only returns the same client's earlier
+# result, never another user's.
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps, ImageStat
+from upload_buffer import UploadBuffer
+
+THUMB_SIZE = 256                    # decode/crop working size (long edge)
+HASH_WIDTH, HASH_HEIGHT = 32, 64    # grayscale grid the DCT runs on (receipts are tall)
+COEFF_WIDTH, COEFF_HEIGHT = 16, 32  # low-frequency block kept
+HASH_BITS = COEFF_WIDTH * COEFF_HEIGHT
+
+# A row/column belongs to the paper when this share of its pixels is bright
+PAPER_FILL = 0.3
+
+
+def _cosine_table(n, k):
+    return [[math.cos(math.pi * (2 * x + 1) * u / (2 * n)) for x in range(n)] for u in range(k)]
+
+
+_COS_X = _cosine_table(HASH_WIDTH, COEFF_WIDTH)
+_COS_Y = _cosine_table(HASH_HEIGHT, COEFF_HEIGHT)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def crop_to_paper(gray):
+    """Crop a grayscale image to the rows/columns that are mostly bright (the receipt paper)"""
+    _, brightest = gray.getextrema()
+    threshold = (ImageStat.Stat(gray).mean[0] + brightest) / 2
+    mask = gray.point(lambda v: 255 if v > threshold else 0)
+    # BOX-resizing the mask to one column/row gives the bright share per row/column
+    rows = [i for i, v in enumerate(mask.resize((1, mask.height), Image.BOX).getdata()) if v > 255 * PAPER_FILL]
+    cols = [i for i, v in enumerate(mask.resize((mask.width, 1), Image.BOX).getdata()) if v > 255 * PAPER_FILL]
+    if not rows or not cols:
+        return gray
+    return gray.crop((cols[0], rows[0], cols[-1] + 1, rows[-1] + 1))
+
+
+def perceptual_hash(image):
+    """512-bit perceptual hash (int) of a PIL image"""
+    gray = ImageOps.exif_transpose(image).convert('L')
+    gray.thumbnail((THUMB_SIZE, THUMB_SIZE))
+    gray = crop_to_paper(gray).resize((HASH_WIDTH, HASH_HEIGHT), Image.LANCZOS)
+    pixels = list(gray.getdata())
+
+    # Separable DCT-II, only the low-frequency coefficients: rows, then columns
+    row_coeffs = []
+    for y in range(HASH_HEIGHT):
+        row = pixels[y * HASH_WIDTH:(y + 1) * HASH_WIDTH]
+        row_coeffs.append([sum(p * c for p, c in zip(row, cos_u)) for cos_u in _COS_X])
+    coeffs = []
+    for cos_v in _COS_Y:
+        for u in range(COEFF_WIDTH):
+            coeffs.append(sum(cos_v[y] * row_coeffs[y][u] for y in range(HASH_HEIGHT)))
+
+    # The DC term is overall brightness; leave it out of the median
+    median = sorted(coeffs[1:])[len(coeffs) // 2]
+    value = 0
+    for coeff in coeffs:
+        value = (value << 1) | (coeff > median)
+    return value
+
+
+def hash_upload(upload):
+    """Perceptual hash of an UploadBuffer (or bytes); None when it does not decode"""
+    if not isinstance(upload, UploadBuffer):
+        upload = UploadBuffer.from_bytes(upload)
+    try:
+        img = Image.open(upload.open())
+        # JPEG: let the decoder downscale (DCT scaling) instead of decoding full size
+        img.draft('L', (THUMB_SIZE, THUMB_SIZE))
+        img.load()
+        return perceptual_hash(img)
+    except Exception:
+        return None
+
+
+class NearDuplicateIndex:
+    """Recently parsed receipts keyed by perceptual hash, searched by Hamming distance.
+
+    Multi-index hashing: the hash is split into max_distance + 1 segments, and
+    two hashes within max_distance bits must agree exactly on at least one of
+    them (pigeonhole), so a lookup only compares the entries sharing a segment
+    value. Entries are LRU-evicted beyond max_entries and expire after ttl
+    seconds. `scope` (OCR backend and client) is part of the entry key, so
+    results from different engines and different clients stay apart even when
+    they share a receipt id.
+    """
+
+    def __init__(self, max_entries=512, max_distance=32, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+
+        segments = max_distance + 1
+        width, extra = divmod(HASH_BITS, segments)
+        self._segments = []  # (shift, mask)
+        shift = 0
+        for i in range(segments):
+            bits = width + (1 if i < extra else 0)
+            self._segments.append((shift, (1 << bits) - 1))
+            shift += bits
+        self._tables = [{} for _ in self._segments]
+
+        self._entries = OrderedDict()  # (scope, key) -> (hash, value, created)
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls):
+        """NEAR_DUP_* settings (None when disabled)"""
+        if os.environ.get('NEAR_DUP_ENABLED', '0').lower() in ('0', 'false', 'no'):
+            return None
+        return cls(
+            max_entries=int(os.environ.get('NEAR_DUP_MAX_ENTRIES', 512)),
+            max_distance=min(HASH_BITS // 4, int(os.environ.get('NEAR_DUP_MAX_DISTANCE', 32))),
+            ttl=int(os.environ.get('NEAR_DUP_TTL', 24 * 3600)),
+        )
+
+    def _segment_values(self, value):
+        return [(value >> shift) & mask for shift, mask in self._segments]
+
+    def _unlink(self, entry_key):
+        value, _, _ = self._entries.pop(entry_key)
+        for table, segment in zip(self._tables, self._segment_values(value)):
+            keys = table.get(segment)
+            if keys is not None:
+                keys.discard(entry_key)
+                if not keys:
+                    del table[segment]
+
+    def lookup(self, value, scope=None):
+        """Closest entry within max_distance as (key, stored value, distance, age seconds), or None"""
+        now = time.time()
+        with self._lock:
+            self._counters["lookups"] += 1
+            candidates = set()
+            for table, segment in zip(self._tables, self._segment_values(value)):
+                candidates.update(table.get(segment, ()))
+
+            best = None
+            best_key = None
+            for entry_key in candidates:
+                stored_hash, stored, created = self._entries[entry_key]
+                if self.ttl and now - created > self.ttl:
+                    self._unlink(entry_key)
+                    self._counters["expired"] += 1
+                    continue
+                if entry_key[0] != scope:
+                    continue
+                distance = hamming(value, stored_hash)
+                if distance <= self.max_distance and (best is None or distance < best[2]):
+                    best = (entry_key[1], stored, distance, now - created)
+                    best_key = entry_key
+
+            if best is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self._counters["hits"] += 1
+            return best
+
+    def put(self, key, value, stored, scope=None):
+        """Index `stored` (e.g. a parse response) under hash `value`; `key` identifies the receipt"""
+        entry_key = (scope, key)
+        with self._lock:
+            if entry_key in self._entries:
+                self._unlink(entry_key)
+            self._entries[entry_key] = (value, stored, time.time())
+            for table, segment in zip(self._tables, self._segment_values(value)):
+                table.setdefault(segment, set()).add(entry_key)
+            self._counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._unlink(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._counters,
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                max_distance=self.max_distance,
+                hash_bits=HASH_BITS,
+                ttl=self.ttl,
+            )
@@ -0,0 +1,456 @@
+# ==============================================================================
+# ocr_backends.py - OCR engines that turn an encoded image into words + boxes
+# ==============================================================================
+# Every backend returns parallel lists: words and [x0, y0, x1, y1] boxes in
+# the pixel space of the image it was given. Available backends:
+#   google     - Google Vision document_text_detection (network, needs credentials)
+#   tesseract  - local Tesseract via pytesseract (needs the tesseract binary)
+#   stub       - replays recorded fixtures (vision_stub.py), for offline runs
+# Backends are created lazily on first use (or by warm_up()), and the Google
+# client libraries are only imported then, to keep worker start-up fast.
+import os
+import io
+import json
+import logging
+from PIL import Image
+from vision_stub import StubVisionClient
+from lazy_resource import LazyResource
+from managed_vision import ManagedVisionClient, AsyncManagedVisionClient, is_transient
+from micro_batcher import MicroBatcher
+from image_preprocess import invalid_image_message
+
+# Optional local engine
+try:
+    import pytesseract
+except Exception:
+    pytesseract = None
+
+# Max images per batch_annotate_images request (Vision API limit)
+VISION_BATCH_LIMIT = 16
+
+logger = logging.getLogger(__name__)
+
+
+class OCRError(Exception):
+    """An image the backend could not read; `kind` feeds the ocr_errors_total metric"""
+
+    def __init__(self, message, kind='backend'):
+        super().__init__(message)
+        self.kind = kind
+
+
+def extract_words_boxes(response):
+    """Flatten a Vision AnnotateImageResponse into parallel words/boxes lists"""
+    # Walk the raw protobuf: proto-plus wraps every nested message on access,
+    # which costs ~15x more for a receipt's few hundred words
+    pb = getattr(type(response), 'pb', None)
+    if pb is not None:
+        response = pb(response)
+
+    words = []
+    boxes = []
+
+    for page in response.full_text_annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    word_text = ''.join([symbol.text for symbol in word.symbols])
+                    words.append(word_text)
+
+                    vertices = word.bounding_box.vertices
+                    box = [
+                        vertices[0].x,
+                        vertices[0].y,
+                        vertices[2].x,
+                        vertices[2].y
+                    ]
+                    boxes.append(box)
+
+    return words, boxes
+
+
+class OCRBackend:
+    """Base class. Subclasses implement recognize(); recognize_batch() loops by default"""
+
+    name = None
+    # Set when the backend must receive the uploaded bytes unchanged
+    # (no downscaling/re-encoding before OCR)
+    replays_original_bytes = False
+
+    def recognize(self, content, image=None):
+        """OCR one encoded image; `image` is the decoded PIL image when the caller has it.
+        Returns (words, boxes) or raises OCRError"""
+        raise NotImplementedError
+
+    def recognize_batch(self, contents, images=None):
+        """OCR many images; returns [(words, boxes, OCRError or None), ...] in input order"""
+        images = images or [None] * len(contents)
+        results = []
+        for content, image in zip(contents, images):
+            try:
+                words, boxes = self.recognize(content, image)
+                results.append((words, boxes, None))
+            except OCRError as e:
+                results.append(([], [], e))
+            except Exception as e:
+                results.append(([], [], OCRError(f"OCR error: {str(e)}", kind='exception')))
+        return results
+
+    def describe(self):
+        return {"name": self.name}
+
+
+# ==============================================================================
+# GOOGLE VISION
+# ==============================================================================
+def preload_modules():
+    """Import the Google client libraries up front (gunicorn --preload master, before fork)"""
+    from google.cloud import vision  # noqa: F401
+    from google.oauth2 import service_account  # noqa: F401
+
+
+def load_vision_credentials():
+    """Service account credentials from GOOGLE_CREDENTIALS_JSON (HF Secret), or None for the default chain"""
+    from google.oauth2 import service_account
+
+    # Try environment variable first (HF Secret: GOOGLE_CREDENTIALS_JSON)
+    google_creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
+    if google_creds_json:
+        print("✅ Using GOOGLE_CREDENTIALS_JSON from secrets")
+        creds_dict = json.loads(google_creds_json)
+        return service_account.Credentials.from_service_account_info(creds_dict)
+
+    # Fallback: try file
+    creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    if creds_path and os.path.exists(creds_path):
+        print(f"✅ Using credentials file: {creds_path}")
+    else:
+        print("⚠️ No credentials found, trying default...")
+    return None
+
+
+def init_vision_client():
+    """Initialize Google Vision with credentials from HF Secrets"""
+    try:
+        from google.cloud import vision
+        credentials = load_vision_credentials()
+
+        # Channel pool with deadlines/retry/hedging (see VISION_* in .env.example)
+        if os.environ.get('VISION_MANAGED', '1').lower() not in ('0', 'false', 'no'):
+            return ManagedVisionClient.from_env(credentials)
+
+        if credentials:
+            return vision.ImageAnnotatorClient(credentials=credentials)
+        return vision.ImageAnnotatorClient()
+
+    except Exception as e:
+        logger.exception("❌ Vision API init failed: %s", e)
+        return None
+
+
+def coalescing_from_env():
+    """VISION_COALESCE_MS / VISION_COALESCE_MAX as (window seconds, max batch); window 0 = off"""
+    window_ms = float(os.environ.get('VISION_COALESCE_MS', 0))
+    max_batch = min(VISION_BATCH_LIMIT, max(1, int(os.environ.get('VISION_COALESCE_MAX', VISION_BATCH_LIMIT))))
+    return window_ms / 1000, max_batch
+
+
+class VisionBackend(OCRBackend):
+    """document_text_detection / batch_annotate_images on a Vision client.
+
+    Also serves the stub backend, since StubVisionClient has the same surface.
+    With a coalescing window, single-image recognize() calls from concurrent
+    requests are held briefly and sent together as one batch_annotate_images.
+    """
+
+    def __init__(self, client, name='google', coalesce_window=0.0, coalesce_max=VISION_BATCH_LIMIT,
+                 coalesce_concurrency=4):
+        from google.cloud import vision
+        self._vision = vision
+        self.client = client
+        self.name = name
+        self.replays_original_bytes = getattr(client, 'replays_original_bytes', False)
+        self.batcher = None
+        if coalesce_window > 0:
+            self.batcher = MicroBatcher(
+                self._annotate, window=coalesce_window, max_batch=min(coalesce_max, VISION_BATCH_LIMIT),
+                max_concurrent=coalesce_concurrency, name=f'{name}-coalesce',
+            )
+
+    @classmethod
+    def from_env(cls):
+        print("🚀 Initializing Google Vision API...")
+        client = init_vision_client()
+        if not client:
+            return None
+        window, max_batch = coalescing_from_env()
+        if window:
+            print(f"✅ Coalescing Vision requests: {window * 1000:g}ms window, up to {max_batch} images")
+        return cls(client, coalesce_window=window, coalesce_max=max_batch,
+                   coalesce_concurrency=getattr(client, 'max_inflight', None) or 4)
+
+    @classmethod
+    def stub_from_env(cls):
+        """Fixture replay client from VISION_STUB_FIXTURES"""
+        stub_dir = os.environ.get('VISION_STUB_FIXTURES')
+        if not stub_dir:
+            return None
+        print(f"🧪 Using stub Vision client with fixtures from {stub_dir}")
+        client = StubVisionClient.from_dir(stub_dir)
+        client.latency = float(os.environ.get('VISION_STUB_LATENCY_MS', 0)) / 1000
+        window, max_batch = coalescing_from_env()
+        return cls(client, name='stub', coalesce_window=window, coalesce_max=max_batch)
+
+    def describe(self):
+        info = {"name": self.name}
+        if hasattr(self.client, 'stats'):
+            info["client"] = self.client.stats()
+        if self.batcher:
+            info["coalescing"] = self.batcher.stats()
+        return info
+
+    def recognize(self, content, image=None):
+        if self.batcher:
+            words, boxes, error = self.batcher(content)
+            if error:
+                raise error
+            return words, boxes
+
+        vision = self._vision
+        try:
+            response = self.client.document_text_detection(image=vision.Image(content=content))
+        except Exception as e:
+            if is_transient(e):
+                raise OCRError(f"Google Vision temporarily unavailable: {str(e)}", kind='unavailable') from e
+            raise
+        if response.error.message:
+            raise OCRError(f"Google Vision API error: {response.error.message}", kind='vision_api')
+        return extract_words_boxes(response)
+
+    def recognize_batch(self, contents, images=None):
+        """One batch_annotate_images call per chunk of VISION_BATCH_LIMIT images"""
+        results = []
+        for start in range(0, len(contents), VISION_BATCH_LIMIT):
+            results.extend(self._annotate(contents[start:start + VISION_BATCH_LIMIT]))
+        return results
+
+    def _annotate(self, chunk):
+        """batch_annotate_images for up to VISION_BATCH_LIMIT images -> [(words, boxes, OCRError or None)]"""
+        vision = self._vision
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+        try:
+            response = self.client.batch_annotate_images(requests=[
+                vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+                for content in chunk
+            ])
+        except Exception as e:
+            if is_transient(e):
+                message, kind = f"Google Vision temporarily unavailable: {str(e)}", 'unavailable'
+            else:
+                logger.exception("Vision batch request failed")
+                message, kind = f"OCR error: {str(e)}", 'exception'
+            # One error per image: coalesced callers raise them on different threads
+            return [([], [], OCRError(message, kind=kind)) for _ in chunk]
+
+        results = []
+        for annotation in response.responses:
+            if annotation.error.message:
+                error = OCRError(f"Google Vision API error: {annotation.error.message}", kind='vision_api')
+                results.append(([], [], error))
+            else:
+                words, boxes = extract_words_boxes(annotation)
+                results.append((words, boxes, None))
+        return results
+
+
+class AsyncVisionBackend:
+    """Google Vision on the asyncio client, for the ASGI app: `await recognize(content)`"""
+
+    name = 'google'
+    replays_original_bytes = False
+
+    def __init__(self, client):
+        from google.cloud import vision
+        self._vision = vision
+        self.client = client
+
+    @classmethod
+    def from_env(cls):
+        """None when the client cannot be created; call from inside the event loop"""
+        print("🚀 Initializing async Google Vision API...")
+        try:
+            return cls(AsyncManagedVisionClient.from_env(load_vision_credentials()))
+        except Exception as e:
+            logger.exception("❌ Async Vision API init failed: %s", e)
+            return None
+
+    async def recognize(self, content, image=None):
+        try:
+            response = await self.client.document_text_detection(image=self._vision.Image(content=content))
+        except Exception as e:
+            if is_transient(e):
+                raise OCRError(f"Google Vision temporarily unavailable: {str(e)}", kind='unavailable') from e
+            raise
+        if response.error.message:
+            raise OCRError(f"Google Vision API error: {response.error.message}", kind='vision_api')
+        return extract_words_boxes(response)
+
+    def describe(self):
+        return {"name": self.name, "mode": "async", "client": self.client.stats()}
+
+
+# ==============================================================================
+# TESSERACT (LOCAL)
+# ==============================================================================
+class TesseractBackend(OCRBackend):
+    """Local OCR with Tesseract; no network round trip, lower accuracy than Vision"""
+
+    name = 'tesseract'
+
+    def __init__(self, lang='eng', min_confidence=30.0, config='--psm 4'):
+        self.lang = lang
+        self.min_confidence = min_confidence
+        self.config = config
+
+    @classmethod
+    def from_env(cls):
+        """None when pytesseract or the tesseract binary is missing"""
+        if pytesseract is None:
+            return None
+        cmd = os.environ.get('TESSERACT_CMD')
+        if cmd:
+            pytesseract.pytesseract.tesseract_cmd = cmd
+        try:
+            version = pytesseract.get_tesseract_version()
+        except Exception as e:
+            print(f"[WARN] Tesseract not available: {e}")
+            return None
+        print(f"✅ Tesseract {version} available for local OCR")
+        return cls(
+            lang=os.environ.get('TESSERACT_LANG', 'eng'),
+            min_confidence=float(os.environ.get('TESSERACT_MIN_CONFIDENCE', 30)),
+            config=os.environ.get('TESSERACT_CONFIG', '--psm 4'),
+        )
+
+    def recognize(self, content, image=None):
+        if image is None:
+            try:
+                image = Image.open(io.BytesIO(content))
+                image.load()
+            except Exception as e:
+                raise OCRError(invalid_image_message(e), kind='invalid_image')
+
+        data = pytesseract.image_to_data(
+            image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT
+        )
+
+        words = []
+        boxes = []
+        for text, conf, left, top, width, height in zip(
+            data['text'], data['conf'], data['left'], data['top'], data['width'], data['height']
+        ):
+            text = text.strip()
+            # conf is -1 for layout rows (blocks, lines) that carry no word
+            if not text or float(conf) < self.min_confidence:
+                continue
+            words.append(text)
+            boxes.append([left, top, left + width, top + height])
+
+        return words, boxes
+
+    def describe(self):
+        return {"name": self.name, "lang": self.lang, "min_confidence": self.min_confidence}
+
+
+# ==============================================================================
+# REGISTRY
+# ==============================================================================
+BACKEND_FACTORIES = {
+    'google': VisionBackend.from_env,
+    'stub': VisionBackend.stub_from_env,
+    'tesseract': TesseractBackend.from_env,
+}
+
+
+class OCRBackends:
+    """Enabled backends, each created on first use, plus the default one"""
+
+    def __init__(self, factories, default=None):
+        self.resources = {name: LazyResource(name, factory) for name, factory in factories.items()}
+        if default not in self.resources:
+            default = next(iter(self.resources), None)
+        self.default = default
+
+    @classmethod
+    def from_env(cls):
+        """OCR_BACKENDS lists the engines to enable, OCR_BACKEND picks the default.
+
+        With VISION_STUB_FIXTURES set and OCR_BACKENDS unset only the stub is
+        enabled, so offline runs never reach for Google credentials.
+        """
+        stub_dir = os.environ.get('VISION_STUB_FIXTURES')
+        enabled = os.environ.get('OCR_BACKENDS') or ('stub' if stub_dir else 'google,tesseract')
+
+        factories = {}
+        for name in [n.strip().lower() for n in enabled.split(',') if n.strip()]:
+            factory = BACKEND_FACTORIES.get(name)
+            if factory is None:
+                print(f"[WARN] Unknown OCR backend: {name}")
+                continue
+            factories[name] = factory
+
+        return cls(factories, os.environ.get('OCR_BACKEND', '').lower() or None)
+
+    def _fallback_order(self):
+        return [self.default] + [n for n in self.resources if n != self.default]
+
+    def get(self, name=None):
+        """Backend by name, initializing it on first use; None if unavailable.
+
+        Without a name: the default backend, or the next enabled one that
+        initializes when the default cannot.
+        """
+        if name:
+            resource = self.resources.get(name)
+            return resource.get() if resource else None
+        for candidate in self._fallback_order():
+            backend = self.resources[candidate].get()
+            if backend:
+                return backend
+        return None
+
+    def ready_backend(self):
+        """The backend get() would return, if it is already initialized (never blocks)"""
+        for candidate in self._fallback_order():
+            resource = self.resources[candidate]
+            if resource.state == 'ready':
+                return resource.peek()
+            if resource.state != 'failed':
+                return None
+        return None
+
+    def state(self, name):
+        resource = self.resources.get(name)
+        return resource.state if resource else 'disabled'
+
+    def warm_up(self):
+        """Initialize every enabled backend in the background"""
+        for resource in self.resources.values():
+            resource.warm_up()
+
+    def names(self):
+        """Enabled backends that have not failed to initialize"""
+        return [name for name, r in self.resources.items() if r.state != 'failed']
+
+    def describe(self):
+        backends = []
+        for resource in self.resources.values():
+            info = resource.describe()
+            backend = resource.peek()
+            if backend:
+                info.update(backend.describe())
+            backends.append(info)
+        return {"default": self.default, "backends": backends}
+
+    def __bool__(self):
+        return bool(self.names())
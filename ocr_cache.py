@@ -0,0 +1,285 @@
+# ==============================================================================
+# ocr_cache.py - Content-addressed cache for OCR results (words + boxes)
+# ==============================================================================
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+def _entry_size(words, boxes):
+    """Approximate memory cost of one entry in bytes"""
+    return sum(len(w) for w in words) + 32 * len(boxes) + 64
+
+
+class OCRCache:
+    """Bounded in-memory LRU of (words, boxes) keyed by image hash.
+
+    Entries expire after `ttl` seconds. The memory tier evicts least recently
+    used entries once `max_entries` or `max_bytes` is exceeded. When `disk_dir`
+    is set, entries are also written there as JSON and memory misses fall back
+    to disk (promoting the entry back into memory). On disk a file's mtime is
+    its creation time and its atime the last hit, so the disk tier evicts
+    least recently used files too.
+
+    Results that are not OCR words/boxes (e.g. Mindee predictions) go through
+    get_payload()/put_payload() under their own namespace: they share the
+    budget and tiers but can never be returned by get().
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024, ttl=24 * 3600,
+                 disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        # key -> (created, size, value); value is (words, boxes), or a JSON
+        # string for namespaced payloads (keys "<namespace>/<key>")
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+        self._disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache from OCR_CACHE_* environment variables (None if disabled)"""
+        if os.environ.get('OCR_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+        return cls(
+            max_entries=int(os.environ.get('OCR_CACHE_MAX_ENTRIES', 512)),
+            max_bytes=int(float(os.environ.get('OCR_CACHE_MAX_MB', 64)) * 1024 * 1024),
+            ttl=int(os.environ.get('OCR_CACHE_TTL', 24 * 3600)),
+            disk_dir=os.environ.get('OCR_CACHE_DIR') or None,
+            disk_max_bytes=int(float(os.environ.get('OCR_CACHE_DISK_MAX_MB', 512)) * 1024 * 1024),
+        )
+
+    # --------------------------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------------------------
+    def get(self, key):
+        """Return (words, boxes) for `key`, or None on a miss"""
+        return self._get(key)
+
+    def get_payload(self, key, namespace):
+        """Return a payload stored with put_payload(), or None on a miss"""
+        text = self._get(f"{namespace}/{key}")
+        return None if text is None else json.loads(text)
+
+    def _get(self, key):
+        now = time.time()
+        hit = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, size, value = entry
+                if self._is_expired(created, now):
+                    self._drop(key)
+                    self._counters["expired"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    hit = value
+        if hit is not None:
+            if self.disk_dir:
+                self._disk_touch(self._disk_path(key), now)
+            return hit
+
+        cached = self._disk_get(key, now)
+        with self._lock:
+            if cached is None:
+                self._counters["misses"] += 1
+                return None
+            created, value = cached
+            self._counters["disk_hits"] += 1
+            self._insert(key, created, value)
+        return value
+
+    def contains(self, key):
+        """Whether `key` is cached and not expired (memory or disk), without counting a lookup"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_expired(entry[0], now):
+                return True
+        if not self.disk_dir:
+            return False
+        try:
+            created = os.stat(self._disk_path(key)).st_mtime
+        except OSError:
+            return False
+        return not self._is_expired(created, now)
+
+    def put(self, key, words, boxes):
+        """Store an OCR result under `key`"""
+        self._put(key, (list(words), [list(b) for b in boxes]))
+
+    def put_payload(self, key, namespace, payload):
+        """Store a JSON-serializable non-OCR result under `namespace`"""
+        self._put(f"{namespace}/{key}", json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=str))
+
+    def _put(self, key, value):
+        created = time.time()
+        with self._lock:
+            self._insert(key, created, value)
+            self._counters["stores"] += 1
+        self._disk_put(key, created, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Snapshot of counters and occupancy for health/metrics"""
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = self._counters["hits"] + self._counters["disk_hits"]
+            return dict(
+                self._counters,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+                ttl=self.ttl,
+                disk_enabled=bool(self.disk_dir),
+                hit_ratio=round(hits / lookups, 4) if lookups else 0.0,
+            )
+
+    # --------------------------------------------------------------------------
+    # Memory tier (callers hold self._lock)
+    # --------------------------------------------------------------------------
+    def _is_expired(self, created, now):
+        return self.ttl > 0 and now - created > self.ttl
+
+    def _insert(self, key, created, value):
+        if key in self._entries:
+            self._drop(key)
+        size = len(value) + 64 if isinstance(value, str) else _entry_size(*value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (created, size, value)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._counters["evictions"] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    # --------------------------------------------------------------------------
+    # Disk tier
+    # --------------------------------------------------------------------------
+    def _disk_path(self, key):
+        namespace, _, key = key.rpartition('/')
+        return os.path.join(self.disk_dir, namespace, key[:2], f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        created = payload.get("created", 0)
+        if self._is_expired(created, now):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._counters["expired"] += 1
+            return None
+        self._disk_touch(path, now)
+        if "payload" in payload:
+            return created, payload["payload"]
+        return created, (payload.get("words", []), payload.get("boxes", []))
+
+    def _disk_put(self, key, created, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                if isinstance(value, str):
+                    record = {"created": created, "payload": value}
+                else:
+                    record = {"created": created, "words": value[0], "boxes": value[1]}
+                json.dump(record, f, separators=(',', ':'))
+            # A rewrite of an existing key replaces that file's bytes
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"[WARN] OCR cache disk write failed: {e}")
+            return
+
+        with self._lock:
+            self._disk_bytes += size - old_size
+            over_budget = self._disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._disk_evict()
+
+    def _disk_touch(self, path, now):
+        """Record a hit as the file's atime (keeping mtime, the creation time)"""
+        try:
+            os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def _disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_atime, st.st_size, path))
+        return files
+
+    def _disk_evict(self):
+        """Delete the least recently used files until the disk tier is back under 90% of budget"""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.disk_max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                with self._lock:
+                    self._counters["evictions"] += 1
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
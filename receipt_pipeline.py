@@ -0,0 +1,626 @@
+# ==============================================================================
+# receipt_pipeline.py - OCR words/boxes -> lines -> filtered text -> JSON
+# ==============================================================================
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# NumPy is optional: the array-backed geometry path falls back to pure Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ==============================================================================
+# LINE GROUPING (FROM NOTEBOOK)
+# ==============================================================================
+# Line grouping engine: 'auto' (default: numpy when installed, else sweep),
+# 'numpy', 'sweep' or 'legacy' (original O(n²) loop, kept for equivalence
+# testing). All engines produce identical text.
+LINE_GROUPING_ENGINE = os.environ.get('LINE_GROUPING_ENGINE', 'auto').lower()
+
+# Upper bound on cells in the banded overlap matrix before the numpy engine
+# hands off to the sweep (a very tall box can widen the band to ~N columns)
+NUMPY_MAX_BAND_CELLS = 4_000_000
+
+def to_box_array(boxes):
+    """Convert [[x0, y0, x1, y1], ...] to an (N, 4) int32 array"""
+    if np is None:
+        raise RuntimeError("NumPy is not installed")
+    if isinstance(boxes, np.ndarray) and boxes.dtype == np.int32:
+        return boxes.reshape(-1, 4)
+    return np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+
+def group_lines_by_height_overlap(words, boxes, overlap_threshold=0.5, engine=None):
+    """Group words into lines based on vertical overlap"""
+    return "\n".join(group_lines(words, boxes, overlap_threshold, engine))
+
+def group_lines(words, boxes, overlap_threshold=0.5, engine=None):
+    """Lines of group_lines_by_height_overlap() as a list of strings, top to bottom"""
+    if len(words) == 0 or len(boxes) == 0:
+        return []
+
+    engine = (engine or LINE_GROUPING_ENGINE).lower()
+    # The sweep and numpy engines rely on overlap > threshold implying a
+    # positive overlap
+    if engine == 'legacy' or overlap_threshold < 0:
+        return _group_lines_legacy(words, boxes, overlap_threshold)
+    if engine in ('auto', 'numpy') and np is not None:
+        lines = _group_lines_numpy(words, boxes, overlap_threshold)
+        if lines is not None:
+            return lines
+    return _group_lines_sweep(words, boxes, overlap_threshold)
+
+def _group_lines_numpy(words, boxes, overlap_threshold):
+    """Array-backed grouping; same semantics as _group_lines_sweep.
+
+    Boxes are held as an (N, 4) int32 array sorted by top edge. Each word can
+    only overlap words whose top edge lies above its bottom edge, so overlap
+    ratios are computed in one batch for that band (N x W, W = widest window)
+    instead of the full N x N matrix. Line assignment walks the seeds in order
+    over the precomputed join lists; the in-line x ordering and inter-word gap
+    (distance > 20 -> tab) are then computed in batch across all lines.
+    Returns None when the band would be too large, so the caller can fall back.
+    """
+    arr = to_box_array(boxes)
+    n = min(len(words), len(arr))
+    arr = arr[:n]
+
+    order = np.argsort(arr[:, 1], kind='stable')
+    b = arr[order].astype(np.int64)
+    x_start, top, x_end, bottom = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    height = bottom - top
+
+    positions = np.arange(n)
+    window_end = np.searchsorted(top, bottom, side='left')
+    width = int(max(0, (window_end - positions - 1).max()))
+
+    if width:
+        if n * width > NUMPY_MAX_BAND_CELLS:
+            return None
+        band = positions[:, None] + 1 + np.arange(width)[None, :]
+        in_band = band < window_end[:, None]
+        band = np.minimum(band, n - 1)
+
+        overlap_h = np.maximum(0, np.minimum(bottom[:, None], bottom[band]) - np.maximum(top[:, None], top[band]))
+        min_height = np.minimum(height[:, None], height[band])
+        ratio = overlap_h / np.where(min_height > 0, min_height, 1)
+        joins = in_band & (min_height > 0) & (ratio > overlap_threshold)
+
+        seeds, cols = np.nonzero(joins)
+        candidates = band[seeds, cols].tolist()
+        bounds = np.searchsorted(seeds, np.arange(n + 1)).tolist()
+    else:
+        candidates = []
+        bounds = [0] * (n + 1)
+
+    assigned = [False] * n
+    line_of = [0] * n
+    rank_in_line = [0] * n
+    line_count = 0
+    for seed in range(n):
+        if assigned[seed]:
+            continue
+        members = [seed]
+        members += [c for c in candidates[bounds[seed]:bounds[seed + 1]] if not assigned[c]]
+        for rank, pos in enumerate(members):
+            assigned[pos] = True
+            line_of[pos] = line_count
+            rank_in_line[pos] = rank
+        line_count += 1
+    line_of = np.array(line_of)
+
+    # Line by line, left to right (ties keep the legacy pick-up order)
+    flat = np.lexsort((np.array(rank_in_line), x_start, line_of))
+    new_line = line_of[flat][1:] != line_of[flat][:-1]
+    distance = x_start[flat][1:] - x_end[flat][:-1]
+    separators = np.where(new_line, "\n", np.where(distance > 20, " \t ", " ")).tolist()
+
+    ordered_words = [words[i] for i in order[flat].tolist()]
+    lines = []
+    parts = [ordered_words[0]]
+    for sep, text in zip(separators, ordered_words[1:]):
+        if sep == "\n":
+            lines.append("".join(parts))
+            parts = [text]
+        else:
+            parts.append(sep)
+            parts.append(text)
+    lines.append("".join(parts))
+    return lines
+
+def _group_lines_sweep(words, boxes, overlap_threshold):
+    """Sweep-line grouping over words sorted by top edge.
+
+    Same semantics as _group_lines_legacy: the topmost ungrouped word seeds a
+    line and collects every other ungrouped word whose vertical overlap with
+    the seed exceeds the threshold. Because words are sorted by top edge, only
+    words starting above the seed's bottom edge can overlap it, so each seed
+    scans a short window of a linked list of ungrouped words instead of all
+    remaining words. Sorting dominates: O(n log n) for typical receipts.
+    """
+    pairs = list(zip(words, boxes))
+    n = len(pairs)
+    order = sorted(range(n), key=lambda i: pairs[i][1][1])
+    y_top = [pairs[i][1][1] for i in order]
+    y_bottom = [pairs[i][1][3] for i in order]
+
+    # Doubly linked list over sorted positions of still-ungrouped words
+    nxt = list(range(1, n + 1))
+    prv = list(range(-1, n - 1))
+
+    def unlink(pos):
+        if prv[pos] >= 0:
+            nxt[prv[pos]] = nxt[pos]
+        if nxt[pos] < n:
+            prv[nxt[pos]] = prv[pos]
+
+    lines = []
+    head = 0
+    while head < n:
+        seed = head
+        top_curr = y_top[seed]
+        bottom_curr = y_bottom[seed]
+        height_curr = bottom_curr - top_curr
+
+        line = [order[seed]]
+        pos = nxt[seed]
+        while pos < n and y_top[pos] < bottom_curr:
+            following = nxt[pos]
+            bottom_other = y_bottom[pos]
+            overlap_h = max(0, min(bottom_curr, bottom_other) - y_top[pos])
+            min_height = min(height_curr, bottom_other - y_top[pos])
+
+            if min_height > 0 and (overlap_h / min_height) > overlap_threshold:
+                line.append(order[pos])
+                unlink(pos)
+            pos = following
+
+        head = nxt[seed]
+        unlink(seed)
+
+        line.sort(key=lambda i: pairs[i][1][0])
+        lines.append([pairs[i] for i in line])
+
+    final_text_lines = []
+    for line_items in lines:
+        parts = [line_items[0][0]]
+        for (_, prev_box), (text, curr_box) in zip(line_items, line_items[1:]):
+            distance = curr_box[0] - prev_box[2]
+            parts.append(" \t " if distance > 20 else " ")
+            parts.append(text)
+        final_text_lines.append("".join(parts))
+
+    return final_text_lines
+
+def _group_lines_legacy(words, boxes, overlap_threshold=0.5):
+    """Original quadratic grouping (reference implementation)"""
+    results = []
+    for word, box in zip(words, boxes):
+        bbox = [
+            [box[0], box[1]],
+            [box[2], box[1]],
+            [box[2], box[3]],
+            [box[0], box[3]]
+        ]
+        results.append((bbox, word))
+
+    results = sorted(results, key=lambda r: r[0][0][1])
+    lines = []
+
+    while results:
+        current_item = results.pop(0)
+        box_curr = current_item[0]
+
+        y_min_curr = min(box_curr[0][1], box_curr[1][1])
+        y_max_curr = max(box_curr[2][1], box_curr[3][1])
+        height_curr = y_max_curr - y_min_curr
+
+        current_line = [current_item]
+        remaining_results = []
+
+        for other_item in results:
+            box_other = other_item[0]
+            y_min_other = min(box_other[0][1], box_other[1][1])
+            y_max_other = max(box_other[2][1], box_other[3][1])
+
+            overlap_min = max(y_min_curr, y_min_other)
+            overlap_max = min(y_max_curr, y_max_other)
+            overlap_h = max(0, overlap_max - overlap_min)
+
+            height_other = y_max_other - y_min_other
+            min_height = min(height_curr, height_other)
+
+            if min_height > 0 and (overlap_h / min_height) > overlap_threshold:
+                current_line.append(other_item)
+            else:
+                remaining_results.append(other_item)
+
+        results = remaining_results
+        current_line.sort(key=lambda item: item[0][0][0])
+        lines.append(current_line)
+
+    final_text_lines = []
+    for line_items in lines:
+        line_str = ""
+        for i, item in enumerate(line_items):
+            text = item[1]
+            if i > 0:
+                prev_box = line_items[i-1][0]
+                curr_box = item[0]
+                prev_x_end = max(prev_box[1][0], prev_box[2][0])
+                curr_x_start = min(curr_box[0][0], curr_box[3][0])
+                distance = curr_x_start - prev_x_end
+
+                if distance > 20:
+                    line_str += " \t " + text
+                else:
+                    line_str += " " + text
+            else:
+                line_str += text
+
+        final_text_lines.append(line_str)
+
+    return final_text_lines
+
+
+# ==============================================================================
+# LINE RULES (compiled once at import)
+# ==============================================================================
+BLACKLIST_PATTERNS = [
+    r'NO\.|TRANS|DATE|TIME|TANGGAL|WAKTU|KASIR|TABLE|BILL|RECEIPT|WELCOME|THANK',
+    r'PHONE|FAX|EMAIL|WEBSITE|WWW|TELP',
+    r'MANDIRI|BCA|BNI|BRI|CIMB|DANAMON|PERMATA|MAYBANK',
+    r'QRIS|GOPAY|OVO|DANA|LINKAJA|SHOPEEPAY',
+    r'DEBIT|CREDIT|CARD|KARTU|EDC|FLASH|E-MONEY',
+    r'TUNAI|PAID|LUNAS|BAYAR'
+]
+# Dates and long transaction/card codes, kept apart from the keyword
+# alternation so the keywords keep their fast literal prefix scan
+BLACKLIST_CODE_PATTERN = r'\d{2}[-./]\d{2}[-./]\d{2,4}|[A-Z0-9]{12,}'
+DISCOUNT_KEYWORDS = r'DISKON|DISC|VOUCHER|POTONGAN|PROMO|HEMAT'
+
+# Rule table: (flag, pattern, anchored). Patterns are written in upper case;
+# anchored rules must match at the start of the line, the rest anywhere.
+LINE_RULES = [
+    ("separator", r'[\-=_]{3,}$', True),
+    ("metadata", r'OPERATOR|CASHIER|KASIR|SERVER|TABLE|TBL|POS|SHIFT|WAKTU|DATE|TIME|NO\.|ORDER|PICKUP|QUEUE|ANTRIAN', True),
+    ("total", r'GRAND\s*TOTAL|TOTAL\s*BAYAR|AMOUNT|TAGIHAN|NET|TOTAL\s+[A-Z]+|TOTAL\b', True),
+    ("total_excluded", r'SUB|DISC|HEMAT|SAVING|ITEM', False),
+    ("tax", r'TAX|PAJAK|PB1|PPN|VAT', False),
+    ("service", r'SERVICE|SC[:\s]|CHARGE', False),
+    ("discount", DISCOUNT_KEYWORDS, False),
+    ("blacklist", '|'.join(BLACKLIST_PATTERNS), False),
+    ("blacklist_code", BLACKLIST_CODE_PATTERN, False),
+    ("change", r'CHANGE|KEMBALI|CASH', False),
+    ("change_word", r'CHANGE', False),
+    ("service_word", r'SERVICE', False),
+    ("money", r'(?:RP\.?\s*|@\s*|X\s*)?\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{0,2})?', False),
+    ("keyword", r'TOTAL|SUBTOTAL|TAX|PAJAK|PPN|HARGA|QTY|ITEM|DISKON|SC|SERVICE', False),
+]
+
+def _compile_rules(flags):
+    return [
+        (name, re.compile(f"^(?:{pattern})" if anchored else pattern, flags))
+        for name, pattern, anchored in LINE_RULES
+    ]
+
+# ASCII lines are upper-cased once and matched case-sensitively, which lets
+# the regex engine use its literal prefix scan; other lines fall back to
+# IGNORECASE so non-ASCII case folding behaves exactly as before
+ASCII_RULES = _compile_rules(0)
+UNICODE_RULES = _compile_rules(re.IGNORECASE)
+
+ITEM_PATTERN = re.compile(r'^(.*?)\s*((?:Rp\.?\s*)?[\d,.]+)$', re.IGNORECASE)
+QTY_PATTERN = re.compile(r'(?:^|\s)[x@]\s*(\d+)|(\d+)\s*[x@]', re.IGNORECASE)
+SEPARATOR_ONLY_PATTERN = re.compile(r'^[\-=_]+$')
+
+def _compile_keywords(pattern):
+    """(ascii, unicode) pattern pair for keyword_search"""
+    return re.compile(pattern), re.compile(pattern, re.IGNORECASE)
+
+def keyword_search(keywords, text):
+    """Case-insensitive search of an upper-case keyword alternation"""
+    ascii_pattern, unicode_pattern = keywords
+    if text.isascii():
+        return ascii_pattern.search(text.upper())
+    return unicode_pattern.search(text)
+
+# Applied to item names (not whole lines), so kept outside LINE_RULES
+FORBIDDEN_ITEMS = _compile_keywords(r'TOTAL|SUBTOTAL|BELANJA|JUAL|HEMAT|PAYMENT|NPWP|DPP|PURCHASE|VAT|HASE|CHANGE|KEMBALI|CASH|TUNAI|DEBIT|CREDIT|ITEM|ITEMS|QTY|MENU|EDC|MANUAL')
+DISCOUNT_ITEMS = _compile_keywords(DISCOUNT_KEYWORDS)
+NON_DIGIT_PATTERN = re.compile(r'\D')
+
+LineClass = namedtuple('LineClass', ['category', 'flags'])
+
+@lru_cache(maxsize=8192)
+def classify_line(line):
+    """Run a stripped line through the rule table once.
+
+    Returns LineClass(category, flags): flags is the frozenset of LINE_RULES
+    names that matched, category is one of metadata, total, tax, service,
+    noise, discount or item (priced line or item name) in the precedence
+    parse_receipt_to_json applies them. Results are memoized, so the parser
+    reuses the classification done by smart_filter_receipt.
+    """
+    if line.isascii():
+        subject, rules = line.upper(), ASCII_RULES
+    else:
+        subject, rules = line, UNICODE_RULES
+    flags = frozenset(name for name, rule in rules if rule.search(subject))
+
+    if 'separator' in flags or 'metadata' in flags:
+        category = 'metadata'
+    elif 'total' in flags:
+        category = 'noise' if 'total_excluded' in flags else 'total'
+    elif 'tax' in flags:
+        category = 'tax'
+    elif 'service' in flags:
+        category = 'service'
+    elif 'blacklist' in flags or 'blacklist_code' in flags or ('change' in flags and not ('change_word' in flags and 'service_word' in flags)):
+        category = 'noise'
+    elif 'discount' in flags:
+        category = 'discount'
+    else:
+        category = 'item'
+    return LineClass(category, flags)
+
+def parse_price(price_str):
+    digits = NON_DIGIT_PATTERN.sub('', price_str)
+    return int(digits) if digits else 0
+
+# ==============================================================================
+# FILTER & PARSE (FROM NOTEBOOK)
+# ==============================================================================
+# Both stages work on a stream of lines: filter_lines() is a generator over
+# grouped lines and ReceiptParser takes them one at a time, so
+# group_lines() -> filter_lines() -> ReceiptParser.parse() runs without
+# joining and re-splitting the text between stages. smart_filter_receipt()
+# and parse_receipt_to_json() keep the original text-in/text-out API.
+def filter_lines(lines):
+    """Yield the receipt lines worth parsing (stripped), dropping metadata and payment noise"""
+    final_line = None
+    prev_line = None
+    for line in lines:
+        line_clean = line.strip()
+        prev_raw, prev_line = prev_line, line
+        if not line_clean:
+            continue
+
+        flags = classify_line(line_clean).flags
+        if 'blacklist' in flags or 'blacklist_code' in flags:
+            continue
+
+        is_service_change = 'service_word' in flags and 'change_word' in flags
+
+        if not is_service_change and 'change' in flags:
+            continue
+
+        has_money = 'money' in flags
+        has_keyword = 'keyword' in flags
+
+        if has_money or has_keyword:
+            # A priced line may carry its item name on the line above
+            if has_money and not has_keyword and prev_raw is not None:
+                prev_clean = prev_raw.strip()
+                prev_flags = classify_line(prev_clean).flags
+                if ('blacklist' not in prev_flags and
+                    'blacklist_code' not in prev_flags and
+                    'money' not in prev_flags and
+                    'keyword' not in prev_flags and
+                    final_line != prev_clean):
+                    final_line = prev_clean
+                    yield prev_clean
+            final_line = line_clean
+            yield line_clean
+
+def smart_filter_receipt(text):
+    """Filter receipt text"""
+    if not text or text.strip() == "":
+        return ""
+    return '\n'.join(filter_lines(text.split('\n')))
+
+class ReceiptParser:
+    """Incremental parse_receipt_to_json: feed() filtered lines one at a time.
+
+    An item is final once the next one starts (a following "2 x 15.000" line
+    can still set its qty and unit price), so parse() yields each item one
+    line late and the last one when the lines run out. result() returns the
+    same dict as parse_receipt_to_json for everything fed so far.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.grand_total = 0
+        self.tax = 0
+        self.service = 0
+        self.total_discount = 0
+        self.pending_name = None
+        self.lines_fed = 0
+        self._emitted = 0
+
+    def parse(self, lines):
+        """Feed all lines, yielding items as they become final"""
+        for line in lines:
+            self.feed(line)
+            if len(self.items) - 1 > self._emitted:
+                yield from self._take(len(self.items) - 1)
+        yield from self._take(len(self.items))
+
+    def _take(self, end):
+        ready = self.items[self._emitted:end]
+        self._emitted = end
+        return ready
+
+    def feed(self, line):
+        """Parse one line of filtered receipt text"""
+        self.lines_fed += 1
+        line = line.strip()
+        if not line:
+            return
+
+        category, flags = classify_line(line)
+
+        if category == 'metadata':
+            self.pending_name = None
+            return
+
+        if 'total' in flags:
+            if category == 'total':
+                parts = ITEM_PATTERN.search(line)
+                if parts:
+                    found_total = parse_price(parts.group(2))
+                    if found_total > 0:
+                        self.grand_total = found_total
+            return
+
+        if category == 'tax':
+            parts = ITEM_PATTERN.search(line)
+            if parts:
+                self.tax = parse_price(parts.group(2))
+            return
+
+        if category == 'service':
+            parts = ITEM_PATTERN.search(line)
+            if parts:
+                self.service = parse_price(parts.group(2))
+            return
+
+        items = self.items
+        pending_name = self.pending_name
+        qty_match = QTY_PATTERN.search(line)
+        price_match = ITEM_PATTERN.search(line)
+
+        if pending_name and price_match:
+            current_line_name = price_match.group(1).strip()
+            if keyword_search(FORBIDDEN_ITEMS, current_line_name):
+                self.pending_name = pending_name = None
+            else:
+                total_price = parse_price(price_match.group(2))
+
+                if keyword_search(DISCOUNT_ITEMS, pending_name):
+                    self.total_discount += abs(total_price)
+                    self.pending_name = None
+                    return
+
+                calc_qty = 1
+                if qty_match:
+                    q_val = qty_match.group(1) or qty_match.group(2)
+                    if q_val:
+                        calc_qty = int(q_val)
+
+                if not keyword_search(FORBIDDEN_ITEMS, pending_name):
+                    items.append({
+                        "name": pending_name,
+                        "qty": calc_qty,
+                        "unit_price": total_price // calc_qty if calc_qty > 0 else total_price,
+                        "line_total": total_price
+                    })
+                self.pending_name = None
+                return
+
+        if not pending_name and items and (qty_match or ("@" in line and price_match)):
+            qty_val = 1
+            if qty_match:
+                q = qty_match.group(1) or qty_match.group(2)
+                if q:
+                    qty_val = int(q)
+
+            if price_match:
+                unit = parse_price(price_match.group(2))
+                items[-1]['unit_price'] = unit
+                if qty_val > 1:
+                    items[-1]['qty'] = qty_val
+            elif qty_val > 1:
+                items[-1]['qty'] = qty_val
+            return
+
+        if price_match:
+            name = price_match.group(1).strip()
+            total_price = parse_price(price_match.group(2))
+
+            if keyword_search(FORBIDDEN_ITEMS, name):
+                return
+            if total_price > 100000000:
+                return
+
+            if len(name) > 1:
+                if keyword_search(DISCOUNT_ITEMS, name):
+                    self.total_discount += abs(total_price)
+                    return
+
+                items.append({
+                    "name": name,
+                    "qty": 1,
+                    "unit_price": total_price,
+                    "line_total": total_price
+                })
+            self.pending_name = None
+            return
+
+        if not keyword_search(FORBIDDEN_ITEMS, line):
+            if not SEPARATOR_ONLY_PATTERN.match(line):
+                self.pending_name = line
+
+    def result(self):
+        """Items, summary and status ({} when no line was fed)"""
+        if not self.lines_fed:
+            return {}
+        return summarize_receipt(self.items, self.grand_total, self.tax, self.service, self.total_discount)
+
+def summarize_receipt(items, grand_total, tax=0, service=0, total_discount=0):
+    """Items, summary and status for parsed items and totals (shared with the Mindee route)"""
+    calc_subtotal = sum(i['line_total'] for i in items)
+    final_calc_total = calc_subtotal - total_discount + tax + service
+
+    gap = grand_total - final_calc_total
+
+    if tax > 0 and abs(gap) == tax:
+        tax = 0
+        final_calc_total = grand_total
+
+    if grand_total == 0:
+        if final_calc_total > 0:
+            status = "Total Not Found (Auto-Calculated)"
+            grand_total = final_calc_total
+        else:
+            status = "Total Not Found"
+    else:
+        diff = grand_total - final_calc_total
+        status = f"Gap {diff}" if abs(diff) > 1000 else "Balanced"
+
+    return {
+        "items": list(items),
+        "summary": {
+            "subtotal": calc_subtotal,
+            "total_discount": total_discount,
+            "tax": tax,
+            "service": service,
+            "grand_total": grand_total,
+            "calculated_total": final_calc_total,
+            "diff": grand_total - final_calc_total
+        },
+        "status": status
+    }
+
+def outcome_label(status):
+    """Collapse parser statuses into a fixed label set ("Gap 1500" -> "gap")"""
+    if status.startswith('Gap'):
+        return 'gap'
+    return {
+        "Balanced": "balanced",
+        "Total Not Found": "total_not_found",
+        "Total Not Found (Auto-Calculated)": "total_auto_calculated",
+        "No Text Detected": "no_text",
+    }.get(status, 'other')
+
+def parse_receipt_to_json(clean_text):
+    """Parse receipt to JSON"""
+    if not clean_text:
+        return {}
+
+    parser = ReceiptParser()
+    for line in clean_text.split('\n'):
+        parser.feed(line)
+    return parser.result()
@@ -0,0 +1,167 @@
+# ==============================================================================
+# receipt_store.py - Persistent store of parsed receipts (SQLite, WAL mode)
+# ==============================================================================
+# Each successful parse is kept with the OCR output it came from, so the app
+# can fetch an earlier result by id (GET /receipts/<id>) instead of uploading
+# and OCR-ing the image again, and the current rules can be re-run over the
+# stored words/boxes (POST /receipts/<id>/reparse) without a Vision call.
+# One row per (image hash, OCR backend): a repeat upload updates the row and
+# keeps its id. Words/boxes use the compact cpu_pool packing.
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from cpu_pool import pack_ocr, unpack_ocr
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    word_count INTEGER NOT NULL,
+    words TEXT NOT NULL,
+    boxes BLOB NOT NULL,
+    result BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS receipts_image_hash ON receipts (image_hash, created);
+CREATE INDEX IF NOT EXISTS receipts_created ON receipts (created);
+"""
+
+# Retention is enforced every this many saves
+PRUNE_EVERY = 200
+
+
+class ReceiptStore:
+    """SQLite-backed receipts: OCR words/boxes plus the parse response.
+
+    One connection per thread (sqlite3 connections are not shared across
+    threads); WAL lets readers run while a write is in progress. Rows older
+    than `retention_days` (0 = keep forever) are pruned as saves come in.
+    """
+
+    def __init__(self, path, retention_days=0, dumps=None):
+        self.path = path
+        self.retention_days = retention_days
+        self._dumps = dumps or (lambda obj: json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"saves": 0, "updates": 0, "reads": 0, "misses": 0, "reparses": 0, "pruned": 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, dumps=None):
+        """RECEIPT_STORE_* settings (None when no path is configured)"""
+        path = os.environ.get('RECEIPT_STORE_PATH')
+        if not path:
+            return None
+        return cls(path, retention_days=float(os.environ.get('RECEIPT_STORE_RETENTION_DAYS', 0)), dumps=dumps)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, event, n=1):
+        with self._lock:
+            self._counters[event] += n
+
+    # --------------------------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------------------------
+    def save(self, image_hash, backend, words, boxes, result):
+        """Store a parse result; returns the receipt id (reused for the same image and backend)"""
+        count, text, box_bytes = pack_ocr(words, boxes)
+        payload = self._dumps(result)
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM receipts WHERE image_hash = ? AND backend = ? ORDER BY created DESC LIMIT 1",
+                (image_hash, backend)).fetchone()
+            if row:
+                receipt_id = row[0]
+                conn.execute(
+                    "UPDATE receipts SET updated = ?, word_count = ?, words = ?, boxes = ?, result = ? WHERE id = ?",
+                    (now, count, text, box_bytes, payload, receipt_id))
+            else:
+                receipt_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO receipts (id, image_hash, backend, created, updated, word_count, words, boxes, result)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (receipt_id, image_hash, backend, now, now, count, text, box_bytes, payload))
+
+        with self._lock:
+            self._counters["updates" if row else "saves"] += 1
+            due = self.retention_days and (self._counters["saves"] + self._counters["updates"]) % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+        return receipt_id
+
+    def get(self, receipt_id, with_ocr=False):
+        """Stored receipt as a dict (result, metadata, and words/boxes when with_ocr), or None"""
+        columns = "id, image_hash, backend, created, updated, result"
+        if with_ocr:
+            columns += ", word_count, words, boxes"
+        row = self._connect().execute(f"SELECT {columns} FROM receipts WHERE id = ?", (receipt_id,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("reads")
+
+        receipt = {
+            "receipt_id": row[0],
+            "image_hash": row[1],
+            "backend": row[2],
+            "created": row[3],
+            "updated": row[4],
+            "result": json.loads(row[5]),
+        }
+        if with_ocr:
+            receipt["words"], receipt["boxes"] = unpack_ocr((row[6], row[7], row[8]))
+        return receipt
+
+    def update_result(self, receipt_id, result):
+        """Replace the stored parse response (after a re-parse); False if the id is unknown"""
+        conn = self._connect()
+        with conn:
+            changed = conn.execute("UPDATE receipts SET updated = ?, result = ? WHERE id = ?",
+                                   (time.time(), self._dumps(result), receipt_id)).rowcount
+        if changed:
+            self._count("reparses")
+        return bool(changed)
+
+    def iter_ocr(self, since=0.0):
+        """(receipt_id, words, boxes) for every stored receipt created after `since`, oldest first"""
+        rows = self._connect().execute(
+            "SELECT id, word_count, words, boxes FROM receipts WHERE created > ? ORDER BY created", (since,))
+        for receipt_id, count, text, box_bytes in rows:
+            words, boxes = unpack_ocr((count, text, box_bytes))
+            yield receipt_id, words, boxes
+
+    def prune(self):
+        """Delete rows older than the retention period; returns how many"""
+        if not self.retention_days:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        conn = self._connect()
+        with conn:
+            deleted = conn.execute("DELETE FROM receipts WHERE created < ?", (cutoff,)).rowcount
+        self._count("pruned", deleted)
+        return deleted
+
+    def stats(self):
+        rows = self._connect().execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+        with self._lock:
+            return dict(self._counters, rows=rows, path=self.path, retention_days=self.retention_days)
@@ -0,0 +1,162 @@
+# ==============================================================================
+# response_format.py - Response shaping, JSON serialization and compression
+# ==============================================================================
+# A /parse response carries the filtered receipt text (debug.raw_text) and an
+# object per item; on a slow mobile link most of that is overhead. Clients
+# can ask for less with query parameters:
+#   ?debug=0         drop the debug block
+#   ?fields=a,b.c    keep only these (dotted) keys; "status" is always kept
+#   ?items=array     items as [name, qty, unit_price, line_total] rows
+#   ?format=compact  debug=0 + items=array
+# JSON is serialized with orjson when installed (JSON_SERIALIZER) and
+# compressed with brotli or gzip, per Accept-Encoding, once the body is
+# larger than RESPONSE_COMPRESS_MIN_BYTES.
+import os
+import json
+import gzip
+from collections import namedtuple
+from flask.json.provider import DefaultJSONProvider
+
+# Optional fast paths; the stdlib json module and gzip are always available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# auto (orjson when installed), orjson or json
+JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'auto').lower()
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1').lower() not in ('0', 'false', 'no')
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 512))
+
+# Fast settings: receipt JSON is small and repetitive, higher levels gain little
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+ITEM_FIELDS = ["name", "qty", "unit_price", "line_total"]
+
+ResponseShape = namedtuple('ResponseShape', ['fields', 'debug', 'items'])
+
+
+def _flag(value, default):
+    if value is None or value == '':
+        return default
+    return value.lower() not in ('0', 'false', 'no')
+
+
+def shape_from_args(args):
+    """ResponseShape from request query parameters, or None for the full response"""
+    compact = (args.get('format') or '').lower() == 'compact'
+    fields = [f.strip() for f in (args.get('fields') or '').split(',') if f.strip()]
+    debug = _flag(args.get('debug'), not compact)
+    items = (args.get('items') or ('array' if compact else 'objects')).lower()
+    if not fields and debug and items != 'array':
+        return None
+    return ResponseShape(fields, debug, items)
+
+
+def select_fields(body, paths):
+    """Copy of `body` with only the dotted key paths (plus "status")"""
+    selected = {"status": body["status"]} if "status" in body else {}
+    for path in paths:
+        keys = path.split('.')
+        src, dst = body, selected
+        for key in keys[:-1]:
+            if not isinstance(src.get(key), dict):
+                break
+            src = src[key]
+            dst = dst.setdefault(key, {})
+        else:
+            if keys[-1] in src:
+                dst[keys[-1]] = src[keys[-1]]
+    return selected
+
+
+def shape_body(body, shape):
+    """Apply a ResponseShape to one parse response (error bodies pass through)"""
+    if shape is None or not isinstance(body, dict) or body.get("status") != "success":
+        return body
+
+    body = dict(body)
+    if not shape.debug:
+        body.pop("debug", None)
+    data = body.get("data")
+    if shape.items == 'array' and isinstance(data, dict) and "items" in data:
+        data = dict(data)
+        data["items"] = [[item.get(k) for k in ITEM_FIELDS] for item in data["items"]]
+        data["item_fields"] = ITEM_FIELDS
+        body["data"] = data
+    if shape.fields:
+        body = select_fields(body, shape.fields)
+    return body
+
+
+# ==============================================================================
+# SERIALIZATION
+# ==============================================================================
+def use_orjson():
+    return orjson is not None and JSON_SERIALIZER in ('auto', 'orjson')
+
+
+def dumps(obj, sort_keys=False):
+    """Compact UTF-8 JSON bytes"""
+    if use_orjson():
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        except TypeError:
+            pass  # e.g. an integer beyond 64 bits; the stdlib handles it
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, sort_keys=sort_keys,
+                      default=str).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that renders jsonify() bodies with dumps() (orjson)"""
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)  # indented output for debugging
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, sort_keys=self.sort_keys), mimetype=self.mimetype)
+
+
+def serializer_name():
+    return 'orjson' if use_orjson() else 'json'
+
+
+# ==============================================================================
+# COMPRESSION
+# ==============================================================================
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header"""
+    if not RESPONSE_COMPRESSION or not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_body(data, accept_encoding):
+    """(possibly compressed data, Content-Encoding or None)"""
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None or len(data) < RESPONSE_COMPRESS_MIN_BYTES:
+        return data, None
+    return compress(data, encoding), encoding
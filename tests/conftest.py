@@ -0,0 +1,24 @@
+# ==============================================================================
+# conftest.py - Offline test setup: stub OCR fixtures, no network, no warm-up
+# ==============================================================================
+# Run from the repository root: python -m pytest -q
+# main.py reads its settings at import, so they are set here before any test
+# module imports it.
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+os.environ.update({
+    'VISION_STUB_FIXTURES': os.path.join(REPO_DIR, 'benchmarks', 'fixtures'),
+    'OCR_BACKENDS': 'stub',
+    'OCR_WARMUP': '0',
+    'CPU_POOL_WORKERS': '0',
+    'RATE_LIMIT_ENABLED': '0',
+    'NEAR_DUP_ENABLED': '0',
+    'LOG_LEVEL': 'WARNING',
+})
+for name in ('OCR_CACHE_DIR', 'RECEIPT_STORE_PATH', 'MINDEE_API_KEY', 'RATE_LIMIT_REDIS_URL'):
+    os.environ.pop(name, None)
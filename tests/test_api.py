@@ -0,0 +1,200 @@
+# ==============================================================================
+# test_api.py - Flask endpoints end to end against the stub OCR backend
+# ==============================================================================
+import io
+import json
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import main
+from conftest import REPO_DIR
+from image_preprocess import INVALID_IMAGE_MESSAGE
+from job_queue import JobQueue
+from vision_stub import load_fixture
+
+FIXTURES_DIR = os.path.join(REPO_DIR, 'benchmarks', 'fixtures')
+with open(os.path.join(REPO_DIR, 'benchmarks', 'baseline.json'), encoding='utf-8') as f:
+    EXPECTED = json.load(f)["receipts"]
+
+
+@pytest.fixture
+def stub():
+    client = main.ocr_backends.get('stub').client
+    fixtures = dict(client.fixtures)
+    yield client
+    client.fixtures = fixtures
+    client.latency = 0.0
+
+
+@pytest.fixture
+def client():
+    if main.ocr_cache:
+        main.ocr_cache.clear()
+    return main.app.test_client()
+
+
+def receipt_image(stub, name):
+    """A small PNG the stub answers with the recorded OCR output of fixture `name`"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (60, 90), (sum(map(ord, name)) % 256, len(name), 200)).save(buffer, format='PNG')
+    image = buffer.getvalue()
+    words, boxes, _ = load_fixture(os.path.join(FIXTURES_DIR, f'{name}.json'))
+    stub.add(image, words, boxes)
+    return image
+
+
+def upload(image, filename='receipt.png'):
+    return (io.BytesIO(image), filename)
+
+
+# ------------------------------------------------------------------------------
+# /parse
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize("name", ["synthetic_000", "synthetic_003", "synthetic_005"])
+@pytest.mark.parametrize("path", ["/parse", "/scan"])
+def test_parse_matches_baseline(client, stub, name, path):
+    response = client.post(path, data={'file': upload(receipt_image(stub, name))})
+    assert response.status_code == 200
+    data = response.get_json()["data"]
+    assert data["summary"]["grand_total"] == EXPECTED[name]["grand_total"]
+    assert data["status"] == EXPECTED[name]["status"]
+
+
+def test_parse_repeat_upload_hits_ocr_cache(client, stub):
+    image = receipt_image(stub, "synthetic_001")
+    calls = stub.calls
+    for _ in range(3):
+        assert client.post('/parse', data={'file': upload(image)}).status_code == 200
+    assert stub.calls - calls == (1 if main.ocr_cache else 3)
+
+
+def test_parse_rejects_bad_uploads(client):
+    assert client.post('/parse', data={}).status_code == 400
+    assert client.post('/parse', data={'file': upload(b'text', 'notes.txt')}).status_code == 400
+    assert client.post('/parse', data={'file': upload(b'', 'empty.png')}).status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/parse", "/scan"])
+def test_parse_rejects_undecodable_image(client, path):
+    response = client.post(path, data={'file': upload(b'not an image', 'receipt.jpg')})
+    assert response.status_code == 400
+    message = response.get_json()["message"]
+    assert message == INVALID_IMAGE_MESSAGE
+    assert 'SpooledTemporaryFile' not in message and ' at 0x' not in message
+
+
+def test_parse_rejects_large_body_before_reading_it(client):
+    response = client.post('/parse', data={'file': upload(b'x')},
+                           environ_overrides={'CONTENT_LENGTH': str(main.app.config['MAX_CONTENT_LENGTH'] + 1)})
+    assert response.status_code == 413
+
+
+# ------------------------------------------------------------------------------
+# /parse-batch
+# ------------------------------------------------------------------------------
+def test_parse_batch(client, stub):
+    names = ["synthetic_000", "synthetic_001", "synthetic_002"]
+    files = [upload(receipt_image(stub, name), f'{name}.png') for name in names]
+    files.append(upload(b'text', 'notes.txt'))
+    calls = stub.calls
+
+    response = client.post('/parse-batch', data={'files': files})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["count"] == 4
+    for name, result in zip(names, body["results"]):
+        assert result["filename"] == f'{name}.png'
+        assert result["data"]["summary"]["grand_total"] == EXPECTED[name]["grand_total"]
+    assert body["results"][3]["status"] == "error"
+    # All valid images went to the OCR backend in one batch call
+    assert stub.calls - calls == 1
+
+
+def test_parse_batch_undecodable_image(client, stub):
+    files = [upload(receipt_image(stub, "synthetic_000"), 'a.png'), upload(b'not an image', 'b.jpg')]
+    response = client.post('/parse-batch', data={'files': files})
+    assert response.status_code == 200
+    first, second = response.get_json()["results"]
+    assert first["data"]["summary"]["grand_total"] == EXPECTED["synthetic_000"]["grand_total"]
+    assert second == {"status": "error", "message": INVALID_IMAGE_MESSAGE, "filename": "b.jpg"}
+
+
+def test_parse_batch_per_file_cap(client, stub, monkeypatch):
+    small = receipt_image(stub, "synthetic_000")
+    big = small + b'\0' * 2048
+    monkeypatch.setattr(main, 'PARSE_BATCH_MAX_FILE_BYTES', len(small) + 1024)
+    response = client.post('/parse-batch', data={'files': [upload(small, 'a.png'), upload(big, 'b.png')]})
+    assert response.status_code == 200
+    first, second = response.get_json()["results"]
+    assert first["data"]["summary"]["grand_total"] == EXPECTED["synthetic_000"]["grand_total"]
+    assert second["status"] == "error" and "too large" in second["message"]
+
+
+def test_parse_batch_has_its_own_body_limit(client):
+    above_default = str(main.app.config['MAX_CONTENT_LENGTH'] + 1)
+    response = client.post('/parse-batch', data={'files': [upload(b'x')]},
+                           environ_overrides={'CONTENT_LENGTH': above_default})
+    assert response.status_code != 413
+    response = client.post('/parse-batch', data={'files': [upload(b'x')]},
+                           environ_overrides={'CONTENT_LENGTH': str(main.PARSE_BATCH_MAX_BYTES + 1)})
+    assert response.status_code == 413
+
+
+# ------------------------------------------------------------------------------
+# Async jobs
+# ------------------------------------------------------------------------------
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_async_job(client, stub):
+    response = client.post('/parse?async=1', data={'file': upload(receipt_image(stub, "synthetic_004"))})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()["job_id"])
+    assert job["status"] == "done"
+    assert job["result"]["data"]["summary"]["grand_total"] == EXPECTED["synthetic_004"]["grand_total"]
+
+
+def test_async_full_queue_is_shed_before_the_body_is_read(client, stub, monkeypatch):
+    # No workers: the first job stays queued and fills the queue
+    monkeypatch.setattr(main, 'job_queue', JobQueue(workers=0, max_pending=1))
+    first = client.post('/parse?async=1', data={'file': upload(receipt_image(stub, "synthetic_000"))})
+    assert first.status_code == 202
+
+    # A body that does not parse as multipart: a 429 proves it was never read
+    response = client.post('/scan?async=1', data=b'not multipart',
+                           content_type='multipart/form-data; boundary=missing')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert main.job_queue.stats()["rejected"] == 1
+
+
+def test_unknown_job(client):
+    assert client.get('/jobs/does-not-exist').status_code == 404
+
+
+# ------------------------------------------------------------------------------
+# /metrics
+# ------------------------------------------------------------------------------
+def test_metrics_exposition(client, stub):
+    assert client.post('/parse', data={'file': upload(receipt_image(stub, "synthetic_002"))}).status_code == 200
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+
+    families = [line.split()[2] for line in text.splitlines() if line.startswith('# TYPE ')]
+    assert families, "no metric families"
+    # Prometheus rejects the whole scrape when a family is declared twice
+    assert len(families) == len(set(families))
+    assert any(line.startswith('http_requests_total{') and 'endpoint="/parse"' in line and 'code="200"' in line
+               for line in text.splitlines())
@@ -0,0 +1,129 @@
+# ==============================================================================
+# test_job_queue.py - Callback URL validation and delivery
+# ==============================================================================
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue
+
+PUBLIC_ADDRESS = "93.184.216.34"
+METADATA_ADDRESS = "169.254.169.254"
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((self.path, self.headers["Host"], json.loads(body)))
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), CallbackHandler)
+    httpd.received = []
+    httpd.status = 204
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    """Fake DNS: each lookup returns the next address listed for the hostname"""
+    answers = {}
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in answers:
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        address = answers[host].pop(0) if len(answers[host]) > 1 else answers[host][0]
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port))]
+
+    monkeypatch.setattr(job_queue.socket, "getaddrinfo", getaddrinfo)
+    return answers
+
+
+@pytest.fixture
+def connections(monkeypatch, server):
+    """Record where callbacks connect, and send them all to the local server"""
+    addresses = []
+    real_create_connection = socket.create_connection
+
+    def create_connection(address, *args, **kwargs):
+        addresses.append(address)
+        return real_create_connection(server.server_address, *args, **kwargs)
+
+    monkeypatch.setattr(job_queue.socket, "create_connection", create_connection)
+    return addresses
+
+
+def finished_job(url):
+    return {"job_id": "job-1", "status": "done", "result": {"total": 10}, "callback_url": url}
+
+
+@pytest.mark.parametrize("url, message", [
+    ("ftp://hooks.example.com/x", "absolute http(s) URL"),
+    ("https://hooks.example.com:99999/x", "invalid port"),
+    ("http://127.0.0.1/x", "non-public address"),
+    ("http://[::1]/x", "non-public address"),
+    ("http://10.0.0.8/x", "non-public address"),
+    (f"http://{METADATA_ADDRESS}/latest/meta-data", "non-public address"),
+])
+def test_rejects_unsafe_callback_urls(url, message):
+    assert message in JobQueue().validate_callback_url(url)
+
+
+def test_allowlist_only_accepts_listed_hosts():
+    queue = JobQueue(allowed_callback_hosts=["hooks.internal"])
+    assert queue.validate_callback_url("http://hooks.internal/done") is None
+    assert "not allowed" in queue.validate_callback_url("http://hooks.example.com/done")
+
+
+def test_callback_connects_to_validated_address_with_original_host(resolver, connections, server):
+    # DNS rebinding: the name turns into the metadata address after the check
+    resolver["hooks.example.com"] = [PUBLIC_ADDRESS, METADATA_ADDRESS]
+    queue = JobQueue()
+    queue._jobs["job-1"] = {"status": "done"}
+
+    queue._send_callback(finished_job("http://hooks.example.com:8080/done?id=1"))
+
+    assert connections == [(PUBLIC_ADDRESS, 8080)]
+    path, host, body = server.received[0]
+    assert (path, host) == ("/done?id=1", "hooks.example.com:8080")
+    assert body["result"] == {"total": 10} and "callback_url" not in body
+    assert queue._jobs["job-1"]["callback_status"] == 204
+
+
+def test_callback_to_rebound_private_address_is_skipped(resolver, connections):
+    resolver["hooks.example.com"] = [METADATA_ADDRESS]
+    queue = JobQueue()
+
+    queue._send_callback(finished_job("http://hooks.example.com/done"))
+
+    assert connections == []
+    assert queue.stats()["callbacks_failed"] == 1
+
+
+def test_redirects_are_not_followed(resolver, connections, server):
+    resolver["hooks.example.com"] = [PUBLIC_ADDRESS]
+    server.status = 302
+    queue = JobQueue()
+    queue._jobs["job-1"] = {"status": "done"}
+
+    queue._send_callback(finished_job("http://hooks.example.com/done"))
+
+    assert len(server.received) == 1
+    assert queue._jobs["job-1"]["callback_status"] is None
+    assert queue.stats()["callbacks_failed"] == 1
@@ -0,0 +1,58 @@
+# ==============================================================================
+# test_line_grouping.py - The sweep and numpy engines match the legacy grouping
+# ==============================================================================
+import random
+
+import pytest
+
+from receipt_pipeline import group_lines, _group_lines_legacy, _group_lines_numpy, _group_lines_sweep, np
+
+ENGINES = ['sweep'] + (['numpy'] if np is not None else [])
+
+
+def random_receipt(rng):
+    """Words on jittered rows, with stray tall/flat boxes and shared top edges"""
+    words, boxes = [], []
+    y = rng.randint(0, 40)
+    for row in range(rng.randint(1, 30)):
+        height = rng.randint(8, 40)
+        x = rng.randint(0, 30)
+        for col in range(rng.randint(1, 6)):
+            width = rng.randint(5, 120)
+            jitter = rng.randint(-height // 2, height // 2)
+            top = y + jitter
+            kind = rng.random()
+            if kind < 0.05:
+                bottom = top  # zero height never joins a line
+            elif kind < 0.1:
+                bottom = top + height * rng.randint(3, 10)  # logo / stamp spanning rows
+            else:
+                bottom = top + height + rng.randint(-3, 3)
+            words.append(f"w{row}.{col}")
+            boxes.append([x, top, x + width, bottom])
+            x += width + rng.choice((2, 10, 21, 40))
+        y += rng.randint(0, 2 * height)
+    return words, boxes
+
+
+@pytest.mark.parametrize("seed", range(300))
+@pytest.mark.parametrize("threshold", [0.5, 0.0, 0.9])
+def test_engines_match_legacy(seed, threshold):
+    words, boxes = random_receipt(random.Random(seed))
+    expected = _group_lines_legacy(words, boxes, threshold)
+    for engine in ENGINES:
+        assert group_lines(words, boxes, threshold, engine=engine) == expected, engine
+
+
+@pytest.mark.skipif(np is None, reason="numpy not installed")
+def test_numpy_engine_handles_the_band_itself():
+    words, boxes = random_receipt(random.Random(7))
+    # group_lines() silently falls back to the sweep; check the array path directly
+    lines = _group_lines_numpy(words, boxes, 0.5)
+    assert lines is not None
+    assert lines == _group_lines_sweep(words, boxes, 0.5) == _group_lines_legacy(words, boxes, 0.5)
+
+
+def test_empty_input():
+    for engine in ENGINES + ['legacy']:
+        assert group_lines([], [], engine=engine) == []
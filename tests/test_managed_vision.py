@@ -0,0 +1,158 @@
+# ==============================================================================
+# test_managed_vision.py - Retry, hedging and coalescing against fake_vision_server
+# ==============================================================================
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("grpc")
+pytest.importorskip("google.cloud.vision")
+
+from fake_vision_server import FakeVisionServer
+from managed_vision import (
+    AsyncManagedVisionClient, ManagedVisionClient, VisionCallError, create_async_client, create_client,
+    is_transient,
+)
+from ocr_backends import VisionBackend
+
+WORDS, BOXES = ["TOTAL", "10.000"], [[0, 0, 50, 20], [60, 0, 120, 20]]
+
+# Fast, deterministic defaults; tests override what they exercise
+POLICY = dict(deadline=5.0, attempt_timeout=2.0, max_attempts=4, backoff_base=0.001, backoff_max=0.01)
+
+
+@pytest.fixture
+def vision():
+    servers = []
+
+    def start(**kwargs):
+        server = FakeVisionServer(default=(WORDS, BOXES), **kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def managed_client(server, pool_size=2, **policy):
+    clients = [create_client(endpoint=server.address, insecure=True) for _ in range(pool_size)]
+    return ManagedVisionClient(clients, **dict(POLICY, **policy))
+
+
+def recognize(client, content=b'image'):
+    return VisionBackend(client).recognize(content)
+
+
+# ------------------------------------------------------------------------------
+# Retry and deadlines
+# ------------------------------------------------------------------------------
+def test_retries_transient_failures(vision):
+    server = vision(fail_first=2)
+    client = managed_client(server)
+    assert recognize(client) == (WORDS, BOXES)
+    stats = client.stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (3, 2, 0)
+    assert server.calls == 3
+
+
+def test_gives_up_after_max_attempts(vision):
+    server = vision(fail_first=100)
+    client = managed_client(server, max_attempts=3)
+    with pytest.raises(VisionCallError) as raised:
+        client.document_text_detection(image=client._vision.Image(content=b'image'))
+    assert raised.value.code == 'UNAVAILABLE' and is_transient(raised.value)
+    assert server.calls == 3
+    assert client.stats()["failures"] == 1
+
+
+def test_does_not_retry_permanent_errors(vision):
+    server = vision(fail_first=100, fail_code='INVALID_ARGUMENT')
+    client = managed_client(server)
+    with pytest.raises(Exception):
+        recognize(client)
+    assert server.calls == 1
+
+
+def test_deadline_bounds_the_whole_call(vision):
+    server = vision(latency=1.0)
+    client = managed_client(server, deadline=0.5, attempt_timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(VisionCallError) as raised:
+        client.document_text_detection(image=client._vision.Image(content=b'image'))
+    assert raised.value.code == 'DEADLINE_EXCEEDED'
+    assert time.monotonic() - started < 0.9
+
+
+# ------------------------------------------------------------------------------
+# Hedging
+# ------------------------------------------------------------------------------
+def test_hedged_copy_wins_over_a_slow_attempt(vision):
+    # Only the first call is slow: the hedge sent after 50ms answers first
+    server = vision(latency=lambda call: 1.5 if call == 1 else 0.0)
+    client = managed_client(server, hedge=0.05)
+    started = time.monotonic()
+    assert recognize(client) == (WORDS, BOXES)
+    assert time.monotonic() - started < 1.0
+    stats = client.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_no_hedge_for_fast_attempts(vision):
+    server = vision()
+    client = managed_client(server, hedge=0.5)
+    for _ in range(3):
+        recognize(client)
+    assert client.stats()["hedges"] == 0
+    assert server.calls == 3
+
+
+# ------------------------------------------------------------------------------
+# Coalescing
+# ------------------------------------------------------------------------------
+def test_concurrent_calls_are_coalesced_into_one_batch(vision):
+    server = vision(latency=0.05)
+    images = [f'image-{i}'.encode() for i in range(8)]
+    for i, image in enumerate(images):
+        server.add(image, [f'ITEM{i}'], [[0, 10 * i, 40, 10 * i + 8]])
+    backend = VisionBackend(managed_client(server), coalesce_window=0.3, coalesce_max=16)
+
+    with ThreadPoolExecutor(len(images)) as pool:
+        results = list(pool.map(backend.recognize, images))
+
+    # Every caller gets its own image's result back
+    assert [words for words, _ in results] == [[f'ITEM{i}'] for i in range(len(images))]
+    stats = backend.batcher.stats()
+    assert stats["items"] == len(images)
+    assert server.calls == stats["batches"] < len(images)
+
+
+def test_coalesced_failure_reaches_every_caller(vision):
+    server = vision(fail_first=100, fail_code='INVALID_ARGUMENT')
+    backend = VisionBackend(managed_client(server), coalesce_window=0.2)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(backend.recognize, f'image-{i}'.encode()) for i in range(4)]
+    for future in futures:
+        with pytest.raises(Exception):
+            future.result()
+
+
+# ------------------------------------------------------------------------------
+# asyncio client
+# ------------------------------------------------------------------------------
+def test_async_client_retries(vision):
+    server = vision(fail_first=1, latency=0.05)
+
+    async def run():
+        clients = [create_async_client(endpoint=server.address, insecure=True)]
+        client = AsyncManagedVisionClient(clients, max_inflight=2, **POLICY)
+        image = client._vision.Image(content=b'image')
+        responses = await asyncio.gather(*[client.document_text_detection(image=image) for _ in range(4)])
+        return client.stats(), responses
+
+    stats, responses = asyncio.run(run())
+    assert all(not r.error.message for r in responses)
+    assert stats["calls"] == 4 and stats["retries"] == 1
+    assert server.calls == 5
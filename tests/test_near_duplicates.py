@@ -0,0 +1,79 @@
+# ==============================================================================
+# test_near_duplicates.py - Perceptual-hash index scoping, eviction and expiry
+# ==============================================================================
+import random
+import time
+
+from near_duplicates import NearDuplicateIndex, HASH_BITS
+
+SHA = "cd" * 32
+ALICE = ("vision", "alice")
+BOB = ("vision", "bob")
+
+
+def random_hash(seed):
+    return random.Random(seed).getrandbits(HASH_BITS)
+
+
+def flip_bits(value, count):
+    for bit in range(count):
+        value ^= 1 << (bit * 7)
+    return value
+
+
+def test_close_hash_matches_same_scope_only():
+    index = NearDuplicateIndex(max_distance=16)
+    value = random_hash(1)
+    index.put(SHA, value, {"total": 1}, scope=ALICE)
+
+    key, body, distance, _ = index.lookup(flip_bits(value, 5), scope=ALICE)
+    assert (key, body, distance) == (SHA, {"total": 1}, 5)
+    assert index.lookup(value, scope=BOB) is None
+    assert index.lookup(random_hash(2), scope=ALICE) is None
+
+
+def test_same_bytes_from_two_clients_keep_both_scopes():
+    index = NearDuplicateIndex(max_distance=16)
+    value = random_hash(3)
+    index.put(SHA, value, {"client": "alice"}, scope=ALICE)
+    index.put(SHA, value, {"client": "bob"}, scope=BOB)
+
+    assert index.lookup(value, scope=ALICE)[1] == {"client": "alice"}
+    assert index.lookup(value, scope=BOB)[1] == {"client": "bob"}
+    assert index.stats()["entries"] == 2
+
+
+def test_put_replaces_entry_in_same_scope():
+    index = NearDuplicateIndex(max_distance=16)
+    old, new = random_hash(4), random_hash(5)
+    index.put(SHA, old, {"v": 1}, scope=ALICE)
+    index.put(SHA, new, {"v": 2}, scope=ALICE)
+
+    assert index.lookup(old, scope=ALICE) is None
+    assert index.lookup(new, scope=ALICE)[1] == {"v": 2}
+    assert index.stats()["entries"] == 1
+
+
+def test_least_recently_matched_entry_is_evicted():
+    index = NearDuplicateIndex(max_entries=2, max_distance=16)
+    values = [random_hash(seed) for seed in (6, 7, 8)]
+    index.put("a", values[0], {}, scope=ALICE)
+    index.put("b", values[1], {}, scope=ALICE)
+    assert index.lookup(values[0], scope=ALICE)[0] == "a"  # "b" is now the oldest
+    index.put("c", values[2], {}, scope=ALICE)
+
+    assert index.lookup(values[1], scope=ALICE) is None
+    assert index.lookup(values[0], scope=ALICE)[0] == "a"
+    assert index.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    index = NearDuplicateIndex(max_distance=16, ttl=60)
+    value = random_hash(9)
+    index.put(SHA, value, {}, scope=ALICE)
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+
+    assert index.lookup(value, scope=ALICE) is None
+    assert index.stats()["expired"] == 1
+    assert index.stats()["entries"] == 0
@@ -0,0 +1,75 @@
+# ==============================================================================
+# test_ocr_cache.py - Memory and disk tiers of the OCR result cache
+# ==============================================================================
+import os
+import time
+
+import pytest
+
+from ocr_cache import OCRCache
+
+WORDS, BOXES = ["TOTAL", "10.000"], [[0, 0, 50, 20], [60, 0, 120, 20]]
+KEY = "ab" * 32
+
+
+@pytest.fixture(params=[False, True], ids=["memory", "disk"])
+def cache(request, tmp_path):
+    return OCRCache(disk_dir=str(tmp_path) if request.param else None)
+
+
+def test_round_trip(cache):
+    assert cache.get(KEY) is None
+    cache.put(KEY, WORDS, BOXES)
+    assert cache.get(KEY) == (WORDS, BOXES)
+    assert cache.contains(KEY)
+
+
+def test_payloads_live_in_their_own_namespace(cache, tmp_path):
+    prediction = {"total_amount": {"value": 10.5, "confidence": 0.9}, "supplier_name": {"value": "Kopi"}}
+    cache.put_payload(KEY, 'mindee', prediction)
+    # Same image hash: an OCR lookup must not see the Mindee entry
+    assert cache.get(KEY) is None
+    assert not cache.contains(KEY)
+    assert cache.get_payload(KEY, 'mindee') == prediction
+
+    cache.put(KEY, WORDS, BOXES)
+    assert cache.get(KEY) == (WORDS, BOXES)
+    assert cache.get_payload(KEY, 'mindee') == prediction
+
+    if cache.disk_dir:
+        cache.clear()  # memory only: the next reads come from disk
+        assert cache.get_payload(KEY, 'mindee') == prediction
+        assert cache.get(KEY) == (WORDS, BOXES)
+
+
+def test_disk_bytes_track_rewrites(tmp_path):
+    cache = OCRCache(disk_dir=str(tmp_path))
+    for _ in range(5):
+        cache.put(KEY, WORDS, BOXES)
+    on_disk = sum(f.stat().st_size for f in tmp_path.rglob('*.json'))
+    assert cache._disk_bytes == on_disk
+
+
+def test_contains_honours_ttl_on_disk(tmp_path):
+    cache = OCRCache(ttl=60, disk_dir=str(tmp_path))
+    cache.put(KEY, WORDS, BOXES)
+    cache.clear()
+    assert cache.contains(KEY)
+    path = cache._disk_path(KEY)
+    os.utime(path, (time.time(), time.time() - 120))  # written two minutes ago
+    assert not cache.contains(KEY)
+
+
+def test_disk_eviction_is_least_recently_used(tmp_path):
+    keys = [f"{i:02x}" * 32 for i in range(4)]
+    cache = OCRCache(disk_dir=str(tmp_path))
+    for age, key in enumerate(keys):
+        cache.put(key, WORDS, BOXES)
+        os.utime(cache._disk_path(key), (time.time() - 100 * (age + 1), time.time() - 100 * (age + 1)))
+    cache.clear()
+    assert cache.get(keys[3]) == (WORDS, BOXES)  # oldest write, but just read
+
+    # Budget of three files; eviction goes down to 90% of it, so two files go
+    cache.disk_max_bytes = int(cache._disk_bytes * 0.75)
+    cache._disk_evict()
+    assert [cache.contains(key) for key in keys] == [True, False, False, True]
@@ -0,0 +1,96 @@
+# ==============================================================================
+# upload_buffer.py - Single spooled copy of an uploaded image
+# ==============================================================================
+import io
+import shutil
+import hashlib
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+# Detached copies stay in memory up to this size, then move to a temp file
+SPOOL_MAX_MEMORY = 512 * 1024
+
+
+class UploadBuffer:
+    """An upload that hashing, validation, OCR and Mindee all read in place.
+
+    Werkzeug already spools multipart files into a SpooledTemporaryFile
+    (on disk above 500KB). UploadBuffer wraps that file object instead of
+    calling file.read(), and computes size and SHA-256 in one chunked pass.
+    A full bytes copy is only made by getvalue(), for consumers that need one.
+    """
+
+    def __init__(self, fileobj, owned=False):
+        self._file = fileobj
+        self._owned = owned
+        self._size = None
+        self._sha256 = None
+        self._value = None
+
+    @classmethod
+    def from_bytes(cls, data):
+        # BytesIO shares the bytes object's storage until it is written to
+        return cls(io.BytesIO(data), owned=True)
+
+    @classmethod
+    def from_file_storage(cls, file):
+        """Wrap a werkzeug FileStorage without reading it into memory"""
+        return cls(file.stream)
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._scan()
+        return self._size
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._scan()
+        return self._sha256
+
+    def _scan(self):
+        digest = hashlib.sha256()
+        size = 0
+        f = self.open()
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+        self._size = size
+        self._sha256 = digest.hexdigest()
+        f.seek(0)
+
+    def open(self):
+        """The underlying file object, rewound (shared, not a copy)"""
+        self._file.seek(0)
+        return self._file
+
+    def getvalue(self):
+        """Whole upload as bytes (made once, then reused)"""
+        if self._value is None:
+            if isinstance(self._file, io.BytesIO):
+                self._value = self._file.getvalue()
+            else:
+                self._value = self.open().read()
+        return self._value
+
+    def copy_to(self, dst):
+        """Stream the upload into another file object in chunks"""
+        shutil.copyfileobj(self.open(), dst, CHUNK_SIZE)
+
+    def detach(self):
+        """Copy into a buffer owned by us (survives request teardown, for background jobs)"""
+        spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, mode='w+b')
+        self.copy_to(spooled)
+        copy = UploadBuffer(spooled, owned=True)
+        copy._size = self._size
+        copy._sha256 = self._sha256
+        return copy
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        self._value = None
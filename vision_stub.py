@@ -0,0 +1,110 @@
+# ==============================================================================
+# vision_stub.py - Offline stand-in for vision.ImageAnnotatorClient
+# ==============================================================================
+# Replays recorded OCR output (words + boxes) so the API can be exercised
+# without credentials or network. Fixture files are JSON objects:
+#   {"image_sha256": "<hex digest of the image bytes>", "words": [...], "boxes": [[x0, y0, x1, y1], ...]}
+# Fixtures without image_sha256 are keyed by their file name (without .json).
+import os
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+
+
+def load_fixture(path):
+    """Read one words/boxes fixture file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    return payload.get("words", []), payload.get("boxes", []), payload
+
+
+def save_fixture(path, words, boxes, image_sha256=None, **extra):
+    """Write one words/boxes fixture file (extra keys, e.g. expected results, are kept)"""
+    payload = {"words": list(words), "boxes": [list(b) for b in boxes]}
+    if image_sha256:
+        payload["image_sha256"] = image_sha256
+    payload.update(extra)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+
+def annotation_from_words(words, boxes, error_message=""):
+    """Build an object shaped like AnnotateImageResponse from words/boxes"""
+    vision_words = []
+    for text, (x0, y0, x1, y1) in zip(words, boxes):
+        vertices = [
+            SimpleNamespace(x=x0, y=y0),
+            SimpleNamespace(x=x1, y=y0),
+            SimpleNamespace(x=x1, y=y1),
+            SimpleNamespace(x=x0, y=y1),
+        ]
+        vision_words.append(SimpleNamespace(
+            symbols=[SimpleNamespace(text=ch) for ch in text],
+            bounding_box=SimpleNamespace(vertices=vertices),
+        ))
+
+    paragraph = SimpleNamespace(words=vision_words)
+    page = SimpleNamespace(blocks=[SimpleNamespace(paragraphs=[paragraph])])
+    return SimpleNamespace(
+        error=SimpleNamespace(message=error_message),
+        full_text_annotation=SimpleNamespace(pages=[page] if vision_words else []),
+    )
+
+
+class StubVisionClient:
+    """Serves document_text_detection / batch_annotate_images from fixtures.
+
+    Images are looked up by the SHA-256 of their bytes; unknown images get
+    `default` (a (words, boxes) tuple) or an empty annotation. `latency`
+    seconds are slept per call, to mimic the round trip to the API.
+    """
+
+    # Fixtures are keyed by the uploaded bytes, so callers must not re-encode
+    # images before sending them here
+    replays_original_bytes = True
+
+    def __init__(self, fixtures=None, default=None, latency=0.0):
+        self.fixtures = dict(fixtures or {})
+        self.default = default
+        self.latency = latency
+        self.calls = 0
+        self.images = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dir(cls, path):
+        fixtures = {}
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.json'):
+                continue
+            words, boxes, payload = load_fixture(os.path.join(path, name))
+            key = payload.get("image_sha256") or name[:-len('.json')]
+            fixtures[key] = (words, boxes)
+        return cls(fixtures)
+
+    def add(self, image_bytes, words, boxes):
+        self.fixtures[hashlib.sha256(image_bytes).hexdigest()] = (words, boxes)
+
+    def document_text_detection(self, image, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.images += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._annotate(image.content)
+
+    def batch_annotate_images(self, requests, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.images += len(requests)
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleNamespace(responses=[self._annotate(r.image.content) for r in requests])
+
+    def _annotate(self, content):
+        found = self.fixtures.get(hashlib.sha256(bytes(content)).hexdigest(), self.default)
+        if found is None:
+            return annotation_from_words([], [])
+        return annotation_from_words(*found)